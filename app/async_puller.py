@@ -0,0 +1,239 @@
+"""
+Asyncio puller of new twitts, many accounts synced by one worker process.
+
+Sync of account same as TwitterPuller.pull_data, but twitter API called
+by httpx with bearer token and DB by Motor, so waits of all accounts
+share one event loop. Calls of all workers limited by one bucket in REDIS.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+import httpx
+from pymongo.errors import BulkWriteError
+
+from app import database, leases, progress
+from app.config import with_settings
+from app.database import DUPLICATE_KEY_ERROR
+from app.limits import acquire_async, TTL, TWITTER_LIMITS
+from app.models import InternalError, RateLimited
+from app.puller import TIMELINE_PAGE_SIZE, twitt_from_json, update_velocity
+
+log = logging.getLogger(__name__)
+
+API_URL = "https://api.twitter.com/1.1/"
+
+
+class AsyncTwitterPuller:
+    """
+    Class for pull new twitts of many accounts concurrently.
+    Use in one event loop:
+        async with AsyncTwitterPuller() as puller:
+            await puller.pull_many(user_ids)
+    """
+
+    @with_settings
+    def __init__(self, settings=None):
+        if not settings.API_BEARER_TOKEN:
+            log.error("API_BEARER_TOKEN not set, async puller not available.")
+            raise InternalError
+        self.settings = settings
+        self.http = httpx.AsyncClient(
+            base_url=API_URL,
+            headers={"Authorization": f"Bearer {settings.API_BEARER_TOKEN}"},
+            timeout=settings.ASYNC_PULL_TIMEOUT,
+        )
+        self.mongo, self.cash_server = database.create_async_clients()
+        self.storage = self.mongo.twitter
+        self.twitts = self.mongo.twitter_data.twitts
+        self.semaphore = asyncio.Semaphore(settings.ASYNC_PULL_CONCURRENCY)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.http.aclose()
+        await self.cash_server.close()
+        self.mongo.close()
+
+    async def _get_twitts(
+        self,
+        user_id: int,
+        since_id: Optional[int] = None,
+        max_id: Optional[int] = None,
+    ) -> list[dict]:
+        """
+        Return page of user timeline, newest first.
+        https://developer.twitter.com/en/docs/twitter-api/v1/tweets/timelines/api-reference/get-statuses-user_timeline
+        :param user_id:
+        :param since_id:
+        :param max_id:
+        :return:
+        """
+        wait = await acquire_async(self.cash_server, "twitts")
+        if wait:
+            raise RateLimited(wait)
+
+        params = {"user_id": user_id, "count": TIMELINE_PAGE_SIZE}
+        if since_id:
+            params["since_id"] = since_id
+        if max_id:
+            params["max_id"] = max_id
+        response = await self.http.get("statuses/user_timeline.json", params=params)
+        if response.status_code == 429:
+            raise RateLimited(TTL / TWITTER_LIMITS["twitts"])
+        response.raise_for_status()
+        return response.json()
+
+    async def _save_twitts(self, twitts: list) -> int:
+        """
+        Save new twitts, twitts already in DB skipped by unique index on twitt id.
+        Index of known twitts in REDIS not changed, it can miss saved twitts.
+        :param twitts: documents for collection of twitts
+        :return: count of saved twitts
+        """
+        try:
+            result = await self.twitts.insert_many(twitts, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as error:
+            errors = error.details["writeErrors"]
+            if any(_error["code"] != DUPLICATE_KEY_ERROR for _error in errors):
+                raise
+            return error.details["nInserted"]
+
+    async def _set_updated(self, account: dict) -> None:
+        """
+        Mark sync of account finished, in account and in all sessions.
+        :param account:
+        """
+        await self.storage.accounts.update_one(
+            {"_id": account["_id"]},
+            {"$set": {"status": progress.STATUS_UPDATED}},
+        )
+        await progress.set_accounts_status_async(
+            self.storage.tasks,
+            [account["username"]],
+            progress.STATUS_UPDATED,
+            self.cash_server,
+        )
+
+    async def pull_data(self, user_id: int) -> int:
+        """
+        Download new user twitts from twitter timeline.
+        If limits over, progress saved in pull_cursor and sync resumed on retry.
+        :param user_id:
+        :return: count of saved twitts
+        """
+        user_id = int(user_id)
+        lease = leases.pull_lease(user_id)
+        ttl = self.settings.LEASE_PULL_TTL
+        token = await asyncio.to_thread(leases.acquire, lease, ttl)
+        if not token:
+            log.info("User %s pulled by other worker.", user_id)
+            return 0
+        try:
+            account, saved = await self._pull_new_twitts(user_id)
+        finally:
+            await asyncio.to_thread(leases.release, lease, token)
+
+        if not account:
+            return saved
+        if not (account.get("backfill") or {}).get("done"):
+            from app.celery_twitter import add_scrapper_task
+
+            await asyncio.to_thread(add_scrapper_task.delay, account["username"])
+        else:
+            await self._set_updated(account)
+        return saved
+
+    async def _pull_new_twitts(self, user_id: int) -> tuple[dict, int]:
+        """
+        Save twitts from newest to last_twitt_id of account.
+        :param user_id:
+        :return: account before sync and count of saved twitts
+        """
+        _filter = {"twitter_id": user_id}
+        account = await self.storage.accounts.find_one(_filter) or {}
+        since_id = account.get("last_twitt_id")
+        cursor = account.get("pull_cursor") or {}
+        max_id = cursor.get("max_id")
+        newest_id = cursor.get("newest_id") or since_id
+
+        saved = 0
+        try:
+            while True:
+                page = await self._get_twitts(user_id, since_id=since_id, max_id=max_id)
+                if not page:
+                    break
+                saved += await self._save_twitts([twitt_from_json(t) for t in page])
+                page_ids = [twitt["id"] for twitt in page]
+                newest_id = max(newest_id or 0, *page_ids)
+                max_id = min(page_ids) - 1
+        except RateLimited:
+            cursor = {"max_id": max_id, "newest_id": newest_id}
+            await self.storage.accounts.update_one(
+                _filter, {"$set": {"pull_cursor": cursor}}
+            )
+            raise
+
+        now = datetime.utcnow()
+        data = {"last_twitt_id": newest_id, "synced_at": now}
+        if account.get("synced_at"):
+            hours = max((now - account["synced_at"]).total_seconds() / 3600, 1 / 60)
+            data["velocity"] = update_velocity(account.get("velocity"), saved, hours)
+        await self.storage.accounts.update_one(
+            _filter,
+            {"$set": data, "$unset": {"pull_cursor": ""}},
+        )
+        return account, saved
+
+    async def _pull(self, user_id: int) -> int:
+        async with self.semaphore:
+            return await self.pull_data(user_id)
+
+    async def pull_many(self, user_ids: list[int]) -> int:
+        """
+        Pull new twitts of accounts concurrently, up to ASYNC_PULL_CONCURRENCY
+        accounts at once. Raise RateLimited with not synced accounts in pending.
+        :param user_ids:
+        :return: count of saved twitts
+        """
+        started = time.monotonic()
+        results = await asyncio.gather(
+            *(self._pull(user_id) for user_id in user_ids),
+            return_exceptions=True,
+        )
+        elapsed = time.monotonic() - started
+
+        saved, pending, wait = 0, [], 0
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, RateLimited):
+                pending.append(user_id)
+                wait = max(wait, result.retry_after)
+            elif isinstance(result, BaseException):
+                log.error("Error in async pull of user %s: %r", user_id, result)
+            else:
+                saved += result
+        synced = len(user_ids) - len(pending)
+        log.info(
+            "Async pull: %s accounts, %s twitts in %.1f s (%.2f accounts/s).",
+            synced,
+            saved,
+            elapsed,
+            synced / elapsed if elapsed else 0,
+        )
+        if pending:
+            raise RateLimited(wait, pending=pending)
+        return saved
+
+
+async def pull_batch(user_ids: list[int]) -> int:
+    """
+    Pull new twitts of accounts by new async puller in current event loop.
+    :param user_ids:
+    :return: count of saved twitts
+    """
+    async with AsyncTwitterPuller() as puller:
+        return await puller.pull_many(user_ids)
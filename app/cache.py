@@ -0,0 +1,225 @@
+"""
+Redis read-through cache for data from Mongo
+"""
+import logging
+import uuid
+from typing import Any, Iterable
+
+from bson import json_util
+from pymongo.collection import Collection
+from redis.exceptions import RedisError
+
+from app import database
+from app.config import with_settings
+
+log = logging.getLogger(__name__)
+
+# Marker for "nothing in cache", None is a valid cached value (user not found)
+NOT_CACHED = object()
+
+# time to live of version keys, must be longer than any account TTL
+VERSION_TTL: int = 24 * 60 * 60
+
+# ids of twitts loaded from Mongo to index of known twitts at once
+KNOWN_TWITTS_BATCH_SIZE = 5000
+
+# Write account to cache only if nobody invalidate it after our read
+_SET_IF_VERSION = """
+local version = redis.call("GET", KEYS[2])
+if (version or "") == ARGV[1] then
+    redis.call("SET", KEYS[1], ARGV[2], "EX", ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Add ids only to loaded index, expired index must be loaded from Mongo again
+_ADD_IF_EXISTS = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    -- by one id, unpack of many ids overflow stack of Lua
+    for i = 2, #ARGV do
+        redis.call("SADD", KEYS[1], ARGV[i])
+    end
+    redis.call("EXPIRE", KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+def _account_key(username: str) -> str:
+    return f"account:{username}"
+
+
+def _account_version_key(username: str) -> str:
+    return f"account:version:{username}"
+
+
+def lookup_account(username: str) -> tuple[Any, str]:
+    """
+    Return cached account (or None for cached miss) and version of cache entry.
+    If account not in cache return NOT_CACHED.
+    :param username:
+    :return: (account, version)
+    """
+    try:
+        value, version = database.cash_server.mget(
+            _account_key(username),
+            _account_version_key(username),
+        )
+    except RedisError:
+        log.warning("Cache not available.")
+        return NOT_CACHED, ""
+
+    version = version.decode() if version else ""
+    if value is None:
+        return NOT_CACHED, version
+    return json_util.loads(value), version
+
+
+@with_settings
+def store_account(
+    username: str,
+    account: Any,
+    version: str,
+    settings=None,
+) -> None:
+    """
+    Save account to cache, None saved as negative result with short TTL.
+    :param username:
+    :param account: document from Mongo or None
+    :param version: version from lookup_account
+    """
+    if account:
+        ttl = settings.ACCOUNT_CACHE_TTL
+    else:
+        ttl = settings.ACCOUNT_CACHE_MISS_TTL
+    if ttl <= 0:
+        return
+
+    try:
+        database.cash_server.register_script(_SET_IF_VERSION)(
+            keys=[_account_key(username), _account_version_key(username)],
+            args=[version, json_util.dumps(account), ttl],
+        )
+    except RedisError:
+        log.warning("Cache not available.")
+
+
+def invalidate_accounts(usernames: Iterable[str]) -> None:
+    """
+    Remove accounts from cache and bump versions
+    so running read-through requests dont write old data back.
+    :param usernames:
+    """
+    usernames = set(usernames)
+    if not usernames:
+        return
+
+    try:
+        pipe = database.cash_server.pipeline(transaction=False)
+        for username in usernames:
+            pipe.delete(_account_key(username))
+            pipe.incr(_account_version_key(username))
+            pipe.expire(_account_version_key(username), VERSION_TTL)
+        pipe.execute()
+    except RedisError:
+        log.error("Cache not available, accounts not invalidated: %s", usernames)
+
+
+def _known_twitts_key(author_id: int) -> str:
+    return f"twitts:known:{author_id}"
+
+
+def _load_known_twitts(author_id: int, collection: Collection, ttl: int) -> None:
+    """
+    Fill index of known twitts from Mongo by batches of ids.
+    Query covered by index (author_id, id), twitts dont come to app.
+    Index renamed to its key with TTL only when all ids loaded.
+    :param author_id:
+    :param collection: collection of twitts
+    :param ttl:
+    """
+    key = _known_twitts_key(author_id)
+    # index filled under temporary key, partial index never visible by key
+    loading_key = f"{key}:loading:{uuid.uuid4().hex}"
+    cursor = collection.find(
+        {"author_id": author_id},
+        {"_id": 0, "id": 1},
+        batch_size=KNOWN_TWITTS_BATCH_SIZE,
+    )
+    loaded = False
+    ids = []
+    try:
+        for twitt in cursor:
+            ids.append(twitt["id"])
+            if len(ids) == KNOWN_TWITTS_BATCH_SIZE:
+                database.cash_server.sadd(loading_key, *ids)
+                database.cash_server.expire(loading_key, ttl)
+                ids.clear()
+                loaded = True
+        if ids:
+            database.cash_server.sadd(loading_key, *ids)
+            loaded = True
+        if not loaded:
+            return
+        pipe = database.cash_server.pipeline(transaction=True)
+        pipe.expire(loading_key, ttl)
+        pipe.rename(loading_key, key)
+        pipe.execute()
+    except BaseException:
+        try:
+            database.cash_server.delete(loading_key)
+        except RedisError:
+            pass
+        raise
+
+
+@with_settings
+def known_twitts(
+    author_id: int,
+    ids: list[int],
+    collection: Collection,
+    settings=None,
+) -> set[int]:
+    """
+    Return ids of twitts already saved in Mongo, by index of known twitts in REDIS.
+    Index loaded from Mongo once for author, if REDIS not available return empty set.
+    :param author_id:
+    :param ids: ids of twitts for check
+    :param collection: collection of twitts for load index
+    :return:
+    """
+    if not ids:
+        return set()
+
+    key = _known_twitts_key(author_id)
+    try:
+        if not database.cash_server.exists(key):
+            _load_known_twitts(author_id, collection, settings.KNOWN_TWITTS_TTL)
+        flags = database.cash_server.smismember(key, ids)
+    except RedisError:
+        log.warning("Cache not available, known twitts not checked.")
+        return set()
+    return {_id for _id, flag in zip(ids, flags) if flag}
+
+
+@with_settings
+def add_known_twitts(author_id: int, ids: list[int], settings=None) -> None:
+    """
+    Add ids of saved twitts to index of known twitts.
+    Call only after twitts saved, index must not have twitts not saved to Mongo.
+    If index not loaded (or expired) nothing added, it loaded from Mongo on next check.
+    :param author_id:
+    :param ids:
+    """
+    if not ids:
+        return
+
+    try:
+        database.cash_server.register_script(_ADD_IF_EXISTS)(
+            keys=[_known_twitts_key(author_id)],
+            args=[settings.KNOWN_TWITTS_TTL, *ids],
+        )
+    except RedisError:
+        log.warning("Cache not available, known twitts not updated.")
@@ -1,21 +1,49 @@
 """
 Celery tasks for pull data from twitter
 """
+import asyncio
 import logging
-from typing import Union
+from typing import Optional, Union
 
-# from celery.schedules import crontab
+from celery.signals import worker_process_init, worker_process_shutdown
 
-from app.puller import TwitterPuller
+from app import database, metrics, webhooks
+from app.config import get_settings
+from app.async_puller import pull_batch
+from app.puller import TwitterPuller, batched
 from app.connections import get_celery
-from app.models import TaskFaled
+from app.models import InternalError, TaskFaled, RateLimited, WebhookFailed
 
 log = logging.getLogger(__name__)
 
 celery = get_celery()
 
+# priority of scheduled sync, lower than sync from new sessions
+SCHEDULED_PRIORITY = 6
 
-@celery.task(name="create_task")
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """
+    Connect to Mongo and REDIS and prepare Mongo collections
+    before worker start tasks.
+    """
+    database.connect_sync()
+    try:
+        database.create_indexes(database.s_db_data, database.sync_client.twitter)
+    except BaseException:
+        log.error("Indexes not created, Mongo not available.")
+
+
+@worker_process_shutdown.connect
+def close_worker_process(**kwargs):
+    """
+    Close connections of worker process.
+    """
+    database.close_sync()
+
+
+@celery.task(name="create_task", bind=True, max_retries=None)
 def create_task(self, users_list: Union[set, list]):
     """
     Start sync users from list
@@ -26,16 +54,23 @@ def create_task(self, users_list: Union[set, list]):
     try:
         puller = TwitterPuller()
         puller.get_users_data(users_list)
-    except TaskFaled:
+    except RateLimited as error:
+        raise self.retry(
+            args=[error.pending or users_list],
+            countdown=error.retry_after,
+        )
+    except TaskFaled as error:
+        metrics.count_error(self, error)
         log.error("Task was panding.. for users: %s", users_list)
-    except BaseException:
+    except BaseException as error:
+        metrics.count_error(self, error)
         log.error(
             "Error in task `create task` with params: %s",
             users_list,
         )
 
 
-@celery.task(name="start_pull_from_twitter")
+@celery.task(name="start_pull_from_twitter", bind=True, max_retries=None)
 def start_pull_from_twitter(self, user_id):
     """
     Pull top twitts by user_id and save to DB
@@ -45,54 +80,132 @@ def start_pull_from_twitter(self, user_id):
     try:
         puller = TwitterPuller()
         puller.pull_data(user_id)
-    except TaskFaled:
+    except RateLimited as error:
+        raise self.retry(countdown=error.retry_after)
+    except TaskFaled as error:
+        metrics.count_error(self, error)
         log.error("Task was panding.. for user: %s", user_id)
-    except BaseException:
+    except BaseException as error:
+        metrics.count_error(self, error)
         log.error(
             "Error in task `start_pull_from_twitter` with params: %s",
             user_id,
         )
 
 
-@celery.task(name="add_scrapper_task")
-def add_scrapper_task(username):
+@celery.task(name="pull_batch_async", bind=True, max_retries=None)
+def pull_batch_async(self, user_ids: list):
+    """
+    Pull new twitts of many accounts concurrently in one process.
+    :param self: For repiat celery task
+    :param user_ids:
+    """
+    try:
+        asyncio.run(pull_batch(user_ids))
+    except RateLimited as error:
+        raise self.retry(args=[error.pending], countdown=error.retry_after)
+    except InternalError:
+        # async puller not configured, sync accounts one by one
+        for user_id in user_ids:
+            start_pull_from_twitter.apply_async(
+                args=[user_id], priority=SCHEDULED_PRIORITY
+            )
+    except BaseException as error:
+        metrics.count_error(self, error)
+        log.error(
+            "Error in task `pull_batch_async` with params: %s",
+            user_ids,
+        )
+
+
+@celery.task(name="add_scrapper_task", bind=True, max_retries=5, acks_late=True)
+def add_scrapper_task(self, username, lease_token=None):
     """
-    Scrap all user twitts.
+    Scrap chunk of user twitts, next chunk started by new task.
+    On fail task restarted from saved checkpoint.
+    :param self: For repiat celery task
     :param username:
+    :param lease_token: lease of backfill from previous chunk
     """
     try:
         puller = TwitterPuller()
-        puller.scrap_user_data(username)
+        puller.scrap_user_data(
+            username,
+            max_batches=get_settings().BACKFILL_CHUNK_BATCHES,
+            lease_token=lease_token,
+        )
     except TaskFaled:
         log.error("Task was panding.. for user: %s", username)
-    except BaseException:
+        raise self.retry(countdown=60 * 2**self.request.retries)
+    except BaseException as error:
+        metrics.count_error(self, error)
         log.error(
             "Error in task `add_scrapper_task` with params: %s",
             username,
         )
 
 
-@celery.task(name="update user`s data")
-def update_user_data(self):
+@celery.task(
+    name="deliver_webhook",
+    bind=True,
+    max_retries=get_settings().WEBHOOK_MAX_RETRIES,
+)
+def deliver_webhook(self, session_id: str, usernames: Optional[list] = None):
     """
-    Update every 15 minutes user data.
+    Post progress of session to callback url, on fail retried with backoff.
     :param self: For repiat celery task
-    :return:
+    :param session_id:
+    :param usernames: changed users, on first run taken from REDIS
     """
+    if usernames is None:
+        usernames = webhooks.pop_changed_users(session_id)
     try:
-        pass
-    except BaseException:
+        webhooks.deliver(session_id, usernames)
+    except WebhookFailed:
+        raise self.retry(
+            args=[session_id, usernames],
+            countdown=10 * 2**self.request.retries,
+        )
+    except BaseException as error:
+        metrics.count_error(self, error)
         log.error(
-            "Error in task `add_scrapper_task` with params: %s",
-            "",
+            "Error in task `deliver_webhook` with params: %s",
+            session_id,
         )
-    update_user_data.retry()
 
 
-# TODO add schedule for update user data from twitter
-# celery.conf.beat_schedule = {
-#     "trigger-email-notifications": {
-#         "task": "app.update_user_data",
-#         "schedule": crontab(minute="0", hour="0", day="*")
-#     }
-# }
+@celery.task(name="update user`s data", bind=True)
+def update_user_data(self):
+    """
+    Send to queue sync of accounts with most expected new twitts,
+    run by beat every SCHEDULER_INTERVAL seconds.
+    :param self: For repiat celery task
+    :return:
+    """
+    try:
+        puller = TwitterPuller()
+        user_ids = puller.schedule_updates()
+    except BaseException as error:
+        metrics.count_error(self, error)
+        log.error("Error in task `update_user_data`, accounts not scheduled.")
+        return
+    settings = get_settings()
+    if settings.ASYNC_PULLER:
+        for batch in batched(user_ids, settings.ASYNC_PULL_BATCH_SIZE):
+            pull_batch_async.delay(batch)
+    else:
+        for user_id in user_ids:
+            # new sessions go first
+            start_pull_from_twitter.apply_async(
+                args=[user_id], priority=SCHEDULED_PRIORITY
+            )
+    if user_ids:
+        log.info("Scheduled sync of %s accounts.", len(user_ids))
+
+
+celery.conf.beat_schedule = {
+    "update-user-data": {
+        "task": "update user`s data",
+        "schedule": get_settings().SCHEDULER_INTERVAL,
+    }
+}
@@ -16,7 +16,8 @@ settings = get_settings()
 try:
     auth = tweepy.OAuthHandler(settings.API_KEY, settings.API_SECRET_KEY)
     auth.set_access_token(settings.API_ACCESS_TOKEN, settings.API_ACCESS_TOKEN_SECRET)
-    _connection_to_twitter = tweepy.API(auth, wait_on_rate_limit=True)
+    # on limits of twitter task rescheduled by RateLimited, worker not sleep
+    _connection_to_twitter = tweepy.API(auth, wait_on_rate_limit=False)
 except BaseException:
     log.error("Some error with twitter connection..")
 
@@ -29,6 +30,27 @@ def get_api():
     return _connection_to_twitter
 
 
+# Queues of tasks, workers of every queue scaled separately:
+#     celery -A app.celery_twitter worker -Q interactive --concurrency=4
+# interactive - lookup of users from new sessions, users wait for it
+# sync - pull of new twitts
+# backfill - scrap of old twitts by chunks
+# webhooks - delivery of progress to callback urls
+QUEUE_INTERACTIVE = "interactive"
+QUEUE_SYNC = "sync"
+QUEUE_BACKFILL = "backfill"
+QUEUE_WEBHOOKS = "webhooks"
+
+# priority of message in queue, 0 is highest
+TASK_ROUTES = {
+    "create_task": {"queue": QUEUE_INTERACTIVE, "priority": 0},
+    "start_pull_from_twitter": {"queue": QUEUE_SYNC, "priority": 3},
+    "pull_batch_async": {"queue": QUEUE_SYNC, "priority": 6},
+    "update user`s data": {"queue": QUEUE_SYNC, "priority": 6},
+    "add_scrapper_task": {"queue": QUEUE_BACKFILL, "priority": 6},
+    "deliver_webhook": {"queue": QUEUE_WEBHOOKS, "priority": 3},
+}
+
 try:
     _celery_broker_url = (
         f"redis://{settings.CELERY_BROKER_HOST}:{settings.CELERY_BROKER_PORT}"
@@ -36,6 +58,16 @@ try:
     _celery = Celery(__name__)
     _celery.conf.broker_url = _celery_broker_url
     _celery.conf.result_backend = _celery_broker_url
+    _celery.conf.task_routes = TASK_ROUTES
+    _celery.conf.task_default_queue = QUEUE_SYNC
+    # REDIS has no priority queues, celery split every queue by priority
+    _celery.conf.broker_transport_options = {
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    }
+    # worker dont reserve long tasks while short tasks wait
+    _celery.conf.worker_prefetch_multiplier = 1
 except BaseException:
     log.error("Error connection to redis!")
 
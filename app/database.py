@@ -1,45 +1,258 @@
 """
 File for connection to Mongo and REDIS
+
+Clients not created on import: API create clients on startup (connect),
+workers in every process after fork (connect_sync), other code on first
+use of database.a_db, database.sync_client, database.cash_server etc.
 """
+import asyncio
 import logging
+import threading
+import time
+from typing import Any, Optional
 
 import motor.motor_asyncio
 import redis
-from pymongo import MongoClient
-from app.config import get_settings
+import redis.asyncio
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.collation import Collation
+from pymongo.database import Database
+from pymongo.errors import OperationFailure, PyMongoError
+from pymongo.read_preferences import SecondaryPreferred
+from redis.exceptions import RedisError
+
+from app.config import Settings, get_settings, with_settings
+from app.metrics import MongoCommandListener
 
 log = logging.getLogger()
 
-_config = get_settings()
+# code of error from Mongo for insert of not unique value
+DUPLICATE_KEY_ERROR = 11000
+
+# usernames in twitter are case insensitive
+USERNAME_COLLATION = Collation(locale="en", strength=2)
+
+
+def create_indexes(db_data: Database, db: Optional[Database] = None) -> None:
+    """
+    Create indexes for collections, do nothing if indexes exist.
+    :param db_data: sync database with twitts
+    :param db: sync database with accounts and sessions
+    """
+    if db is not None:
+        # for update status of user in all sessions
+        db.tasks.create_index("users.username", name="users_username")
+        # for find accounts by names in any case
+        db.accounts.create_index(
+            "username", name="username_ci", collation=USERNAME_COLLATION
+        )
+        # for find and upsert accounts by lowercase names, queries without collation
+        db.accounts.create_index("username", name="username")
+        # for pulls of accounts by id and checkpoints of pulls
+        db.accounts.create_index("twitter_id", name="twitter_id")
+        # for choose accounts for scheduled sync
+        db.accounts.create_index(
+            [("backfill.done", ASCENDING), ("synced_at", ASCENDING)],
+            name="backfill_done_synced_at",
+        )
+
+    # all twitts stored in one collection, newest first for every author
+    db_data.twitts.create_index(
+        [("author_id", ASCENDING), ("id", DESCENDING)],
+        name="author_id_twitt_id",
+    )
+    try:
+        db_data.twitts.create_index("id", unique=True, name="twitt_id")
+    except OperationFailure as error:
+        if error.code != DUPLICATE_KEY_ERROR:
+            raise
+        log.error("Twitts have duplicates, run: python -m app.migrations dedup")
+
+
+def _mongo_options(settings: Settings, client: str) -> dict:
+    timeout = int(settings.MONGO_TIMEOUT * 1000)
+    options = dict(
+        host=settings.MONGO_HOST or "localhost",
+        port=settings.MONGO_PORT or 27017,
+        maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+        minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+        connectTimeoutMS=timeout,
+        serverSelectionTimeoutMS=timeout,
+        readPreference=settings.MONGO_READ_PREFERENCE,
+        event_listeners=[MongoCommandListener(client)],
+    )
+    if settings.MONGO_REPLICA_SET:
+        options["replicaSet"] = settings.MONGO_REPLICA_SET
+    return options
+
+
+@with_settings
+def for_reads(db: Any, settings=None) -> Any:
+    """
+    Return database for reads, which can be stale for a short time:
+    secondary of replica set not older than MONGO_MAX_STALENESS seconds
+    or primary if no such secondary. Reads after own writes use db itself.
+        await database.for_reads(database.a_db).accounts.find_one(query)
+    :param db: database of sync or async client
+    :return:
+    """
+    if not settings.MONGO_SECONDARY_READS:
+        return db
+    preference = SecondaryPreferred(max_staleness=settings.MONGO_MAX_STALENESS)
+    return db.with_options(read_preference=preference)
+
+
+def _redis_options(settings: Settings) -> dict:
+    return dict(
+        host=settings.REDIS_HOST or "localhost",
+        port=settings.REDIS_PORT or 6379,
+        db=0,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        socket_timeout=settings.REDIS_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_TIMEOUT,
+    )
+
+
+# clients created on first use, database.a_db, database.cash_server,
+# sync clients for workers, async clients for API
+_CLIENTS = {
+    "async_client": lambda settings: motor.motor_asyncio.AsyncIOMotorClient(
+        **_mongo_options(settings, "motor")
+    ),
+    "sync_client": lambda settings: MongoClient(**_mongo_options(settings, "pymongo")),
+    "cash_server": lambda settings: redis.Redis(**_redis_options(settings)),
+    # for API only, events of sync progress
+    "a_cash_server": lambda settings: redis.asyncio.Redis(**_redis_options(settings)),
+}
+_DATABASES = {
+    "a_db": ("async_client", "twitter"),
+    "a_db_data": ("async_client", "twitter_data"),
+    "s_db_data": ("sync_client", "twitter_data"),
+}
+_lock = threading.RLock()
+
 
-_mongo_host = _config.MONGO_HOST if _config.MONGO_HOST else "localhost"
-_mongo_port = _config.MONGO_PORT if _config.MONGO_PORT else 27017
+def _get(name: str) -> Any:
+    """
+    Return client or database, create it on first use.
+    :param name: name of attribute of module
+    :return:
+    """
+    with _lock:
+        if name not in globals():
+            if name in _DATABASES:
+                client, database = _DATABASES[name]
+                globals()[name] = _get(client)[database]
+            else:
+                globals()[name] = _CLIENTS[name](get_settings())
+        return globals()[name]
 
-async_client = motor.motor_asyncio.AsyncIOMotorClient(_mongo_host, _mongo_port)
-a_db = async_client.twitter
-a_db_data = async_client.twitter_data
 
-sync_client = MongoClient(host=_mongo_host, port=_mongo_port)
-s_db_data = sync_client.twitter_data
+def __getattr__(name: str) -> Any:
+    if name in _CLIENTS or name in _DATABASES:
+        return _get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-def _create_ts_for_limist(_connection):
-    # create time sirieses for count calls to twitter
+def _reset() -> list:
+    """
+    Forget created clients, next use create new clients.
+    :return: forgotten clients
+    """
+    with _lock:
+        for name in _DATABASES:
+            globals().pop(name, None)
+        return [globals().pop(name) for name in _CLIENTS if name in globals()]
+
+
+async def check_health() -> dict:
+    """
+    Return state of connections of API for readiness check, like:
+        {"ready": True, "mongo": {"ok": True, "latency_ms": 1.2, ...}, ...}
+    :return:
+    """
+    settings = get_settings()
+    mongo = {
+        "max_pool_size": settings.MONGO_MAX_POOL_SIZE,
+        "min_pool_size": settings.MONGO_MIN_POOL_SIZE,
+    }
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(_get("a_db").command("ping"), settings.MONGO_TIMEOUT)
+        mongo.update(ok=True, latency_ms=(time.monotonic() - started) * 1000)
+    except (PyMongoError, asyncio.TimeoutError) as error:
+        mongo.update(ok=False, error=repr(error))
+
+    server = _get("a_cash_server")
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(server.ping(), settings.REDIS_TIMEOUT)
+        cache = {"ok": True, "latency_ms": (time.monotonic() - started) * 1000}
+    except (RedisError, OSError, asyncio.TimeoutError) as error:
+        cache = {"ok": False, "error": repr(error)}
+    cache["max_connections"] = server.connection_pool.max_connections
+    return {"ready": mongo["ok"] and cache["ok"], "mongo": mongo, "redis": cache}
+
+
+async def connect() -> None:
+    """
+    Create clients of API and open connections before first request.
+    Errors only logged, state of connections in readiness check.
+    """
+    health = await check_health()
+    try:
+        await asyncio.to_thread(_get("cash_server").ping)
+    except RedisError as error:
+        health["ready"] = False
+        log.error("Redis not available: %r", error)
+    if health["ready"]:
+        log.info("Connections ready.")
+    else:
+        log.error("Connections not ready: %s", health)
+
+
+async def close() -> None:
+    """
+    Close clients of API.
+    """
+    for client in _reset():
+        if isinstance(client, redis.asyncio.Redis):
+            await client.close()
+        else:
+            client.close()
+
+
+def connect_sync() -> None:
+    """
+    Create clients of worker process and open connections.
+    Clients of parent process not used after fork, Mongo clients not fork-safe.
+    """
+    _reset()
     try:
-        from app.puller import TWITTER_LIMITS, TTL
-
-        for method in TWITTER_LIMITS.keys():
-            _connection.ts().create(
-                key=f"twitter:{method}",
-                retention_msecs=TTL * 1000,
-                duplicate_policy="SUM",
-            )
-    except BaseException:
-        log.error("Redis not available!")
-
-
-_redis_host = _config.MONGO_HOST if _config.MONGO_HOST else "localhost"
-_redis_port = _config.REDIS_HOST if _config.REDIS_PORT else 6379
-_pool = redis.ConnectionPool(host=_redis_host, port=_redis_port, db=0)
-cash_server = redis.Redis(connection_pool=_pool)
-_create_ts_for_limist(cash_server)
+        _get("sync_client").admin.command("ping")
+        _get("cash_server").ping()
+    except (PyMongoError, RedisError) as error:
+        log.error("Connections of worker not ready: %r", error)
+
+
+def close_sync() -> None:
+    """
+    Close clients of worker process.
+    """
+    for client in _reset():
+        if not isinstance(client, redis.asyncio.Redis):
+            client.close()
+
+
+def create_async_clients() -> (
+    tuple[motor.motor_asyncio.AsyncIOMotorClient, redis.asyncio.Redis]
+):
+    """
+    Return new async clients of Mongo and REDIS for workers.
+    Async clients bound to event loop, every asyncio.run need new clients.
+    :return: (mongo, redis)
+    """
+    settings = get_settings()
+    mongo = motor.motor_asyncio.AsyncIOMotorClient(**_mongo_options(settings, "motor"))
+    server = redis.asyncio.Redis(**_redis_options(settings))
+    return mongo, server
@@ -0,0 +1,145 @@
+"""
+Push of sync progress to API clients.
+
+All clients of one API process share one REDIS pub/sub connection,
+every session channel subscribed once while it has clients.
+"""
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Optional
+
+from redis.exceptions import RedisError
+
+from app import database
+from app.progress import session_channel, is_done
+
+log = logging.getLogger(__name__)
+
+# seconds between comments in idle stream, keep connection through proxies
+HEARTBEAT = 15
+# events waiting for slow client, older events dropped
+QUEUE_SIZE = 100
+
+
+class SessionEvents:
+    """
+    Fan out of events from REDIS channels of sessions to queues of clients.
+    """
+
+    def __init__(self):
+        self._queues: dict[str, set[asyncio.Queue]] = {}
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def subscribe(self, session_id: str) -> asyncio.Queue:
+        """
+        Return queue with events of session.
+        :param session_id:
+        :return:
+        """
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        if session_id not in self._queues:
+            if self._pubsub is None:
+                self._pubsub = database.a_cash_server.pubsub()
+            await self._pubsub.subscribe(session_channel(session_id))
+        self._queues.setdefault(session_id, set()).add(queue)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read())
+        return queue
+
+    async def unsubscribe(self, session_id: str, queue: asyncio.Queue) -> None:
+        """
+        Remove queue of client, unsubscribe channel without clients.
+        :param session_id:
+        :param queue:
+        """
+        queues = self._queues.get(session_id, set())
+        queues.discard(queue)
+        if not queues:
+            self._queues.pop(session_id, None)
+            try:
+                await self._pubsub.unsubscribe(session_channel(session_id))
+            except RedisError:
+                log.warning("Redis not available, channel not unsubscribed.")
+
+    def dispatch(self, channel: str, data: str) -> None:
+        """
+        Put event to queues of all clients of session.
+        :param channel:
+        :param data: JSON with users and counters
+        """
+        session_id = channel.split(":", 1)[1]
+        for queue in self._queues.get(session_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+    async def _read(self) -> None:
+        while self._queues:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except (RedisError, OSError):
+                log.warning("Redis not available, wait events.")
+                await asyncio.sleep(1)
+                continue
+            if message and message["type"] == "message":
+                self.dispatch(message["channel"].decode(), message["data"].decode())
+
+    async def open(self, session_id: str) -> Optional[asyncio.Queue]:
+        """
+        Subscribe to session before read of snapshot, so events
+        published while snapshot is read are in queue.
+        :param session_id:
+        :return: queue for stream, None if REDIS not available
+        """
+        try:
+            return await self.subscribe(session_id)
+        except RedisError:
+            log.warning("Redis not available, events not streamed.")
+            return None
+
+    async def stream(
+        self, session_id: str, snapshot: dict, queue: Optional[asyncio.Queue]
+    ) -> AsyncIterator[bytes]:
+        """
+        Server-Sent Events of session: snapshot of progress, then changes.
+        Stream closed when all users of session have final statuses,
+        if REDIS not available only snapshot sent, client can poll status.
+        :param session_id:
+        :param snapshot: current total and counters of session
+        :param queue: queue from open, taken before snapshot
+        :return:
+        """
+        try:
+            yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n".encode()
+            if queue is None:
+                return
+            done = is_done(snapshot)
+            while not done:
+                try:
+                    data = await asyncio.wait_for(queue.get(), HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                yield f"event: progress\ndata: {data}\n\n".encode()
+                done = is_done(json.loads(data))
+            yield b"event: done\ndata: {}\n\n"
+        finally:
+            if queue is not None:
+                await self.unsubscribe(session_id, queue)
+
+    async def close(self) -> None:
+        """
+        Stop reader and close pub/sub connection.
+        """
+        self._queues.clear()
+        if self._reader:
+            self._reader.cancel()
+        if self._pubsub:
+            await self._pubsub.close()
+
+
+session_events = SessionEvents()
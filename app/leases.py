@@ -0,0 +1,140 @@
+"""
+Leases in REDIS, only one worker sync account at once.
+
+Lease is key with random token of owner and TTL, owner can extend
+lease by token (next chunk of long work) and release it. Work for
+account with lease of other worker skipped: sessions get status of
+account from running work, owner release lease before last update
+of statuses in sessions.
+"""
+import logging
+import uuid
+from typing import Iterable, Optional
+
+from redis.exceptions import RedisError
+
+from app import database
+
+log = logging.getLogger(__name__)
+
+# Take free lease or extend own lease
+_ACQUIRE = """
+local current = redis.call("GET", KEYS[1])
+if (not current) or current == ARGV[1] then
+    redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Remove only own lease, lease can be expired and taken by other worker
+_RELEASE = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+def _lease_key(name: str) -> str:
+    return f"lease:{name}"
+
+
+def acquire_many(
+    names: Iterable[str], ttl: float, token: Optional[str] = None
+) -> tuple[str, list[str]]:
+    """
+    Take leases by one pipeline.
+    If REDIS not available all leases taken, work can be duplicated.
+    :param names: names of leases
+    :param ttl: seconds
+    :param token: token of own leases for extend
+    :return: token and names of taken leases
+    """
+    names = list(names)
+    token = token or uuid.uuid4().hex
+    if not names:
+        return token, []
+    try:
+        script = database.cash_server.register_script(_ACQUIRE)
+        pipe = database.cash_server.pipeline(transaction=False)
+        for name in names:
+            script(keys=[_lease_key(name)], args=[token, int(ttl * 1000)], client=pipe)
+        taken = pipe.execute()
+    except RedisError:
+        log.warning("Redis not available, leases not checked.")
+        return token, names
+    return token, [name for name, flag in zip(names, taken) if flag]
+
+
+def acquire(name: str, ttl: float, token: Optional[str] = None) -> Optional[str]:
+    """
+    Take or extend lease.
+    :param name: name of lease
+    :param ttl: seconds
+    :param token: token of own lease for extend
+    :return: token if lease taken, None if lease of other worker
+    """
+    token, taken = acquire_many([name], ttl, token)
+    return token if taken else None
+
+
+def held_many(names: Iterable[str]) -> set[str]:
+    """
+    Return names of leases held by any worker now.
+    If REDIS not available no leases held.
+    :param names: names of leases
+    :return:
+    """
+    names = list(names)
+    if not names:
+        return set()
+    try:
+        pipe = database.cash_server.pipeline(transaction=False)
+        for name in names:
+            pipe.exists(_lease_key(name))
+        held = pipe.execute()
+    except RedisError:
+        log.warning("Redis not available, leases not checked.")
+        return set()
+    return {name for name, flag in zip(names, held) if flag}
+
+
+def release_many(names: Iterable[str], token: str) -> None:
+    """
+    Release own leases.
+    :param names: names of leases
+    :param token:
+    """
+    names = list(names)
+    if not names:
+        return
+    try:
+        script = database.cash_server.register_script(_RELEASE)
+        pipe = database.cash_server.pipeline(transaction=False)
+        for name in names:
+            script(keys=[_lease_key(name)], args=[token], client=pipe)
+        pipe.execute()
+    except RedisError:
+        log.warning("Redis not available, leases not released.")
+
+
+def release(name: str, token: str) -> None:
+    """
+    Release own lease.
+    :param name: name of lease
+    :param token:
+    """
+    release_many([name], token)
+
+
+def lookup_lease(username: str) -> str:
+    return f"lookup:{username.lower()}"
+
+
+def pull_lease(user_id: int) -> str:
+    return f"pull:{user_id}"
+
+
+def backfill_lease(username: str) -> str:
+    return f"backfill:{username.lower()}"
@@ -0,0 +1,216 @@
+"""
+Limits of calls to twitter API, shared by all workers in REDIS
+"""
+import functools
+import logging
+import time
+
+import tweepy
+from prometheus_client.core import GaugeMetricFamily
+from redis.exceptions import RedisError
+
+from app import database
+from app.models import RateLimited
+
+# time limit 900 sec
+TTL: int = 15 * 60
+
+# calls of twitter API methods per TTL
+TWITTER_LIMITS = {
+    "twitts": 300,
+    "users": 300,
+    "tasks": 150,
+}
+
+log = logging.getLogger(__name__)
+
+# Token bucket, refill and take run in REDIS atomically.
+# Return 0 if tokens taken, else milliseconds to wait for tokens.
+_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = math.ceil((requested - tokens) / rate)
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "ts", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / rate))
+return wait
+"""
+
+# Tokens in bucket now, bucket not changed.
+_TOKENS_AVAILABLE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+return math.floor(math.min(capacity, tokens + math.max(0, now - ts) * rate))
+"""
+
+
+def _bucket_key(method: str) -> str:
+    return f"twitter:limits:{method}"
+
+
+def _rate(method: str) -> float:
+    # tokens per millisecond
+    return TWITTER_LIMITS[method] / (TTL * 1000)
+
+
+def acquire(method: str, tokens: int = 1) -> float:
+    """
+    Take tokens from bucket of method.
+    :param method: key of TWITTER_LIMITS
+    :param tokens:
+    :return: 0 if tokens taken, else seconds to wait
+    """
+    capacity = TWITTER_LIMITS[method]
+    rate = _rate(method)
+    try:
+        wait = database.cash_server.register_script(_TOKEN_BUCKET)(
+            keys=[_bucket_key(method)],
+            args=[capacity, rate, tokens],
+        )
+    except RedisError:
+        # twitter API will stop us if REDIS not available
+        log.error("Redis not available, limits for %s not checked.", method)
+        return 0
+    return int(wait) / 1000
+
+
+async def acquire_async(server, method: str, tokens: int = 1) -> float:
+    """
+    Take tokens from bucket of method, same bucket as in acquire.
+    :param server: async REDIS client
+    :param method: key of TWITTER_LIMITS
+    :param tokens:
+    :return: 0 if tokens taken, else seconds to wait
+    """
+    try:
+        wait = await server.register_script(_TOKEN_BUCKET)(
+            keys=[_bucket_key(method)],
+            args=[TWITTER_LIMITS[method], _rate(method), tokens],
+        )
+    except RedisError:
+        log.error("Redis not available, limits for %s not checked.", method)
+        return 0
+    return int(wait) / 1000
+
+
+def available(method: str) -> int:
+    """
+    Return tokens in bucket of method, for plan of calls.
+    :param method: key of TWITTER_LIMITS
+    :return: 0 if REDIS not available
+    """
+    capacity = TWITTER_LIMITS[method]
+    rate = _rate(method)
+    try:
+        tokens = database.cash_server.register_script(_TOKENS_AVAILABLE)(
+            keys=[_bucket_key(method)],
+            args=[capacity, rate],
+        )
+    except RedisError:
+        log.error("Redis not available, limits for %s not checked.", method)
+        return 0
+    return int(tokens)
+
+
+def available_all() -> dict[str, int]:
+    """
+    Return tokens in buckets of all methods by one pipeline of HMGET,
+    refill counted here like in _TOKENS_AVAILABLE, by time of REDIS.
+    :return: method -> tokens, 0 for all methods if REDIS not available
+    """
+    try:
+        pipe = database.cash_server.pipeline(transaction=False)
+        pipe.time()
+        for method in TWITTER_LIMITS:
+            pipe.hmget(_bucket_key(method), "tokens", "ts")
+        (seconds, micros), *buckets = pipe.execute()
+    except RedisError:
+        log.error("Redis not available, limits not checked.")
+        return dict.fromkeys(TWITTER_LIMITS, 0)
+
+    now = seconds * 1000 + micros // 1000
+    tokens = {}
+    for method, (stored, ts) in zip(TWITTER_LIMITS, buckets):
+        capacity = TWITTER_LIMITS[method]
+        if stored is None:
+            tokens[method] = capacity
+            continue
+        refill = max(0, now - int(ts or now)) * _rate(method)
+        tokens[method] = int(min(capacity, float(stored) + refill))
+    return tokens
+
+
+class BudgetCollector:
+    """
+    Collector of tokens in buckets of all methods, read on scrape of metrics.
+    """
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            "twitter_limit_remaining",
+            "Calls to twitter API method available now.",
+            labels=["method"],
+        )
+        for method, tokens in available_all().items():
+            gauge.add_metric([method], tokens)
+        yield gauge
+
+
+def _retry_after(method: str, error: tweepy.TooManyRequests) -> float:
+    """
+    Return seconds to wait after answer 429 of twitter, by time of reset
+    of limit in header, one token of limit if header not found.
+    :param method: key of TWITTER_LIMITS
+    :param error:
+    :return:
+    """
+    reset = getattr(error.response, "headers", {}).get("x-rate-limit-reset")
+    try:
+        return max(int(reset) - time.time(), 1)
+    except (TypeError, ValueError):
+        return TTL / TWITTER_LIMITS[method]
+
+
+def with_limits(method: str):
+    """
+    Decorator for count requests to Twitter API.
+    Raise RateLimited if limit for method is over, or twitter answer 429,
+    so task rescheduled instead of sleep in worker.
+    :param method: key of TWITTER_LIMITS
+    :return: decorator
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            """Decorator"""
+            wait = acquire(method)
+            if wait:
+                raise RateLimited(wait)
+            try:
+                return function(*args, **kwargs)
+            except tweepy.TooManyRequests as error:
+                raise RateLimited(_retry_after(method, error))
+
+        return wrapper
+
+    return decorator
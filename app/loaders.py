@@ -0,0 +1,144 @@
+"""
+DataLoader for reads of API.
+
+Same keys requested at once wait one load, distinct keys requested
+in BATCH_DELAY seconds loaded by one call of batch function:
+    loader = DataLoader(load_accounts)
+    account = await loader.load("username")
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from prometheus_client.core import CounterMetricFamily
+
+log = logging.getLogger(__name__)
+
+# seconds to wait other keys for batch
+BATCH_DELAY = 0.002
+# max keys in one batch
+MAX_BATCH_SIZE = 100
+
+
+class DataLoader:
+    """
+    Merge loads of same key in flight and batch distinct keys.
+    Batch function get list of keys and return dict key -> value,
+    missing keys have value None.
+    """
+
+    def __init__(
+        self,
+        batch_function: Callable[[list], Awaitable[dict]],
+        delay: float = BATCH_DELAY,
+        max_batch_size: int = MAX_BATCH_SIZE,
+    ):
+        self.batch_function = batch_function
+        self.delay = delay
+        self.max_batch_size = max_batch_size
+        # sizes of batches, count of batches by size
+        self.batch_sizes: dict[int, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+        self._batch: dict[Hashable, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # running batches, loop keep only weak references to tasks
+        self._tasks: set[asyncio.Task] = set()
+
+    def _reset(self, loop: asyncio.AbstractEventLoop) -> None:
+        # futures bound to event loop, new loop start with empty state
+        self._loop = loop
+        self._in_flight = {}
+        self._batch = {}
+        self._timer = None
+        self._tasks = set()
+
+    async def load(self, key: Hashable) -> Any:
+        """
+        Return value of key, loaded with other keys requested at same time.
+        :param key:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._reset(loop)
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = loop.create_future()
+            self._in_flight[key] = future
+            self._batch[key] = future
+            if len(self._batch) >= self.max_batch_size:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.delay, self._dispatch)
+        # cancel of one request dont cancel load for others
+        return await asyncio.shield(future)
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, {}
+        if batch:
+            task = self._loop.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: dict[Hashable, asyncio.Future]) -> None:
+        size = len(batch)
+        self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+        try:
+            values = await self.batch_function(list(batch))
+        except Exception as error:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(error)
+        except BaseException:
+            for future in batch.values():
+                future.cancel()
+            raise
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(values.get(key))
+        finally:
+            for key in batch:
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        """
+        Return count of batches, keys and average size of batch.
+        :return:
+        """
+        batches = sum(self.batch_sizes.values())
+        keys = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "batches": batches,
+            "keys": keys,
+            "average_batch_size": keys / batches if batches else 0,
+        }
+
+
+class LoadersCollector:
+    """
+    Collector of batches and keys of loaders, read on scrape of metrics.
+    Average size of batch is keys / batches.
+    """
+
+    def __init__(self, loaders: dict[str, DataLoader]):
+        self.loaders = loaders
+
+    def collect(self):
+        batches = CounterMetricFamily(
+            "api_loader_batches", "Batches loaded by loader.", labels=["loader"]
+        )
+        keys = CounterMetricFamily(
+            "api_loader_keys", "Keys loaded by loader.", labels=["loader"]
+        )
+        for name, loader in self.loaders.items():
+            stats = loader.stats()
+            batches.add_metric([name], stats["batches"])
+            keys.add_metric([name], stats["keys"])
+        yield batches
+        yield keys
@@ -1,20 +1,29 @@
 """
 Test api for scrapping twitter accounts
 """
+import asyncio
 import logging
 import uvicorn
 
-from fastapi import FastAPI, HTTPException, Body
+from datetime import datetime
+from typing import Optional, Union
+
+from fastapi import FastAPI, HTTPException, Body, Header, Query, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
 
 from app.models import (
     AccountStatus,
+    SessionSummary,
     InternalError,
     Session,
     ProfilesList,
     Account,
 )
-from app import services
+from app import database, metrics, profiling, services
+from app.events import session_events
+from app.limits import BudgetCollector
+from app.loaders import LoadersCollector
 
 
 log = logging.getLogger(__name__)
@@ -29,7 +38,9 @@ or (and) with using account app. 🚀
 
 **add task** for sync list twitter users names
 
-**get task status** with all users in list
+**get task status** with all users in list, by pages or only counters by status
+
+**stream task status** changes of statuses as Server-Sent Events
 
 ### User
 
@@ -37,7 +48,10 @@ or (and) with using account app. 🚀
 
 ### Twitts
 
-**get twitts** by user twitter id (will return 10 last twitts)
+**get twitts** by user twitter id (will return 10 last twitts),
+for next pages use cursor from header `X-Next-Cursor` as `before_id`
+
+**export twitts** all twitts of user as NDJSON stream
 
 ---
 
@@ -59,6 +73,62 @@ app = FastAPI(
 )
 
 
+metrics.scrape_registry.register(BudgetCollector())
+metrics.scrape_registry.register(
+    LoadersCollector(
+        {"accounts": services.accounts_loader, "twitts": services.twitts_loader}
+    )
+)
+
+
+app.add_middleware(metrics.RequestMetricsMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Return metrics for Prometheus.
+    :return:
+    """
+    content = await asyncio.to_thread(metrics.exposition)
+    return Response(content=content, media_type=metrics.CONTENT_TYPE_LATEST)
+
+
+def _check_profile_token(token: Optional[str]) -> None:
+    # headers decoded as latin-1, encode back to raw bytes
+    if not profiling.is_profile_token(token.encode("latin-1") if token else None):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.get("/api/profiles", include_in_schema=False)
+async def get_profiles(x_profile: Optional[str] = Header(default=None)):
+    """
+    Return saved profiles of requests, newest first.
+    Header X-Profile must have PROFILE_TOKEN.
+    :param x_profile:
+    :return:
+    """
+    _check_profile_token(x_profile)
+    return await asyncio.to_thread(profiling.list_profiles)
+
+
+@app.get("/api/profiles/{name}", include_in_schema=False)
+async def get_profile(name: str, x_profile: Optional[str] = Header(default=None)):
+    """
+    Return profile of request as HTML.
+    Header X-Profile must have PROFILE_TOKEN.
+    :param name: name from list of profiles or header X-Profile-Id
+    :param x_profile:
+    :return:
+    """
+    _check_profile_token(x_profile)
+    path = profiling.get_profile_path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return FileResponse(path, media_type="text/html")
+
+
 @app.post(
     "/api/users",
     response_description="Add new task for sync from twitter",
@@ -79,6 +149,11 @@ async def add_profiles(data: ProfilesList = Body(...)):
     }
     ```
     """
+    if data.callback_url and not await services.is_safe_callback(data.callback_url):
+        raise HTTPException(
+            status_code=422,
+            detail="Callback url not allowed.",
+        )
     try:
         result = await services.create_new_task(data)
         if result:
@@ -98,11 +173,19 @@ async def add_profiles(data: ProfilesList = Body(...)):
 @app.get(
     "/api/users/status",
     response_description="List with status for sync",
-    response_model=list[AccountStatus],
+    response_model=Union[list[AccountStatus], SessionSummary],
 )
-async def get_status(session_id: str):
+async def get_status(
+    session_id: str,
+    offset: int = Query(default=0, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1, le=services.MAX_SESSION_USERS),
+    summary: bool = False,
+):
     """
-    Return list of dict with status of parsing accounts by session_id
+    Return list of dict with status of parsing accounts by session_id.
+
+    Use `offset` and `limit` for pages of users,
+    `summary=true` for count of users by status only.
     """
     try:
         if not session_id:
@@ -111,7 +194,12 @@ async def get_status(session_id: str):
                 detail="Bad response, request dosnt contain key session_id",
             )
 
-        status_list = await services.get_status_by_session(session_id)
+        status_list = await services.get_status_by_session(
+            session_id,
+            offset=offset,
+            limit=limit,
+            summary=summary,
+        )
         if status_list:
             return status_list
         else:
@@ -126,6 +214,45 @@ async def get_status(session_id: str):
         )
 
 
+@app.get(
+    "/api/users/status/stream",
+    response_description="Stream of status changes for sync",
+    response_class=StreamingResponse,
+)
+async def stream_status(session_id: str):
+    """
+    Stream progress of session as Server-Sent Events.
+
+    First event is counters of session, next events are
+    changed users with counters. Stream closed after
+    all users are updated or not found.
+    """
+    # events published while summary is read wait in queue
+    queue = await session_events.open(session_id)
+    try:
+        summary = await services.get_status_by_session(session_id, summary=True)
+        if not summary:
+            raise HTTPException(
+                status_code=404,
+                detail="Session_id key not valid",
+            )
+    except BaseException as error:
+        if queue is not None:
+            await session_events.unsubscribe(session_id, queue)
+        if isinstance(error, InternalError):
+            raise HTTPException(
+                status_code=500,
+                detail="Internal error, try leter.",
+            )
+        raise
+    snapshot = {"total": summary.total, "counters": summary.counters}
+    return StreamingResponse(
+        session_events.stream(session_id, snapshot, queue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get(
     "/api/user/{username}",
     response_model=Account,
@@ -154,19 +281,43 @@ async def get_user_data(username: str):
 
 @app.get(
     "/api/twitts/{twitter_id}",
-    response_description="List last 10 twitts of user",
+    response_description="List last twitts of user",
     response_model=list[str],
 )
-async def get_twitts(twitter_id: str):
+async def get_twitts(
+    twitter_id: str,
+    response: Response,
+    limit: int = Query(default=10, ge=1, le=100),
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+):
     """
-    Get last 10 twitts by twitter_id from DB only.
+    Get last twitts by twitter_id from DB only, newest first.
+
+    Cursors of pages returned in headers:
+    `X-Next-Cursor` - use as `before_id` for older twitts,
+    `X-Prev-Cursor` - use as `after_id` for newer twitts.
     :param twitter_id:
+    :param response:
+    :param limit: twitts on page (10 by default)
+    :param before_id: return twitts older than this id
+    :param after_id: return twitts newer than this id
     :return:
     """
     try:
-        twitts = await services.get_last_ten_twitts_by_twitter_id(twitter_id)
-        if twitts:
-            return twitts
+        page = await services.get_twitts_by_twitter_id(
+            twitter_id,
+            limit=limit,
+            before_id=before_id,
+            after_id=after_id,
+        )
+        if page.next_cursor:
+            response.headers["X-Next-Cursor"] = page.next_cursor
+        if page.prev_cursor:
+            response.headers["X-Prev-Cursor"] = page.prev_cursor
+
+        if page.twitts or before_id is not None or after_id is not None:
+            return page.twitts
         else:
             raise HTTPException(
                 status_code=404,
@@ -179,5 +330,57 @@ async def get_twitts(twitter_id: str):
         )
 
 
+@app.get(
+    "/api/twitts/{twitter_id}/export",
+    response_description="Stream of all user twitts, one JSON per line",
+    response_class=StreamingResponse,
+)
+async def export_twitts(
+    twitter_id: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    Export all twitts by twitter_id from DB as NDJSON, newest first.
+    :param twitter_id:
+    :param since: twitts created at or after (UTC)
+    :param until: twitts created before (UTC)
+    :return:
+    """
+    if not twitter_id.isdigit():
+        raise HTTPException(
+            status_code=404,
+            detail="Twitter id not found in DB.",
+        )
+    return StreamingResponse(
+        services.export_twitts(twitter_id, since=since, until=until),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get(
+    "/api/ready",
+    response_description="State of connections to Mongo and REDIS",
+)
+async def get_readiness():
+    """
+    Return state of connection pools, status 503 if API not ready.
+    :return:
+    """
+    health = await database.check_health()
+    return JSONResponse(content=health, status_code=200 if health["ready"] else 503)
+
+
+@app.on_event("startup")
+async def open_connections():
+    await database.connect()
+
+
+@app.on_event("shutdown")
+async def close_connections():
+    await session_events.close()
+    await database.close()
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0")
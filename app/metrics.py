@@ -0,0 +1,242 @@
+"""
+Metrics of API and workers for Prometheus.
+
+API export metrics on GET /metrics, main process of every worker on
+METRICS_PORT. Processes of one worker (prefork pool) write metrics to
+PROMETHEUS_MULTIPROC_DIR, exporter aggregate them. Set dir before start
+of worker, dir cleaned by worker on start:
+    PROMETHEUS_MULTIPROC_DIR=/tmp/metrics METRICS_PORT=9100 celery -A app.celery_twitter worker
+"""
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+
+from celery.signals import (
+    before_task_publish,
+    task_failure,
+    task_postrun,
+    task_prerun,
+    task_retry,
+    worker_init,
+    worker_process_shutdown,
+)
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from pymongo import monitoring
+
+from app.config import get_settings
+
+log = logging.getLogger(__name__)
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# header of task message with time of publish
+PUBLISHED_AT_HEADER = "published_at"
+
+# seconds
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+TASK_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+REQUEST_DURATION = Histogram(
+    "api_request_duration_seconds",
+    "Duration of API requests by route.",
+    ["method", "route", "status"],
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds",
+    "Duration of Mongo commands.",
+    ["client", "command", "status"],
+    buckets=FAST_BUCKETS,
+)
+TASK_DURATION = Histogram(
+    "celery_task_duration_seconds",
+    "Duration of celery tasks by final state.",
+    ["task", "state"],
+    buckets=TASK_BUCKETS,
+)
+TASK_QUEUE_WAIT = Histogram(
+    "celery_task_queue_wait_seconds",
+    "Time of task in queue, from publish (or eta) to start.",
+    ["task"],
+    buckets=TASK_BUCKETS,
+)
+TASK_FAILURES = Counter(
+    "celery_task_failures_total",
+    "Failed celery tasks.",
+    ["task", "exception"],
+)
+TASK_RETRIES = Counter(
+    "celery_task_retries_total",
+    "Retries of celery tasks.",
+    ["task"],
+)
+
+# collectors read on every scrape: limits in REDIS, loaders of API
+scrape_registry = CollectorRegistry()
+
+
+def exposition() -> bytes:
+    """
+    Return metrics of process, or of all processes in PROMETHEUS_MULTIPROC_DIR,
+    in text format of Prometheus.
+    :return:
+    """
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry) + generate_latest(scrape_registry)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware, save duration of request by template of route,
+    until end of response body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.monotonic()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.labels(
+                scope["method"], _route_path(scope), status
+            ).observe(time.monotonic() - started)
+
+
+def _route_path(scope) -> str:
+    # template of path, not path itself, for small count of labels
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        for route in scope["app"].routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                return route.path
+    return "unmatched"
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Save duration of every command of Mongo client.
+    """
+
+    def __init__(self, client: str):
+        self.client = client
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        MONGO_COMMAND_DURATION.labels(self.client, event.command_name, "ok").observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        MONGO_COMMAND_DURATION.labels(
+            self.client, event.command_name, "failed"
+        ).observe(event.duration_micros / 1e6)
+
+
+# start of running tasks of process by task id
+_started: dict[str, float] = {}
+
+
+@before_task_publish.connect
+def mark_published(headers=None, **kwargs):
+    if headers is not None:
+        headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+@task_prerun.connect
+def start_task(task_id=None, task=None, **kwargs):
+    _started[task_id] = time.monotonic()
+    published_at = task.request.get(PUBLISHED_AT_HEADER)
+    if published_at is None:
+        return
+    # tasks with countdown wait in queue by plan
+    eta = task.request.eta
+    if eta:
+        published_at = max(published_at, datetime.fromisoformat(eta).timestamp())
+    TASK_QUEUE_WAIT.labels(task.name).observe(max(time.time() - published_at, 0))
+
+
+@task_postrun.connect
+def finish_task(task_id=None, task=None, state=None, **kwargs):
+    started = _started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(
+            time.monotonic() - started
+        )
+
+
+@task_failure.connect
+def count_failure(sender=None, exception=None, **kwargs):
+    TASK_FAILURES.labels(sender.name, type(exception).__name__).inc()
+
+
+def count_error(task, exception: BaseException) -> None:
+    """
+    Count failure of task which error logged and not raised,
+    signal task_failure not sent for it.
+    :param task:
+    :param exception:
+    """
+    TASK_FAILURES.labels(task.name, type(exception).__name__).inc()
+
+
+@task_retry.connect
+def count_retry(sender=None, **kwargs):
+    TASK_RETRIES.labels(sender.name).inc()
+
+
+@worker_init.connect
+def start_exporter(**kwargs):
+    """
+    Clean metrics of previous run and start exporter of worker.
+    """
+    if MULTIPROC_DIR:
+        shutil.rmtree(MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    port = get_settings().METRICS_PORT
+    if port:
+        start_http_server(port, registry=_worker_registry())
+        log.info("Metrics of worker on port %s.", port)
+
+
+def _worker_registry() -> CollectorRegistry:
+    if not MULTIPROC_DIR:
+        log.warning("PROMETHEUS_MULTIPROC_DIR not set, metrics of pool not exported.")
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+@worker_process_shutdown.connect
+def remove_process(pid=None, **kwargs):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,136 @@
+"""
+Migrations of data in Mongo
+
+Run:
+    python -m app.migrations twitts [--batch-size 1000] [--drop]
+    python -m app.migrations dedup [--batch-size 1000]
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from typing import Optional
+
+from pymongo import ReplaceOne, DeleteMany
+from pymongo.database import Database
+
+from app import database
+
+log = logging.getLogger(__name__)
+
+# created_at format in twitts from twitter API v1.1
+TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+
+def _flush(collection, requests: list) -> None:
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+        requests.clear()
+
+
+def migrate_user_twitts(
+    batch_size: int = 1000,
+    drop: bool = False,
+    db: Optional[Database] = None,
+) -> int:
+    """
+    Move twitts from collections per user (twitter_data.<twitter_id>)
+    to one collection twitter_data.twitts.
+    Can be restarted, moved twitts replaced by id.
+    :param batch_size: twitts in one bulk write
+    :param drop: drop collection of user after move
+    :param db: database with twitts, twitter_data by default
+    :return: count of moved twitts
+    """
+    if db is None:
+        db = database.s_db_data
+    database.create_indexes(db)
+
+    moved = 0
+    for name in db.list_collection_names():
+        # old collections named by twitter id of user
+        if not name.isdigit():
+            continue
+
+        author_id = int(name)
+        requests = []
+        for twitt in db[name].find({}, batch_size=batch_size):
+            twitt.pop("_id", None)
+            twitt["author_id"] = author_id
+            if isinstance(twitt.get("created_at"), str):
+                twitt["created_at"] = datetime.strptime(
+                    twitt["created_at"], TWITTER_TIME_FORMAT
+                )
+            _filter = {"author_id": author_id, "id": twitt["id"]}
+            requests.append(ReplaceOne(_filter, twitt, upsert=True))
+            if len(requests) == batch_size:
+                moved += len(requests)
+                _flush(db.twitts, requests)
+        moved += len(requests)
+        _flush(db.twitts, requests)
+        log.info("Collection %s moved to twitts.", name)
+
+        if drop:
+            db[name].drop()
+    return moved
+
+
+def dedup_twitts(batch_size: int = 1000, db: Optional[Database] = None) -> int:
+    """
+    Remove duplicates of twitts and create unique index on twitt id.
+    Duplicates found by aggregation in Mongo, only _id of extra copies
+    come to app. Can be run while twitts are saved.
+    :param batch_size: groups of duplicates in one bulk write
+    :param db: database with twitts, twitter_data by default
+    :return: count of removed twitts
+    """
+    if db is None:
+        db = database.s_db_data
+    collection = db.twitts
+    pipeline = [
+        {"$group": {"_id": "$id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        # first copy stay in DB
+        {"$project": {"extra": {"$slice": ["$ids", 1, "$count"]}}},
+    ]
+    removed = 0
+    requests = []
+    groups = collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+    for group in groups:
+        requests.append(DeleteMany({"_id": {"$in": group["extra"]}}))
+        removed += len(group["extra"])
+        if len(requests) == batch_size:
+            _flush(collection, requests)
+    _flush(collection, requests)
+    log.info("Removed %s duplicates of twitts.", removed)
+
+    database.create_indexes(db)
+    return removed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    twitts = subparsers.add_parser(
+        "twitts", help="move twitts from collections per user to one collection"
+    )
+    twitts.add_argument("--batch-size", type=int, default=1000)
+    twitts.add_argument("--drop", action="store_true")
+
+    dedup = subparsers.add_parser(
+        "dedup", help="remove duplicates of twitts and create unique index"
+    )
+    dedup.add_argument("--batch-size", type=int, default=1000)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "twitts":
+        moved = migrate_user_twitts(batch_size=args.batch_size, drop=args.drop)
+        log.info("Moved %s twitts.", moved)
+    elif args.command == "dedup":
+        dedup_twitts(batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 """
 Models for API
 """
-from typing import List
+from typing import List, Optional
 
 from bson import ObjectId
-from pydantic import BaseModel, Field
+from pydantic import AnyHttpUrl, BaseModel, Field
 import pymongo
 
 
@@ -40,6 +40,7 @@ class SyncTask(BaseModel):
 
     session_id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     users_list: set[str] = Field(...)
+    callback_url: Optional[str] = None
 
     class Config:
         """
@@ -61,6 +62,16 @@ class AccountStatus(BaseModel):
     status: str
 
 
+class SessionSummary(BaseModel):
+    """
+    Model for progress of session: count of users by status.
+    """
+
+    session_id: str
+    total: int
+    counters: dict[str, int]
+
+
 class Account(BaseModel):
     """
     Class for Users of twitter
@@ -74,7 +85,7 @@ class Account(BaseModel):
     followers_count: int = Field(...)
     description: str = Field(...)
     twitts_count: int = Field(...)
-    status: str = Field(..., default="started")
+    status: str = Field(default="started")
 
     class Collection:
         """
@@ -116,15 +127,47 @@ class Session(BaseModel):
     session_id: str
 
 
+class TwittsPage(BaseModel):
+    """
+    Class for page of twitts, newest first.
+    next_cursor - for older twitts, prev_cursor - for newer twitts.
+    """
+
+    twitts: List[str]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
 class ProfilesList(BaseModel):
     """
-    Class for list of profiles in twitter
+    Class for list of profiles in twitter,
+    progress of sync posted to callback_url if set.
     """
 
     profiles: List[str]
+    callback_url: Optional[AnyHttpUrl] = None
 
 
 class TaskFaled(BaseException):
     """
     Class for task fails
     """
+
+
+class WebhookFailed(BaseException):
+    """
+    Class for fails of delivery to callback url, delivery can be retried.
+    """
+
+
+class RateLimited(BaseException):
+    """
+    Class for limit of calls to twitter is over.
+    retry_after - seconds to wait,
+    pending - data not processed because of limit.
+    """
+
+    def __init__(self, retry_after: float, pending: Optional[list] = None):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+        self.pending = pending
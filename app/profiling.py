@@ -0,0 +1,140 @@
+"""
+Profiling of API requests on demand.
+
+Request profiled if header X-Profile has PROFILE_TOKEN, or by chance
+PROFILE_SAMPLE_RATE. Profile (HTML of pyinstrument) saved in PROFILE_DIR,
+name of profile returned in header X-Profile-Id, only PROFILE_KEEP last
+profiles kept. If token and rate not set, requests go to app without profiler.
+"""
+import asyncio
+import hmac
+import logging
+import random
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from pyinstrument import Profiler
+
+from app.config import get_settings
+
+log = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+PROFILE_NAME_REGEX = re.compile(r"^[\w.-]+\.html$")
+
+# listing and download of profiles not profiled
+PROFILES_PATH = "/api/profiles"
+
+
+def is_profile_token(token: Optional[bytes]) -> bool:
+    """
+    Check raw value of header X-Profile with PROFILE_TOKEN.
+    :param token: bytes of header, any bytes allowed
+    :return:
+    """
+    expected = get_settings().PROFILE_TOKEN
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(token, expected.encode())
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware, profile chosen requests until end of response body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _is_profiled(self, scope) -> bool:
+        settings = get_settings()
+        if scope["path"].startswith(PROFILES_PATH):
+            return False
+        if is_profile_token(dict(scope["headers"]).get(PROFILE_HEADER)):
+            return True
+        rate = settings.PROFILE_SAMPLE_RATE
+        return bool(rate) and random.random() < rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._is_profiled(scope):
+            return await self.app(scope, receive, send)
+
+        name = _profile_name(scope)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_ID_HEADER, name.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = Profiler(
+            interval=get_settings().PROFILE_INTERVAL, async_mode="enabled"
+        )
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.stop()
+            await asyncio.to_thread(save_profile, name, profiler.output_html())
+
+
+def _profile_name(scope) -> str:
+    path = re.sub(r"[^\w-]+", "_", scope["path"]).strip("_") or "root"
+    started = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    return f"{started}-{scope['method']}-{path[:50]}.html"
+
+
+def _profile_dir() -> Path:
+    return Path(get_settings().PROFILE_DIR)
+
+
+def save_profile(name: str, html: str) -> None:
+    """
+    Save profile, remove oldest profiles over PROFILE_KEEP.
+    :param name:
+    :param html:
+    """
+    directory = _profile_dir()
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / name).write_text(html)
+        profiles = sorted(directory.glob("*.html"), key=lambda path: path.name)
+        for path in profiles[: -get_settings().PROFILE_KEEP or None]:
+            path.unlink(missing_ok=True)
+    except OSError as error:
+        log.error("Profile %s not saved: %r", name, error)
+
+
+def list_profiles() -> list[dict]:
+    """
+    Return saved profiles, newest first.
+    :return:
+    """
+    profiles = []
+    for path in sorted(_profile_dir().glob("*.html"), reverse=True):
+        stat = path.stat()
+        profiles.append(
+            {
+                "name": path.name,
+                "size": stat.st_size,
+                "created_at": datetime.utcfromtimestamp(stat.st_mtime),
+            }
+        )
+    return profiles
+
+
+def get_profile_path(name: str) -> Optional[Path]:
+    """
+    Return path of saved profile, None if not found.
+    :param name: name from list_profiles or header X-Profile-Id
+    :return:
+    """
+    if not PROFILE_NAME_REGEX.match(name):
+        return None
+    path = _profile_dir() / name
+    return path if path.is_file() else None
@@ -0,0 +1,265 @@
+"""
+Progress of sync sessions.
+
+Session (task) document keep status of every user and counters by status:
+    {
+        "_id": "63c251447c36683bae7dadca",
+        "users_list": ["username", ...],
+        "users": [{"username": "username", "status": "new"}, ...],
+        "counters": {"new": 1},
+        "total": 1,
+    }
+Workers change status of user in all sessions with this user,
+status and counters changed atomically in one update.
+After update changed users and counters of session published to REDIS
+channel "session:<session_id>" and sent to callback url of session.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Iterable
+
+import redis.asyncio
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateMany
+from pymongo.collection import Collection
+from redis.exceptions import RedisError
+
+from app import database, webhooks
+
+log = logging.getLogger(__name__)
+
+STATUS_NEW = "new"
+STATUS_PULLING = "pulling"
+STATUS_UPDATED = "updated"
+STATUS_NOT_FOUND = "not_found"
+
+# status can be changed only from previous statuses
+PREVIOUS_STATUSES = {
+    STATUS_NEW: (),
+    STATUS_PULLING: (STATUS_NEW,),
+    STATUS_UPDATED: (STATUS_NEW, STATUS_PULLING),
+    STATUS_NOT_FOUND: (STATUS_NEW, STATUS_PULLING),
+}
+
+# session is done when all users have final statuses
+FINAL_STATUSES = (STATUS_UPDATED, STATUS_NOT_FOUND)
+
+
+def is_done(progress: dict) -> bool:
+    """
+    Return True if all users of session have final statuses.
+    :param progress: dict with total and counters
+    :return:
+    """
+    counters = progress.get("counters") or {}
+    done = sum(counters.get(status, 0) for status in FINAL_STATUSES)
+    return done >= progress.get("total", 0)
+
+
+def new_session(usernames: Iterable[str], updated: Iterable[str] = ()) -> dict:
+    """
+    Return progress fields for new session, users are new or updated.
+    :param usernames:
+    :param updated: users with fresh data, not synced again
+    :return:
+    """
+    # usernames in twitter are case insensitive
+    usernames = dict.fromkeys(username.lower() for username in usernames)
+    updated = {username.lower() for username in updated}
+    users = [
+        {
+            "username": username,
+            "status": STATUS_UPDATED if username in updated else STATUS_NEW,
+        }
+        for username in usernames
+    ]
+    counters = {}
+    for user in users:
+        counters[user["status"]] = counters.get(user["status"], 0) + 1
+    return {
+        "users": users,
+        "counters": counters,
+        "total": len(users),
+        "updated_at": datetime.utcnow(),
+    }
+
+
+def _status_requests(
+    usernames: list[str], status: str, now: datetime
+) -> list[UpdateMany]:
+    """
+    Return updates of status of users in all sessions for one bulk write.
+    updated_at never moved back, so sessions changed by this write
+    have updated_at not older than now.
+    :param usernames: lowercase usernames
+    :param status:
+    :param now: time of write
+    :return:
+    """
+    requests = []
+    for username in usernames:
+        for previous in PREVIOUS_STATUSES[status]:
+            _filter = {
+                "users": {"$elemMatch": {"username": username, "status": previous}}
+            }
+            update = {
+                "$set": {"users.$.status": status},
+                "$max": {"updated_at": now},
+                "$inc": {f"counters.{previous}": -1, f"counters.{status}": 1},
+            }
+            requests.append(UpdateMany(_filter, update))
+    return requests
+
+
+def set_accounts_status(
+    collection: Collection,
+    usernames: Iterable[str],
+    status: str,
+) -> None:
+    """
+    Change status of users in all sessions by one bulk write.
+    :param collection: collection of sessions (tasks)
+    :param usernames:
+    :param status:
+    """
+    now = datetime.utcnow()
+    usernames = [username.lower() for username in usernames]
+    requests = _status_requests(usernames, status, now)
+    if requests:
+        result = collection.bulk_write(requests, ordered=False)
+        if result.modified_count:
+            publish_progress(collection, usernames, status, now)
+
+
+async def set_accounts_status_async(
+    collection: AsyncIOMotorCollection,
+    usernames: Iterable[str],
+    status: str,
+    cash_server: redis.asyncio.Redis,
+) -> None:
+    """
+    Same as set_accounts_status, by Motor and async REDIS client.
+    :param collection: collection of sessions (tasks)
+    :param usernames:
+    :param status:
+    :param cash_server: async client for publish of progress
+    """
+    now = datetime.utcnow()
+    usernames = [username.lower() for username in usernames]
+    requests = _status_requests(usernames, status, now)
+    if requests:
+        result = await collection.bulk_write(requests, ordered=False)
+        if result.modified_count:
+            await publish_progress_async(
+                collection, usernames, status, now, cash_server
+            )
+
+
+def session_channel(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+def _progress_pipeline(
+    usernames: list[str], status: str, since: datetime
+) -> list[dict]:
+    """
+    Return aggregation of sessions where users have new status and changed
+    since time of write, old sessions with same users not returned,
+    sessions changed by other workers at same time found too,
+    only users from list returned.
+    :param usernames: lowercase usernames
+    :param status: new status of users
+    :param since: time of write of status
+    :return:
+    """
+    return [
+        {
+            "$match": {
+                "users": {
+                    "$elemMatch": {"username": {"$in": usernames}, "status": status}
+                },
+                "updated_at": {"$gte": since},
+            }
+        },
+        {
+            "$project": {
+                "total": 1,
+                "counters": 1,
+                "callback_url": 1,
+                "users": {
+                    "$filter": {
+                        "input": "$users",
+                        "cond": {"$in": ["$$this.username", usernames]},
+                    }
+                },
+            }
+        },
+    ]
+
+
+def _publish(pipe, session: dict, callbacks: dict) -> None:
+    session_id = str(session.pop("_id"))
+    if session.pop("callback_url", None):
+        callbacks[session_id] = [user["username"] for user in session["users"]]
+    pipe.publish(session_channel(session_id), json.dumps(session))
+
+
+def publish_progress(
+    collection: Collection,
+    usernames: list[str],
+    status: str,
+    since: datetime,
+) -> None:
+    """
+    Publish current statuses of users and counters to channels of sessions
+    and schedule delivery to callback urls of sessions.
+    Sessions where users have new status found by one aggregation.
+    :param collection: collection of sessions (tasks)
+    :param usernames: lowercase usernames
+    :param status: new status of users
+    :param since: time of write of status
+    """
+    callbacks = {}
+    try:
+        pipe = database.cash_server.pipeline(transaction=False)
+        for session in collection.aggregate(
+            _progress_pipeline(usernames, status, since)
+        ):
+            _publish(pipe, session, callbacks)
+        pipe.execute()
+    except RedisError:
+        log.warning("Redis not available, progress not published.")
+
+    for session_id, changed in callbacks.items():
+        webhooks.schedule_delivery(session_id, changed)
+
+
+async def publish_progress_async(
+    collection: AsyncIOMotorCollection,
+    usernames: list[str],
+    status: str,
+    since: datetime,
+    cash_server: redis.asyncio.Redis,
+) -> None:
+    """
+    Same as publish_progress, by Motor and async REDIS client.
+    :param collection: collection of sessions (tasks)
+    :param usernames: lowercase usernames
+    :param status: new status of users
+    :param since: time of write of status
+    :param cash_server: async client for publish
+    """
+    callbacks = {}
+    try:
+        pipe = cash_server.pipeline(transaction=False)
+        pipeline = _progress_pipeline(usernames, status, since)
+        async for session in collection.aggregate(pipeline):
+            _publish(pipe, session, callbacks)
+        await pipe.execute()
+    except RedisError:
+        log.warning("Redis not available, progress not published.")
+
+    for session_id, changed in callbacks.items():
+        await asyncio.to_thread(webhooks.schedule_delivery, session_id, changed)
@@ -1,66 +1,135 @@
 """
 Puller from twitter
 """
+import json
 import logging
-from typing import Union
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+from typing import Union, Iterable, Iterator, Optional
 import functools
 import snscrape.modules.twitter as sntwitter
-from pymongo import InsertOne, UpdateOne, DeleteOne
-from datetime import datetime
+import tweepy
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta
+from app import cache, database, leases, progress, scraper_pool
 from app.config import with_settings
 from app.connections import get_api
-from app.database import cash_server, sync_client
-from app.models import InternalError, Account, TaskFaled
-from time import sleep
+from app.database import DUPLICATE_KEY_ERROR
+from app.migrations import TWITTER_TIME_FORMAT
+from app.limits import with_limits, available, TTL, TWITTER_LIMITS
+from app.models import InternalError, Account, TaskFaled, RateLimited
 
 END_TIME = "2010-01-01"
-# time limit 900 sec
-TTL: int = 15 * 60
 
-TWITTER_LIMITS = {
-    "twitts": 300,
-    "users": 300,
-    "tasks": 150,
-}
+# max screen names in one call of lookup_users
+LOOKUP_USERS_LIMIT = 100
+# max twitts in one call of user_timeline
+TIMELINE_PAGE_SIZE = 200
+# twitts from scraper saved to DB at once
+BACKFILL_BATCH_SIZE = 500
+# max twitts available in user_timeline
+TIMELINE_LIMIT = 3200
+
+# velocity of account (new twitts per hour) is average of every sync,
+# weight of old syncs halved every VELOCITY_HALF_LIFE hours
+VELOCITY_HALF_LIFE = 24
+# velocity of new account and min velocity, so dormant accounts synced rarely
+DEFAULT_VELOCITY = 1
+MIN_VELOCITY = 0.01
 
 log = logging.getLogger(__name__)
 
 
-def with_limits(function):
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
     """
-    Decorator for count requests to Twitter API
-    :param function:
-    :return: function(*args, **kwargs)
+    Split stream to lists of size items, last list can be shorter.
+    :param iterable:
+    :param size:
+    :return:
     """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
-    @functools.wraps(function)
-    def wrapper(*args, **kwargs):
-        """Decorator"""
-        method = ""
-        key = f"twitter:{method}"
-        method_call_count = 0
-        try:
-            method_call_count = int(
-                cash_server.ts().range(
-                    key=key,
-                    from_time="-",
-                    to_time="+",
-                    aggregation_type="sum",
-                    bucket_size_msec=TTL * 10000,
-                )[0][1]
-            )
-            print(method_call_count)
-        except BaseException:
-            pass
 
-        if method_call_count > int(TWITTER_LIMITS.get(method) * 0.75):
-            d_time = TTL / (TWITTER_LIMITS.get(method) - method_call_count)
-            print("sleep ", d_time)
-            sleep(d_time)
-        cash_server.ts().add(key=key, timestamp="*", value=1)
-        return function(*args, **kwargs)
+def _is_transient(error: BaseException) -> bool:
+    """
+    Return True if call of twitter can pass on retry: errors of servers
+    of twitter and errors of connection (tweepy raise TweepyException).
+    :param error:
+    :return:
+    """
+    if isinstance(error, tweepy.TwitterServerError):
+        return True
+    if isinstance(error, tweepy.HTTPException):
+        return False
+    return isinstance(error, (tweepy.TweepyException, OSError))
+
 
-    return wrapper
+def update_velocity(velocity: Optional[float], saved: int, hours: float) -> float:
+    """
+    Return new velocity of account after sync.
+    :param velocity: previous velocity, None for first sync
+    :param saved: new twitts
+    :param hours: since previous sync
+    :return: twitts per hour
+    """
+    rate = saved / hours
+    if velocity is None:
+        return rate
+    weight = 1 - 0.5 ** (hours / VELOCITY_HALF_LIFE)
+    return weight * rate + (1 - weight) * velocity
+
+
+def pull_cost(expected: float) -> int:
+    """
+    Return calls of user_timeline for sync of expected new twitts,
+    last call return empty page.
+    :param expected: new twitts
+    :return:
+    """
+    return math.ceil(min(expected, TIMELINE_LIMIT) / TIMELINE_PAGE_SIZE) + 1
+
+
+def twitt_from_status(status) -> dict:
+    """
+    Document for collection of twitts from tweepy Status.
+    :param status:
+    :return: dict
+    """
+    data = dict(status._json)
+    data["author_id"] = status.user.id
+    data["created_at"] = status.created_at
+    return data
+
+
+def twitt_from_json(data: dict) -> dict:
+    """
+    Document for collection of twitts from JSON of twitter API v1.1.
+    :param data:
+    :return: dict
+    """
+    data = dict(data)
+    data["author_id"] = data["user"]["id"]
+    data["created_at"] = datetime.strptime(data["created_at"], TWITTER_TIME_FORMAT)
+    return data
+
+
+def twitt_from_scrapper(twitt) -> dict:
+    """
+    Document for collection of twitts from snscrape Tweet.
+    :param twitt:
+    :return: dict
+    """
+    data = json.loads(twitt.json())
+    data["id_str"] = str(twitt.id)
+    data["author_id"] = twitt.user.id
+    data["text"] = twitt.rawContent
+    data["created_at"] = twitt.date
+    return data
 
 
 class TwitterPuller:
@@ -69,19 +138,20 @@ class TwitterPuller:
     """
 
     @with_settings
-    def __init__(self):
+    def __init__(self, settings=None):
+        self.settings = settings
         self.api = get_api()
-        self.storage = sync_client.twitter
-        self.storage_data = sync_client.twitter_data
+        self.storage = database.sync_client.twitter
+        self.twitts = database.sync_client.twitter_data.twitts
 
     def _get_user_by_name(self, username: str):
         """
-
+        Return user data by username from Mongo.
         :param username:
         :return:
         """
         query = {"username": {"$eq": username}}
-        return self.storage.accounts.find(query)
+        return self.storage.accounts.find_one(query)
 
     def get_user_by_id(self, user_id: Union[str, int]):  # -> Account:
         """
@@ -89,165 +159,220 @@ class TwitterPuller:
         :param user_id:
         :return:
         """
-        query = {"id_str": {"$eq": user_id}}
-        return self.storage.accounts.find(query)
+        query = {"twitter_id": {"$eq": int(user_id)}}
+        return self.storage.accounts.find_one(query)
 
-    @with_limits
-    def _get_users(self, usernames: list) -> list[Account, None]:
+    @with_limits("users")
+    def _lookup_users(self, usernames: list) -> list[Account, None]:
+        """
+        Lookup up to 100 users in twitter by one call.
+        https://docs.tweepy.org/en/latest/api.html#tweepy.API.lookup_users
+        :param usernames:
+        :return:
+        """
         users = []
-        try:
-            _users = self.api.lookup_users(screen_name=usernames)
-            """
-            [
-                {
-                 'contributors_enabled': False,
-                 'created_at': 'Tue Jun 02 20:12:29 +0000 2009',
-                 'default_profile': False,
-                 'default_profile_image': False,
-                 'description': '',
-                 'entities': {'description': {'urls': []}},
-                 'favourites_count': 16798,
-                 'follow_request_sent': False,
-                 'followers_count': 124887908,
-                 'following': False,
-                 'friends_count': 165,
-                 'geo_enabled': False,
-                 'has_extended_profile': True,
-                 'id': 44196397,
-                 'id_str': '44196397',
-                 'is_translation_enabled': False,
-                 'is_translator': False,
-                 'lang': None,
-                 'listed_count': 106952,
-                 'location': '',
-                 'name': 'Elon Musk',
-                 'notifications': False,
-                 'profile_background_color': 'C0DEED',
-                 'profile_background_image_url': 'http://abs.twimg.com/images/themes/theme1/bg.png',
-                 'profile_background_image_url_https': 'https://abs.twimg.com/images/themes/theme1/bg.png',
-                 'profile_background_tile': False,
-                 'profile_banner_url': 'https://pbs.twimg.com/profile_banners/44196397/1576183471',
-                 'profile_image_url': 'http://pbs.twimg.com/profile_images/1590968738358079488/IY9Gx6Ok_normal.jpg',
-                 'profile_image_url_https': 'https://pbs.twimg.com/profile_images/1590968738358079488/IY9Gx6Ok_normal.jpg',
-                 'profile_link_color': '0084B4',
-                 'profile_location': None,
-                 'profile_sidebar_border_color': 'C0DEED',
-                 'profile_sidebar_fill_color': 'DDEEF6',
-                 'profile_text_color': '333333',
-                 'profile_use_background_image': True,
-                 'protected': False,
-                 'screen_name': 'elonmusk',
-                 'status': {'contributors': None,
-                            'coordinates': None,
-                            'created_at': 'Sun Jan 08 01:05:44 +0000 2023',
-                            'entities': {'hashtags': [],
-                                         'symbols': [],
-                                         'urls': [],
-                                         'user_mentions': [{'id': 14710129,
-                                                            'id_str': '14710129',
-                                                            'indices': [0, 15],
-                                                            'name': 'Peter H. Diamandis, MD',
-                                                            'screen_name': 'PeterDiamandis'}]},
-                            'favorite_count': 2907,
-                            'favorited': False,
-                            'geo': None,
-                            'id': 1611891871512514560,
-                            'id_str': '1611891871512514560',
-                            'in_reply_to_screen_name': 'PeterDiamandis',
-                            'in_reply_to_status_id': 1611867056768532481,
-                            'in_reply_to_status_id_str': '1611867056768532481',
-                            'in_reply_to_user_id': 14710129,
-                            'in_reply_to_user_id_str': '14710129',
-                            'is_quote_status': False,
-                            'lang': 'en',
-                            'place': None,
-                            'retweet_count': 185,
-                            'retweeted': False,
-                            'source': '<a href="http://twitter.com/download/iphone" '
-                                      'rel="nofollow">Twitter for iPhone</a>',
-                            'text': '@PeterDiamandis Risky Business (great movie)',
-                            'truncated': False},
-                 'statuses_count': 21995,
-                 'time_zone': None,
-                 'translator_type': 'none',
-                 'url': None,
-                 'utc_offset': None,
-                 'verified': True,
-                 'withheld_in_countries': []
-                },
-            ]
-            """
-            for _user in _users:
-                users.append(
-                    Account.construct(
-                        twitter_id=_user.id,
-                        name=_user.name,
-                        username=_user.screen_name,
-                        following_count=_user.favourites_count,
-                        followers_count=_user.followers_count,
-                        description=_user.description,
-                        twitts_count=_user.statuses_count,
-                        status="new",
-                    )
+        _users = self.api.lookup_users(screen_name=usernames)
+        """
+        [
+            {
+             'contributors_enabled': False,
+             'created_at': 'Tue Jun 02 20:12:29 +0000 2009',
+             'default_profile': False,
+             'default_profile_image': False,
+             'description': '',
+             'entities': {'description': {'urls': []}},
+             'favourites_count': 16798,
+             'follow_request_sent': False,
+             'followers_count': 124887908,
+             'following': False,
+             'friends_count': 165,
+             'geo_enabled': False,
+             'has_extended_profile': True,
+             'id': 44196397,
+             'id_str': '44196397',
+             'is_translation_enabled': False,
+             'is_translator': False,
+             'lang': None,
+             'listed_count': 106952,
+             'location': '',
+             'name': 'Elon Musk',
+             'notifications': False,
+             'profile_background_color': 'C0DEED',
+             'profile_background_image_url': 'http://abs.twimg.com/images/themes/theme1/bg.png',
+             'profile_background_image_url_https': 'https://abs.twimg.com/images/themes/theme1/bg.png',
+             'profile_background_tile': False,
+             'profile_banner_url': 'https://pbs.twimg.com/profile_banners/44196397/1576183471',
+             'profile_image_url': 'http://pbs.twimg.com/profile_images/1590968738358079488/IY9Gx6Ok_normal.jpg',
+             'profile_image_url_https': 'https://pbs.twimg.com/profile_images/1590968738358079488/IY9Gx6Ok_normal.jpg',
+             'profile_link_color': '0084B4',
+             'profile_location': None,
+             'profile_sidebar_border_color': 'C0DEED',
+             'profile_sidebar_fill_color': 'DDEEF6',
+             'profile_text_color': '333333',
+             'profile_use_background_image': True,
+             'protected': False,
+             'screen_name': 'elonmusk',
+             'status': {'contributors': None,
+                        'coordinates': None,
+                        'created_at': 'Sun Jan 08 01:05:44 +0000 2023',
+                        'entities': {'hashtags': [],
+                                     'symbols': [],
+                                     'urls': [],
+                                     'user_mentions': [{'id': 14710129,
+                                                        'id_str': '14710129',
+                                                        'indices': [0, 15],
+                                                        'name': 'Peter H. Diamandis, MD',
+                                                        'screen_name': 'PeterDiamandis'}]},
+                        'favorite_count': 2907,
+                        'favorited': False,
+                        'geo': None,
+                        'id': 1611891871512514560,
+                        'id_str': '1611891871512514560',
+                        'in_reply_to_screen_name': 'PeterDiamandis',
+                        'in_reply_to_status_id': 1611867056768532481,
+                        'in_reply_to_status_id_str': '1611867056768532481',
+                        'in_reply_to_user_id': 14710129,
+                        'in_reply_to_user_id_str': '14710129',
+                        'is_quote_status': False,
+                        'lang': 'en',
+                        'place': None,
+                        'retweet_count': 185,
+                        'retweeted': False,
+                        'source': '<a href="http://twitter.com/download/iphone" '
+                                  'rel="nofollow">Twitter for iPhone</a>',
+                        'text': '@PeterDiamandis Risky Business (great movie)',
+                        'truncated': False},
+             'statuses_count': 21995,
+             'time_zone': None,
+             'translator_type': 'none',
+             'url': None,
+             'utc_offset': None,
+             'verified': True,
+             'withheld_in_countries': []
+            },
+        ]
+        """
+        for _user in _users:
+            users.append(
+                Account.construct(
+                    twitter_id=_user.id,
+                    name=_user.name,
+                    username=_user.screen_name,
+                    following_count=_user.favourites_count,
+                    followers_count=_user.followers_count,
+                    description=_user.description,
+                    twitts_count=_user.statuses_count,
+                    status="new",
                 )
-        except BaseException:
-            log.error("Error of lookup users in twitter!")
+            )
         return users
 
+    def _get_users(self, usernames: list) -> tuple[list[Account], list[str]]:
+        """
+        Lookup users in twitter by chunks of 100 names in parallel.
+        Chunks failed by transient errors retried one by one,
+        chunk with answer 404 has no found users and not retried.
+        :param usernames:
+        :return: users and names not looked up because of limits
+        """
+        usernames = list(usernames)
+        chunks = [
+            usernames[i : i + LOOKUP_USERS_LIMIT]
+            for i in range(0, len(usernames), LOOKUP_USERS_LIMIT)
+        ]
+        if not chunks:
+            return [], []
+
+        users = []
+        failed = []
+        limited = []
+        workers = min(self.settings.TWITTER_LOOKUP_WORKERS, len(chunks))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self._lookup_users, chunk): chunk for chunk in chunks
+            }
+            for future in as_completed(futures):
+                try:
+                    users.extend(future.result())
+                except RateLimited:
+                    limited.extend(futures[future])
+                except tweepy.NotFound:
+                    log.info("Users of chunk not found in twitter.")
+                except BaseException as error:
+                    if _is_transient(error):
+                        failed.append(futures[future])
+                    else:
+                        log.error("Error of lookup users in twitter: %r", error)
+
+        for chunk in failed:
+            for attempt in range(1, self.settings.TWITTER_LOOKUP_RETRIES + 1):
+                try:
+                    users.extend(self._lookup_users(chunk))
+                    break
+                except RateLimited:
+                    limited.extend(chunk)
+                    break
+                except tweepy.NotFound:
+                    break
+                except BaseException as error:
+                    if not _is_transient(error):
+                        log.error("Error of lookup users in twitter: %r", error)
+                        break
+                    log.warning("Lookup users failed, attempt %s.", attempt)
+            else:
+                log.error("Error of lookup users in twitter: %s", chunk)
+        return users, limited
+
     def _scrapp_users(self, usernames: list) -> list[Account, None]:
         """
-        Scrapp users from twitter.
+        Scrapp users from twitter in threads by pool of proxies.
         :param usernames:
         :return:
         """
         new_users_data = []
         try:
-            from snscrape.modules.twitter import TwitterUserScraper
-
-            for user_name in usernames:
-                # TODO add proxy to env or other file or endpoint
-                # _data = TwitterUserScraper(user=user_name, proxies={}).get_items()
-                _data = TwitterUserScraper(user=user_name).get_items()
-                _user = _data.gi_frame.f_locals["self"].entity
-                """
-                User(
-                    username = 'elonmusk',
-                    id = 44196397,
-                    displayname = 'Elon Musk',
-                    rawDescription = '',
-                    renderedDescription = '',
-                    descriptionLinks = [],
-                    verified = True,
-                    created = datetime.datetime(2009, 6, 2, 20, 12, 29, tzinfo = datetime.timezone.utc),
-                    followersCount = 129994028,
-                    friendsCount = 181,
-                    statusesCount = 23224,
-                    favouritesCount = 18901,
-                    listedCount = 115282,
-                    mediaCount = 1424,
-                    location = '',
-                    protected = False,
-                    link = None,
-                    profileImageUrl = 'https://pbs.twimg.com/profile_images/1590968738358079488/IY9Gx6Ok_normal.jpg',
-                    profileBannerUrl = 'https://pbs.twimg.com/profile_banners/44196397/1576183471',
-                    label = None
-                    )
-                """
-                new_users_data.append(
-                    Account.construct(
-                        twitter_id=_user.id,
-                        name=_user.displayname,
-                        username=_user.username,
-                        following_count=_user.favouritesCount,
-                        followers_count=_user.followersCount,
-                        description=_user.rawDescription,
-                        twitts_count=_user.statusesCount,
-                        status="new",
-                    )
-                )
+            users = scraper_pool.scrap_users(list(usernames))
         except BaseException:
             log.error("Bad response from twitter, scrapper not working..")
+            return new_users_data
 
+        for _user in users:
+            """
+            User(
+                username = 'elonmusk',
+                id = 44196397,
+                displayname = 'Elon Musk',
+                rawDescription = '',
+                renderedDescription = '',
+                descriptionLinks = [],
+                verified = True,
+                created = datetime.datetime(2009, 6, 2, 20, 12, 29, tzinfo = datetime.timezone.utc),
+                followersCount = 129994028,
+                friendsCount = 181,
+                statusesCount = 23224,
+                favouritesCount = 18901,
+                listedCount = 115282,
+                mediaCount = 1424,
+                location = '',
+                protected = False,
+                link = None,
+                profileImageUrl = 'https://pbs.twimg.com/profile_images/1590968738358079488/IY9Gx6Ok_normal.jpg',
+                profileBannerUrl = 'https://pbs.twimg.com/profile_banners/44196397/1576183471',
+                label = None
+                )
+            """
+            new_users_data.append(
+                Account.construct(
+                    twitter_id=_user.id,
+                    name=_user.displayname,
+                    username=_user.username,
+                    following_count=_user.favouritesCount,
+                    followers_count=_user.followersCount,
+                    description=_user.rawDescription,
+                    twitts_count=_user.statusesCount,
+                    status="new",
+                )
+            )
         return new_users_data
 
     def get_users_data(self, usernames: list) -> None:
@@ -256,43 +381,91 @@ class TwitterPuller:
         :param usernames: list
         :return:
         """
-        if self.api:
-            users = self._get_users(usernames)
-        else:
-            users = self._scrapp_users(usernames)
-
-        if not users:
+        # names looked up by other worker now, sessions get status from it
+        lease_names = {leases.lookup_lease(name): name for name in usernames}
+        token, taken = leases.acquire_many(lease_names, self.settings.LEASE_LOOKUP_TTL)
+        if len(taken) < len(lease_names):
+            log.info("Skip %s users in lookup.", len(lease_names) - len(taken))
+        usernames = [lease_names[name] for name in taken]
+        if not usernames:
+            return
+
+        limited = []
+        try:
+            if self.api:
+                users, limited = self._get_users(usernames)
+            else:
+                users = self._scrapp_users(usernames)
+        finally:
+            leases.release_many(taken, token)
+
+        found = {user.username.lower() for user in users}
+        pending = {username.lower() for username in limited}
+        not_found = {username.lower() for username in usernames} - found - pending
+        progress.set_accounts_status(
+            self.storage.tasks, not_found, progress.STATUS_NOT_FOUND
+        )
+        if not users and not limited:
             raise InternalError
 
-        query = {"username": {"$in": usernames}}
+        query = {"username": {"$in": [user.username for user in users]}}
         params = {"username": 1, "twitts_count": 1}
         accounts = self.storage.accounts.find(query, params)
         accounts_exist = {
-            account["usename"]: account["twitts_count"] for account in accounts
+            account["username"]: account["twitts_count"] for account in accounts
         }
 
+        # sync of account running now, sync set updated status when finished
+        syncing = leases.held_many(
+            lease
+            for user in users
+            for lease in (
+                leases.pull_lease(user.twitter_id),
+                leases.backfill_lease(user.username),
+            )
+        )
+
         users_for_pull_data = []
         query = []
         for user in users:
-            if accounts_exist.get(user.username):
-                _filter = {"username": user.username}
-                query.append(UpdateOne(_filter, {"$set": user.dict()}))
-                if user.twitts_count != accounts_exist.get(user.username):
-                    users_for_pull_data.append(user.id)
+            if user.twitts_count != accounts_exist.get(user.username):
+                user.status = progress.STATUS_PULLING
+                users_for_pull_data.append(user)
+            elif (
+                leases.pull_lease(user.twitter_id) in syncing
+                or leases.backfill_lease(user.username) in syncing
+            ):
+                user.status = progress.STATUS_PULLING
             else:
-                InsertOne(user.dict())
-                users_for_pull_data.append(user.id)
+                user.status = progress.STATUS_UPDATED
+            _filter = {"username": user.username}
+            _data = user.dict(exclude={"id"})
+            query.append(UpdateOne(_filter, {"$set": _data}, upsert=True))
 
         if query:
-            self.storage.accounts.bulk_write(query)
+            self.storage.accounts.bulk_write(query, ordered=False)
+            # requested names can differ from names in twitter
+            cache.invalidate_accounts({*usernames, *(user.username for user in users)})
+
+        for status in (progress.STATUS_PULLING, progress.STATUS_UPDATED):
+            progress.set_accounts_status(
+                self.storage.tasks,
+                [user.username for user in users if user.status == status],
+                status,
+            )
 
         if users_for_pull_data:
-            from celery_twitter import start_pull_from_twitter
+            from app.celery_twitter import start_pull_from_twitter
+
+            for user in users_for_pull_data:
+                start_pull_from_twitter.delay(user.twitter_id)
 
-            for user in users:
-                start_pull_from_twitter.delay(user.id)
+        if limited:
+            # saved users done, other users after one token of limit refilled
+            wait = max(TTL / TWITTER_LIMITS["users"], 1)
+            raise RateLimited(wait, pending=limited)
 
-    @with_limits
+    @with_limits("twitts")
     def _get_twitts_by_id(self, ids: list) -> list:
         """
         Return up to 100 twitt objs by IDs.
@@ -307,127 +480,288 @@ class TwitterPuller:
             log.error("Error lookup statuses")
         return statuses
 
-    @with_limits
-    def _get_twitts(self, user_id: int, since_id: int = None) -> list:
+    @with_limits("twitts")
+    def _get_twitts(
+        self,
+        user_id: int,
+        since_id: int = None,
+        max_id: int = None,
+    ) -> list:
         """
-        Return 20 twitts by user id.
+        Return up to 200 twitts by user id, newer than since_id, not newer than max_id.
+        https://docs.tweepy.org/en/latest/api.html#tweepy.API.user_timeline
         :param user_id:
         :param since_id:
+        :param max_id:
         :return:
         """
-        try:
-            result = self.api.user_timeline(user_id=user_id, since_id=since_id)
-            if result:
-                return result
-            else:
-                return []
-        except BaseException:
-            log.error("Get user timeline error!")
-
-    def _remove_twitts_repits(
-        self,
-        user_id: Union[str, int],
-        twitts: list,
-    ) -> None:
+        result = self.api.user_timeline(
+            user_id=user_id,
+            since_id=since_id,
+            max_id=max_id,
+            count=TIMELINE_PAGE_SIZE,
+        )
+        return result or []
+
+    def _set_updated(self, account: dict) -> None:
         """
-        Remove dublicate twitts from DB.
-        :rtype: object
-        :param user_id:
-        :param twitts:
+        Mark sync of account finished, in account and in all sessions.
+        :param account:
         """
-
-        def _write(_data):
-            self.storage_data[f"{user_id}"].bulk_write(_data, ordered=False)
-
-        seen = set()
-        must_delete = []
-        for twitt in twitts:
-            if twitt in seen:
-                must_delete.append(DeleteOne({"_id": twitt.id}))
-                if len(must_delete) == 500:
-                    _write(must_delete)
-                    must_delete.clear()
-            else:
-                seen.add(twitt)
-        _write(must_delete)
-
-    def _get_twitts_by_user_id(self, user_id: Union[str, int]) -> set:
+        self.storage.accounts.update_one(
+            {"_id": account["_id"]},
+            {"$set": {"status": progress.STATUS_UPDATED}},
+        )
+        progress.set_accounts_status(
+            self.storage.tasks, [account["username"]], progress.STATUS_UPDATED
+        )
+
+    def _save_twitts(self, author_id: int, twitts: list) -> int:
         """
-        Get twitts from Mongo DB by user_id
-        :param user_id:
-        :return:
+        Save new twitts of one author. Known twitts skipped by index in REDIS,
+        other twitts already in DB skipped by unique index on twitt id.
+        :param author_id:
+        :param twitts: documents for collection of twitts
+        :return: count of saved twitts
         """
-        collection_exists = self.storage_data.validate_collection(f"{user_id}")
-        _result = set()
-        twitts = []
-        if collection_exists:
-            twitts = self.storage_data[f"{user_id}"].find()
-            if len(twitts):
-                _result = {twitt_id["id_str"] for twitt_id in twitts}
-
-        if len(twitts) != len(_result):
-            self._remove_twitts_repits(user_id, twitts)
-        return _result
+        ids = [twitt["id"] for twitt in twitts]
+        known = cache.known_twitts(author_id, ids, self.twitts)
+        twitts = [twitt for twitt in twitts if twitt["id"] not in known]
+        if not twitts:
+            return 0
+        try:
+            result = self.twitts.insert_many(twitts, ordered=False)
+            saved = len(result.inserted_ids)
+        except BulkWriteError as error:
+            errors = error.details["writeErrors"]
+            if any(_error["code"] != DUPLICATE_KEY_ERROR for _error in errors):
+                raise
+            saved = error.details["nInserted"]
+        # all twitts in DB now, saved or found as duplicates
+        cache.add_known_twitts(author_id, [twitt["id"] for twitt in twitts])
+        return saved
 
     def pull_data(self, user_id: int) -> None:
         """
-        Download all user twitts.
+        Download new user twitts from twitter timeline.
+        Pages go from newest twitt to last_twitt_id saved in account on previous sync,
+        so sync cost depends on count of new twitts only.
+        If limits over, progress saved in pull_cursor and sync resumed on retry.
         :param user_id:
         """
-        result = self._get_twitts(user_id)
-        twitts_ids = self._get_twitts_by_user_id(user_id)
-
-        if not twitts_ids:
-            log.info("New data")
-            data = [InsertOne(twitt._json) for twitt in result]
+        started = time.monotonic()
+        user_id = int(user_id)
+        lease = leases.pull_lease(user_id)
+        token = leases.acquire(lease, self.settings.LEASE_PULL_TTL)
+        if not token:
+            log.info("User %s pulled by other worker.", user_id)
+            return
+        try:
+            account, saved = self._pull_new_twitts(user_id)
+        finally:
+            leases.release(lease, token)
+        log.info(
+            "Saved %s new twitts of user %s in %.1f s.",
+            saved,
+            user_id,
+            time.monotonic() - started,
+        )
+
+        if not account:
+            return
+        if not (account.get("backfill") or {}).get("done"):
+            from app.celery_twitter import add_scrapper_task
+
+            add_scrapper_task.delay(account["username"])
         else:
-            data = [
-                InsertOne(twitt._json)
-                for twitt in result
-                if twitt.id_str not in twitts_ids
-            ]
+            self._set_updated(account)
 
-        if data:
-            self.storage_data[f"{user_id}"].bulk_write(data)
+    def _pull_new_twitts(self, user_id: int) -> tuple[dict, int]:
+        """
+        Save twitts from newest to last_twitt_id of account.
+        :param user_id:
+        :return: account before sync and count of saved twitts
+        """
+        account = self.get_user_by_id(user_id) or {}
+        since_id = account.get("last_twitt_id")
+        cursor = account.get("pull_cursor") or {}
+        max_id = cursor.get("max_id")
+        newest_id = cursor.get("newest_id") or since_id
+
+        _filter = {"twitter_id": user_id}
+        saved = 0
+        try:
+            while True:
+                page = self._get_twitts(user_id, since_id=since_id, max_id=max_id)
+                if not page:
+                    break
+                saved += self._save_twitts(
+                    user_id, [twitt_from_status(twitt) for twitt in page]
+                )
+                page_ids = [twitt.id for twitt in page]
+                newest_id = max(newest_id or 0, *page_ids)
+                max_id = min(page_ids) - 1
+        except RateLimited:
+            cursor = {"max_id": max_id, "newest_id": newest_id}
+            self.storage.accounts.update_one(_filter, {"$set": {"pull_cursor": cursor}})
+            raise
+
+        now = datetime.utcnow()
+        data = {"last_twitt_id": newest_id, "synced_at": now}
+        if account.get("synced_at"):
+            hours = max((now - account["synced_at"]).total_seconds() / 3600, 1 / 60)
+            data["velocity"] = update_velocity(account.get("velocity"), saved, hours)
+        self.storage.accounts.update_one(
+            _filter,
+            {"$set": data, "$unset": {"pull_cursor": ""}},
+        )
+        return account, saved
+
+    def schedule_updates(self) -> list[int]:
+        """
+        Choose accounts for sync by expected new twitts: velocity * time since sync.
+        Accounts with most new twitts chosen first while expected calls
+        fit in share of twitts limit left now. Chosen accounts marked
+        as scheduled and not chosen again for TTL.
+        :return: twitter ids of chosen accounts
+        """
+        budget = int(available("twitts") * self.settings.SCHEDULER_BUDGET_SHARE)
+        if budget <= 0:
+            return []
+
+        now = datetime.utcnow()
+        synced_before = now - timedelta(seconds=TTL)
+        velocity = {
+            "$max": [{"$ifNull": ["$velocity", DEFAULT_VELOCITY]}, MIN_VELOCITY]
+        }
+        hours = {"$divide": [{"$subtract": [now, "$synced_at"]}, 3600 * 1000]}
+        pipeline = [
+            {
+                "$match": {
+                    "backfill.done": True,
+                    "synced_at": {"$lt": synced_before},
+                    "$or": [
+                        {"scheduled_at": {"$exists": False}},
+                        {"scheduled_at": {"$lt": synced_before}},
+                    ],
+                }
+            },
+            {
+                "$project": {
+                    "twitter_id": 1,
+                    "expected": {"$multiply": [velocity, hours]},
+                }
+            },
+            {"$match": {"expected": {"$gte": self.settings.SCHEDULER_MIN_EXPECTED}}},
+            {"$sort": {"expected": -1}},
+            # every sync cost one call at least
+            {"$limit": budget},
+        ]
+        chosen = []
+        for account in self.storage.accounts.aggregate(pipeline):
+            cost = pull_cost(account["expected"])
+            if cost <= budget:
+                budget -= cost
+                chosen.append(account)
+
+        if chosen:
+            self.storage.accounts.update_many(
+                {"_id": {"$in": [account["_id"] for account in chosen]}},
+                {"$set": {"scheduled_at": now}},
+            )
+        return [account["twitter_id"] for account in chosen]
 
-        from celery_twitter import add_scrapper_task
+    def _iter_scrapped_twitts(self, query: str) -> Iterator[dict]:
+        """
+        Stream of twitts from twitter search, newest first.
+        :param query: search query
+        :return:
+        """
+        for twitt in sntwitter.TwitterSearchScraper(query).get_items():
+            yield twitt_from_scrapper(twitt)
 
-        add_scrapper_task.delay(self.get_user_by_id(user_id))
+    def _save_backfill_checkpoint(self, account: dict, batch: list) -> None:
+        """
+        Save oldest twitt of saved batch as progress of backfill.
+        :param account:
+        :param batch:
+        """
+        oldest = min(batch, key=lambda twitt: twitt["id"])
+        self.storage.accounts.update_one(
+            {"_id": account["_id"]},
+            {
+                "$set": {
+                    "backfill.oldest_id": oldest["id"],
+                    "backfill.oldest_date": oldest["created_at"],
+                }
+            },
+        )
 
     def scrap_user_data(
-        self, username: str, start_time: str = "", end_time: str = END_TIME
+        self,
+        username: str,
+        start_time: str = "",
+        end_time: str = END_TIME,
+        max_batches: Optional[int] = None,
+        lease_token: Optional[str] = None,
     ):
         """
         Run scraper for twitter by username(scenename) in twitter.
+        Twitts saved by batches, after every batch oldest saved twitt is checkpoint
+        in account (backfill.oldest_id), task restarted from checkpoint.
+        After max_batches batches next chunk sent to queue, so short tasks
+        of other accounts run between chunks. Lease of backfill passed
+        to next chunk, other tasks for account skipped.
         :param username:
-        :param start_time:
+        :param start_time: first day of search if no checkpoint, today by default
         :param end_time:
-        :return:
+        :param max_batches: batches in one chunk, all by default
+        :param lease_token: lease of previous chunk
+        :return: True if backfill done
         """
+        lease = leases.backfill_lease(username)
+        token = leases.acquire(lease, self.settings.LEASE_BACKFILL_TTL, lease_token)
+        if not token:
+            log.info("User %s scrapped by other worker.", username)
+            return False
         try:
-            if not start_time:
-                start_time = datetime.today().strftime("%Y-%m-%d")
             account = self._get_user_by_name(username)
-            twitts_id_set = self._get_twitts_by_user_id(account.twitter_id)
-
-            if account.twitts_count == len(twitts_id_set):
+            if not account:
+                log.error("Account %s not found for scrap.", username)
+                leases.release(lease, token)
+                return False
+
+            author_id = int(account["twitter_id"])
+            backfill = account.get("backfill") or {}
+            if not backfill.get("done"):
+                count = self.twitts.count_documents({"author_id": author_id})
                 # If all twitts updated exit from task
-                if account.status != "updated":
-                    account.status = "updated"
-                    _filter = {"_id": account.username}
-                    self.storage.UpdateOne(_filter, {"$set": account.dict()})
-                return True
-
-            query = f"(from:{username}) until:{start_time} since:{end_time}"
-            new_twitts = []
-            butch_count = 500
-            for twitt in sntwitter.TwitterSearchScraper(query).get_items():
-                if twitt.id not in twitts_id_set:
-                    new_twitts.append(InsertOne(twitt.json()))
-                    twitts_id_set.add(twitt.id)
-                if len(new_twitts) == butch_count:
-                    collection = f"{account.twitter_id}"
-                    self.storage_data[collection].bulk_write(new_twitts)
-                    new_twitts.clear()
+                if count < account["twitts_count"]:
+                    query = f"(from:{username}) since:{end_time}"
+                    if backfill.get("oldest_id"):
+                        query += f" max_id:{backfill['oldest_id'] - 1}"
+                    elif start_time:
+                        query += f" until:{start_time}"
+
+                    twitts = self._iter_scrapped_twitts(query)
+                    batches = batched(twitts, BACKFILL_BATCH_SIZE)
+                    for number, batch in enumerate(batches, 1):
+                        self._save_twitts(author_id, batch)
+                        self._save_backfill_checkpoint(account, batch)
+                        if number == max_batches:
+                            from app.celery_twitter import add_scrapper_task
+
+                            add_scrapper_task.delay(username, token)
+                            return False
+
+            self.storage.accounts.update_one(
+                {"_id": account["_id"]},
+                {"$set": {"backfill.done": True}},
+            )
+            leases.release(lease, token)
+            self._set_updated(account)
+            return True
         except BaseException:
+            # retry of task take lease again
+            leases.release(lease, token)
             raise TaskFaled
@@ -0,0 +1,149 @@
+"""
+Pool of proxies for scraper of twitter.
+
+Profiles scraped in threads, every thread take proxy from pool:
+proxy used by SCRAPER_PROXY_CONCURRENCY threads at once at most,
+after error proxy not used for SCRAPER_PROXY_COOLDOWN seconds
+(doubled for every next error in row). Without proxies scraper
+use direct connection with same limits.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from snscrape.modules.twitter import TwitterUserScraper
+
+from app.config import get_settings
+
+log = logging.getLogger(__name__)
+
+# max cooldown of proxy after many errors in row, seconds
+MAX_COOLDOWN = 30 * 60
+
+
+class ProxyPool:
+    """
+    Proxies with limit of concurrent requests and cooldown after errors.
+    """
+
+    def __init__(self, proxies: list[Optional[str]], concurrency: int, cooldown: float):
+        self.proxies = proxies or [None]
+        self.concurrency = concurrency
+        self.cooldown = cooldown
+        self._in_use = [0] * len(self.proxies)
+        self._errors = [0] * len(self.proxies)
+        self._cool_until = [0.0] * len(self.proxies)
+        self._next = 0
+        self._condition = threading.Condition()
+
+    @property
+    def size(self) -> int:
+        """
+        Max requests at once by all proxies.
+        """
+        return len(self.proxies) * self.concurrency
+
+    def _take(self) -> Optional[int]:
+        now = time.monotonic()
+        for shift in range(len(self.proxies)):
+            index = (self._next + shift) % len(self.proxies)
+            if (
+                self._in_use[index] < self.concurrency
+                and self._cool_until[index] <= now
+            ):
+                self._next = index + 1
+                self._in_use[index] += 1
+                return index
+        return None
+
+    def _wait_time(self) -> Optional[float]:
+        # proxy with free slots can be cooling down, wake up when it ready
+        now = time.monotonic()
+        cooling = [
+            until - now
+            for until, in_use in zip(self._cool_until, self._in_use)
+            if until > now and in_use < self.concurrency
+        ]
+        return min(cooling) if cooling else None
+
+    @contextmanager
+    def lease(self) -> Iterator[Optional[dict]]:
+        """
+        Take proxy for one request, wait if all proxies busy or cooling down.
+        Error in block start cooldown of proxy.
+        :return: proxies for requests or None for direct connection
+        """
+        with self._condition:
+            while (index := self._take()) is None:
+                self._condition.wait(self._wait_time())
+        proxy = self.proxies[index]
+        try:
+            yield {"http": proxy, "https": proxy} if proxy else None
+        except BaseException:
+            with self._condition:
+                self._errors[index] += 1
+                cooldown = self.cooldown * 2 ** (self._errors[index] - 1)
+                self._cool_until[index] = time.monotonic() + min(cooldown, MAX_COOLDOWN)
+            log.warning("Proxy %s failed, cooldown %s s.", proxy, cooldown)
+            raise
+        else:
+            with self._condition:
+                self._errors[index] = 0
+        finally:
+            with self._condition:
+                self._in_use[index] -= 1
+                self._condition.notify_all()
+
+
+@lru_cache()
+def get_proxy_pool() -> ProxyPool:
+    """
+    Return pool of proxies of current process.
+    :return: ProxyPool
+    """
+    settings = get_settings()
+    return ProxyPool(
+        settings.SCRAPER_PROXIES,
+        settings.SCRAPER_PROXY_CONCURRENCY,
+        settings.SCRAPER_PROXY_COOLDOWN,
+    )
+
+
+def scrap_user(username: str, pool: ProxyPool, retries: int):
+    """
+    Return profile of user from scraper, on errors retried with next proxy.
+    :param username:
+    :param pool:
+    :param retries:
+    :return: snscrape User or None if user not found
+    """
+    for attempt in range(retries + 1):
+        try:
+            with pool.lease() as proxies:
+                return TwitterUserScraper(username, proxies=proxies, retries=0).entity
+        except Exception as error:
+            log.warning("Scrap of %s failed, attempt %s: %s", username, attempt, error)
+    log.error("Profile of %s not scraped.", username)
+    return None
+
+
+def scrap_users(usernames: list[str], pool: Optional[ProxyPool] = None) -> list:
+    """
+    Scrap profiles of users in threads, threads limited by size of proxy pool.
+    :param usernames:
+    :param pool: pool of current process by default
+    :return: snscrape Users of found users
+    """
+    if not usernames:
+        return []
+    if pool is None:
+        pool = get_proxy_pool()
+    retries = get_settings().SCRAPER_RETRIES
+    workers = min(pool.size, len(usernames))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        users = executor.map(lambda name: scrap_user(name, pool, retries), usernames)
+        return [user for user in users if user]
@@ -1,22 +1,31 @@
 """
 Service layer for app
 """
+import asyncio
 import functools
+import json
 import logging
 import re
-from typing import Union, Optional, Any, Callable
+from datetime import datetime, timedelta, timezone
+from typing import Union, Optional, Any, Callable, AsyncIterator
 
 from fastapi.encoders import jsonable_encoder
+from pymongo import ASCENDING, DESCENDING
 from pymongo.errors import PyMongoError
 
-from app import database, celery_twitter
+from app import database, celery_twitter, cache, progress, webhooks
+from app.config import with_settings
+from app.database import USERNAME_COLLATION
+from app.loaders import DataLoader
 from app.models import (
     Account,
     AccountStatus,
     SyncTask,
     InternalError,
     Session,
+    SessionSummary,
     ProfilesList,
+    TwittsPage,
 )
 
 log = logging.getLogger(__name__)
@@ -25,6 +34,24 @@ log = logging.getLogger(__name__)
 TWITTER_USERNAME_REGEX = re.compile(r"^(?!.*\.\.)(?!.*\.$)[^\W][\w.]{0,15}$")
 TWITTER_STR_REGEX = re.compile(r"(?:https?://)?(?:www\.)?twitter\.com/(\w+)/?")
 
+# start of twitter snowflake ids in ms (2010-11-04)
+TWITTER_EPOCH_MS = 1288834974657
+
+# fields of twitt in export and twitts read from Mongo per batch
+EXPORT_FIELDS = {
+    "_id": 0,
+    "id": 1,
+    "id_str": 1,
+    "author_id": 1,
+    "text": 1,
+    "created_at": 1,
+    "lang": 1,
+}
+EXPORT_BATCH_SIZE = 1000
+
+# max users on page of session status
+MAX_SESSION_USERS = 1000
+
 
 def standart_exceptions(func: Callable[..., Any]) -> Callable[..., Any]:
     """
@@ -49,38 +76,165 @@ def standart_exceptions(func: Callable[..., Any]) -> Callable[..., Any]:
 @standart_exceptions
 async def get_status_by_session(
     session_id: str,
-) -> Union[list[AccountStatus], None]:
+    offset: int = 0,
+    limit: Optional[int] = None,
+    summary: bool = False,
+) -> Union[list[AccountStatus], SessionSummary, None]:
     """
-    Return
+    Return statuses of users in session, page of users or only counters by status.
+    One read of session document by _id.
     :param session_id: str of Session ID(Task ID)
+    :param offset: first user on page
+    :param limit: users on page, all users by default
+    :param summary: return only counters of users by status
     :return:
     """
-    # load from Mongo by session_id
     query = {"_id": {"$eq": session_id}}
+    if summary:
+        projection = {"total": 1, "counters": 1}
+    elif offset or limit:
+        projection = {"users": {"$slice": [offset, limit or MAX_SESSION_USERS]}}
+    else:
+        projection = {"users": 1}
 
-    task = await database.a_db.tasks.find_one(query)
+    task = await database.for_reads(database.a_db).tasks.find_one(query, projection)
+    if not task:
+        # new session can be not yet on secondary
+        task = await database.a_db.tasks.find_one(query, projection)
     if not task:
         return []
-    # find all account from task
-    query = {"username": {"$in": task["users_list"]}}
-    accounts = database.a_db.accounts.find(query)
-    return [account async for account in accounts]
+    if summary:
+        return SessionSummary(
+            session_id=str(task["_id"]),
+            total=task["total"],
+            counters=task["counters"],
+        )
+    return task["users"]
 
 
 @standart_exceptions
 async def get_user_data_by_username(username: str) -> Union[Account, None]:
     """
-    Load user data from DB
+    Load user data from cache or DB
 
     :param username:
     :return:
     """
-    query = {"username": {"$eq": username}}
-    account = await database.a_db.accounts.find_one(query)
+    account, version = await asyncio.to_thread(cache.lookup_account, username)
+    if account is not cache.NOT_CACHED:
+        return account
+
+    account = await accounts_loader.load(username)
+    await asyncio.to_thread(cache.store_account, username, account, version)
     if account:
         return account
 
 
+async def _load_accounts(usernames: list[str]) -> dict[str, dict]:
+    """
+    Return accounts by usernames, by one query to primary.
+    Accounts written to cache, secondary can return account before sync
+    and it would be cached after invalidation by sync.
+    :param usernames:
+    :return:
+    """
+    cursor = database.a_db.accounts.find({"username": {"$in": usernames}})
+    return {account["username"]: account async for account in cursor}
+
+
+accounts_loader = DataLoader(_load_accounts)
+
+
+@standart_exceptions
+async def get_twitts_by_twitter_id(
+    twitter_id: str,
+    limit: int = 10,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+) -> TwittsPage:
+    """
+    Return page of twitts by twitter id, newest first.
+    Page is found by index (author_id, id), so any page costs like first one.
+    :param twitter_id:
+    :param limit: twitts on page
+    :param before_id: return twitts older than this id
+    :param after_id: return twitts newer than this id
+    :return:
+    """
+    if not twitter_id.isdigit():
+        return TwittsPage(twitts=[])
+
+    key = (int(twitter_id), limit, before_id, after_id)
+    twitts = await twitts_loader.load(key)
+    has_more = len(twitts) > limit
+    twitts = twitts[:limit]
+    if after_id is not None:
+        twitts.reverse()
+
+    page = TwittsPage(twitts=[twitt["text"] for twitt in twitts])
+    if twitts:
+        if has_more or after_id is not None:
+            page.next_cursor = str(twitts[-1]["id"])
+        if before_id is not None or (after_id is not None and has_more):
+            page.prev_cursor = str(twitts[0]["id"])
+    return page
+
+
+def _twitts_page_pipeline(key: tuple, batch: int) -> list[dict]:
+    """
+    Return pipeline for page of twitts, found by index (author_id, id).
+    One twitt more than limit, for check of next page.
+    :param key: author_id, limit, before_id, after_id
+    :param batch: number of page in batch
+    :return:
+    """
+    author_id, limit, before_id, after_id = key
+    query = {"author_id": author_id}
+    id_range = {}
+    if before_id is not None:
+        id_range["$lt"] = before_id
+    if after_id is not None:
+        id_range["$gt"] = after_id
+    if id_range:
+        query["id"] = id_range
+
+    # twitts next after after_id are oldest of newer twitts
+    order = ASCENDING if after_id is not None else DESCENDING
+    return [
+        {"$match": query},
+        {"$sort": {"id": order}},
+        {"$limit": limit + 1},
+        {"$project": {"id": 1, "text": 1, "batch": {"$literal": batch}}},
+    ]
+
+
+async def _load_twitts_pages(keys: list[tuple]) -> dict[tuple, list]:
+    """
+    Return pages of twitts by keys (author_id, limit, before_id, after_id),
+    pages of batch found by one aggregation with $unionWith.
+    :param keys:
+    :return:
+    """
+    pipeline = _twitts_page_pipeline(keys[0], 0)
+    for batch, key in enumerate(keys[1:], 1):
+        pipeline.append(
+            {
+                "$unionWith": {
+                    "coll": "twitts",
+                    "pipeline": _twitts_page_pipeline(key, batch),
+                }
+            }
+        )
+    pages = {key: [] for key in keys}
+    twitts = database.for_reads(database.a_db_data).twitts
+    async for twitt in twitts.aggregate(pipeline):
+        pages[keys[twitt["batch"]]].append(twitt)
+    return pages
+
+
+twitts_loader = DataLoader(_load_twitts_pages)
+
+
 @standart_exceptions
 async def get_last_ten_twitts_by_twitter_id(
     twitter_id: str,
@@ -90,8 +244,86 @@ async def get_last_ten_twitts_by_twitter_id(
     :param twitter_id:
     :return:
     """
-    cursor = database.a_db_data[twitter_id].find()
-    return [twitt["text"] for twitt in await cursor.to_list(length=10)]
+    page = await get_twitts_by_twitter_id(twitter_id)
+    return page.twitts
+
+
+def _twitt_id_by_time(value: datetime) -> Optional[int]:
+    """
+    Return smallest twitt id created at time, or None for time before snowflake ids
+    :param value: naive datetime is UTC
+    :return:
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    ms = int(value.timestamp() * 1000) - TWITTER_EPOCH_MS
+    if ms < 0:
+        return None
+    return ms << 22
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def export_twitts(
+    twitter_id: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """
+    Yield all twitts of user as NDJSON, newest first, one chunk per batch.
+    Dates limit ids too, so Mongo reads only twitts in range by index.
+    :param twitter_id:
+    :param since: twitts created at or after
+    :param until: twitts created before
+    :param batch_size: twitts in one batch from Mongo
+    :return:
+    """
+    if not twitter_id.isdigit():
+        return
+
+    query = {"author_id": int(twitter_id)}
+    id_range = {}
+    created_at = {}
+    if since:
+        created_at["$gte"] = since
+        since_id = _twitt_id_by_time(since)
+        if since_id:
+            id_range["$gte"] = since_id
+    if until:
+        created_at["$lt"] = until
+        until_id = _twitt_id_by_time(until)
+        if until_id is not None:
+            id_range["$lt"] = until_id
+    if id_range:
+        query["id"] = id_range
+    if created_at:
+        query["created_at"] = created_at
+
+    cursor = (
+        database.for_reads(database.a_db_data)
+        .twitts.find(query, EXPORT_FIELDS)
+        .sort("id", DESCENDING)
+        .batch_size(batch_size)
+    )
+    lines = []
+    try:
+        async for twitt in cursor:
+            lines.append(json.dumps(twitt, default=_json_default))
+            if len(lines) == batch_size:
+                yield ("\n".join(lines) + "\n").encode()
+                lines.clear()
+        if lines:
+            yield ("\n".join(lines) + "\n").encode()
+    except PyMongoError:
+        # response already started, only stop stream
+        log.error("Data base not available, export of %s stopped.", twitter_id)
+    finally:
+        await cursor.close()
 
 
 def _get_username(value: str) -> Optional[str]:
@@ -109,6 +341,37 @@ def _get_username(value: str) -> Optional[str]:
     return None
 
 
+@with_settings
+async def _get_fresh_usernames(usernames: set[str], settings=None) -> set[str]:
+    """
+    Return lowercase names of accounts synced in FRESHNESS_WINDOW seconds.
+    Names compared case insensitive by collation of index on username.
+    :param usernames:
+    :return:
+    """
+    if settings.FRESHNESS_WINDOW <= 0:
+        return set()
+    synced_after = datetime.utcnow() - timedelta(seconds=settings.FRESHNESS_WINDOW)
+    query = {
+        "username": {"$in": list(usernames)},
+        "status": progress.STATUS_UPDATED,
+        "synced_at": {"$gte": synced_after},
+    }
+    cursor = database.a_db.accounts.find(
+        query, {"_id": 0, "username": 1}, collation=USERNAME_COLLATION
+    )
+    return {account["username"].lower() async for account in cursor}
+
+
+async def is_safe_callback(url: str) -> bool:
+    """
+    Check that callback url is not address of internal service.
+    :param url:
+    :return:
+    """
+    return await asyncio.to_thread(webhooks.is_safe_callback, url)
+
+
 @standart_exceptions
 async def create_new_task(data: ProfilesList) -> Union[Session, None]:
     """
@@ -121,19 +384,32 @@ async def create_new_task(data: ProfilesList) -> Union[Session, None]:
     """
     # parse str of urls and names to usernames
     users_set = {_get_username(item) for item in data.profiles if item}
+    users_set.discard(None)
     if not users_set:
         return None
 
+    # accounts synced short time ago not synced again
+    fresh = await _get_fresh_usernames(users_set)
+    stale = {username for username in users_set if username.lower() not in fresh}
+
     # create new task entity
-    new_task = SyncTask(users_list=users_set)
+    new_task = SyncTask(users_list=users_set, callback_url=data.callback_url)
+    document = jsonable_encoder(new_task)
+    document.update(progress.new_session(users_set, updated=fresh))
 
     # save new task to mongo
-    task = await database.a_db.tasks.insert_one(jsonable_encoder(new_task))
+    task = await database.a_db.tasks.insert_one(document)
     log.info("Create new task in mongo: %s.", task.inserted_id)
 
-    # create new task in celery
-    celery_task_id = celery_twitter.create_task.delay(users_set)
-    log.info("Create new task in celery: %s", celery_task_id)
+    if stale:
+        # create new task in celery
+        celery_task_id = celery_twitter.create_task.delay(sorted(stale))
+        log.info("Create new task in celery: %s", celery_task_id)
+    elif data.callback_url:
+        # no changes of statuses will come, send result now
+        await asyncio.to_thread(
+            webhooks.schedule_delivery, str(task.inserted_id), sorted(fresh)
+        )
 
     # return task id
     return Session(session_id=task.inserted_id)
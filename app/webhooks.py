@@ -0,0 +1,241 @@
+"""
+Delivery of sync progress to callback urls of sessions.
+
+Changes of session collected in REDIS and posted by one celery task
+after WEBHOOK_DEBOUNCE seconds, so many fast updates give one post:
+    {
+        "session_id": "63c251447c36683bae7dadca",
+        "event": "progress",  # or "completed" when all users are done
+        "total": 2,
+        "counters": {"new": 1, "updated": 1},
+        "users": [{"username": "username", "status": "updated"}],
+    }
+Tasks of delivery run in queue "webhooks", not in queue of puller.
+"""
+import ipaddress
+import logging
+import socket
+from typing import Iterable, Optional
+from urllib.parse import unquote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from pymongo.collection import Collection
+from redis.exceptions import RedisError
+
+from app import database, progress
+from app.config import with_settings
+from app.connections import get_celery
+from app.models import WebhookFailed
+
+log = logging.getLogger(__name__)
+
+# seconds to keep mark of scheduled delivery, if task lost next change schedule new
+PENDING_TTL = 60
+
+
+def _resolve(host: str, port: int) -> list[str]:
+    return [info[4][0] for info in socket.getaddrinfo(host, port)]
+
+
+@with_settings
+def check_callback(url: str, settings=None) -> Optional[str]:
+    """
+    Check that callback url is not address of internal service:
+    host from WEBHOOK_ALLOWED_HOSTS if it is set, and all addresses
+    of host are public (not loopback, private, link-local, reserved).
+    :param url:
+    :return: checked address of host for connect, None if url not allowed
+    """
+    try:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        return None
+    if parts.scheme not in ("http", "https") or not host:
+        return None
+    if settings.WEBHOOK_ALLOWED_HOSTS and host not in settings.WEBHOOK_ALLOWED_HOSTS:
+        return None
+    try:
+        addresses = _resolve(host, port or (443 if parts.scheme == "https" else 80))
+    except (OSError, UnicodeError):
+        return None
+    for address in addresses:
+        address = ipaddress.ip_address(address.split("%")[0])
+        if not address.is_global or address.is_multicast:
+            return None
+    return addresses[0] if addresses else None
+
+
+def is_safe_callback(url: str) -> bool:
+    """
+    Check that callback url is not address of internal service.
+    :param url:
+    :return:
+    """
+    return check_callback(url) is not None
+
+
+class _PinnedAdapter(HTTPAdapter):
+    """
+    Adapter for url with address instead of host, TLS (SNI and certificate)
+    checked for host.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        super().__init__()
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["server_hostname"] = self.host
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _post(url: str, address: str, **kwargs) -> requests.Response:
+    """
+    Post to checked address of host of url, host not resolved again,
+    so address can not be changed after check (DNS rebinding).
+    :param url: callback url
+    :param address: address from check_callback
+    :param kwargs: params of requests.post
+    :return:
+    """
+    parts = urlsplit(url)
+    ip = ipaddress.ip_address(address)
+    netloc = f"[{ip}]" if ip.version == 6 else str(ip)
+    if parts.port:
+        netloc = f"{netloc}:{parts.port}"
+    auth = None
+    if parts.username:
+        auth = (unquote(parts.username), unquote(parts.password or ""))
+    with requests.Session() as session:
+        session.mount("https://", _PinnedAdapter(parts.hostname))
+        return session.post(
+            parts._replace(netloc=netloc).geturl(),
+            headers={"Host": parts.netloc.rpartition("@")[2]},
+            auth=auth,
+            **kwargs,
+        )
+
+
+def _pending_key(session_id: str) -> str:
+    return f"webhook:pending:{session_id}"
+
+
+def _users_key(session_id: str) -> str:
+    return f"webhook:users:{session_id}"
+
+
+@with_settings
+def schedule_delivery(session_id: str, usernames: Iterable[str], settings=None) -> None:
+    """
+    Add changed users to next delivery of session,
+    create task of delivery if session has no scheduled delivery.
+    :param session_id:
+    :param usernames: changed users
+    """
+    usernames = list(usernames)
+    try:
+        pipe = database.cash_server.pipeline(transaction=False)
+        if usernames:
+            pipe.sadd(_users_key(session_id), *usernames)
+            pipe.expire(_users_key(session_id), PENDING_TTL)
+        pipe.set(_pending_key(session_id), 1, nx=True, ex=PENDING_TTL)
+        scheduled = pipe.execute()[-1]
+    except RedisError:
+        log.warning("Redis not available, delivery of %s not scheduled.", session_id)
+        return
+
+    if scheduled:
+        get_celery().send_task(
+            "deliver_webhook",
+            args=[session_id],
+            countdown=settings.WEBHOOK_DEBOUNCE,
+        )
+
+
+def pop_changed_users(session_id: str) -> list[str]:
+    """
+    Return users changed after last delivery and allow schedule next delivery.
+    :param session_id:
+    :return:
+    """
+    try:
+        pipe = database.cash_server.pipeline(transaction=True)
+        pipe.smembers(_users_key(session_id))
+        pipe.delete(_users_key(session_id), _pending_key(session_id))
+        usernames, _ = pipe.execute()
+    except RedisError:
+        log.warning("Redis not available, changed users of %s lost.", session_id)
+        return []
+    return sorted(username.decode() for username in usernames)
+
+
+@with_settings
+def deliver(
+    session_id: str,
+    usernames: list[str],
+    collection: Optional[Collection] = None,
+    settings=None,
+) -> None:
+    """
+    Post current progress of session and statuses of changed users to callback url.
+    Raise WebhookFailed if post can be retried.
+    :param session_id:
+    :param usernames: changed users
+    :param collection: collection of sessions, twitter.tasks by default
+    """
+    if collection is None:
+        collection = database.sync_client.twitter.tasks
+    pipeline = [
+        {"$match": {"_id": session_id}},
+        {
+            "$project": {
+                "_id": 0,
+                "callback_url": 1,
+                "total": 1,
+                "counters": 1,
+                "users": {
+                    "$filter": {
+                        "input": "$users",
+                        "cond": {"$in": ["$$this.username", usernames]},
+                    }
+                },
+            }
+        },
+    ]
+    session = next(collection.aggregate(pipeline), None)
+    if not session or not session.get("callback_url"):
+        return
+
+    url = session.pop("callback_url")
+    # address of host can be changed after session was created
+    address = check_callback(url)
+    if not address:
+        log.error("Callback of session %s not allowed, dropped.", session_id)
+        return
+    event = "completed" if progress.is_done(session) else "progress"
+    payload = {"session_id": session_id, "event": event, **session}
+    try:
+        response = _post(
+            url,
+            address,
+            json=payload,
+            timeout=settings.WEBHOOK_TIMEOUT,
+            allow_redirects=False,
+        )
+    except requests.RequestException as error:
+        log.warning("Callback of session %s not available: %s", session_id, error)
+        raise WebhookFailed(url)
+
+    if response.status_code == 429 or response.status_code >= 500:
+        log.warning(
+            "Callback of session %s return %s.", session_id, response.status_code
+        )
+        raise WebhookFailed(url)
+    if response.status_code >= 300:
+        log.error(
+            "Callback of session %s reject delivery with %s, dropped.",
+            session_id,
+            response.status_code,
+        )
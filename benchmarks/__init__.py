@@ -0,0 +1,8 @@
+"""
+Benchmarks of API on local Mongo and REDIS
+
+Run:
+    python -m benchmarks.seed --drop
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.compare base.json results.json
+"""
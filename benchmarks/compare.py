@@ -0,0 +1,73 @@
+"""
+Compare results of benchmarks, exit code 1 if any route is slower
+
+Route is slower if p50 or p99 latency grows, or throughput drops,
+by more than threshold (share of base value).
+
+Run:
+    python -m benchmarks.compare base.json results.json [--threshold 0.1]
+"""
+import argparse
+import json
+import sys
+
+# metric -> True if bigger value is better
+METRICS = {"p50_ms": False, "p99_ms": False, "rps": True}
+
+
+def compare(base: dict, current: dict, threshold: float = 0.1) -> list[dict]:
+    """
+    Return changes of metrics of routes found in both results.
+    :param base: results of benchmarks.run
+    :param current: results of benchmarks.run
+    :param threshold: allowed change, share of base value
+    :return:
+    """
+    changes = []
+    for route, stats in current["routes"].items():
+        base_stats = base["routes"].get(route)
+        if not base_stats:
+            continue
+        for metric, bigger_better in METRICS.items():
+            old, new = base_stats[metric], stats[metric]
+            change = (new - old) / old if old else 0
+            worse = -change if bigger_better else change
+            changes.append(
+                {
+                    "route": route,
+                    "metric": metric,
+                    "base": old,
+                    "current": new,
+                    "change": change,
+                    "regression": worse > threshold,
+                }
+            )
+    return changes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("base")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+
+    print(f"base {base.get('commit')}, current {current.get('commit')}")
+    changes = compare(base, current, args.threshold)
+    for change in changes:
+        print(
+            "{route:16} {metric:8} {base:10.1f} {current:10.1f} {change:+8.1%}{mark}".format(
+                **change, mark="  REGRESSION" if change["regression"] else ""
+            )
+        )
+    if any(change["regression"] for change in changes):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
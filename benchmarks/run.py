@@ -0,0 +1,307 @@
+"""
+Benchmark of API routes under concurrent load
+
+Requests sent to app in this process (ASGI, without network) or to running
+API by --url. Keys of requests (usernames, twitter ids, sessions) sampled
+from Mongo seeded by benchmarks.seed. Results saved as JSON for
+benchmarks.compare. Route add_profiles creates sessions, it is not in
+default routes; in process tasks of new sessions not sent to celery.
+
+Run:
+    python -m benchmarks.run [--routes user,twitts] [--requests 2000]
+        [--concurrency 50] [--warmup 100] [--url http://localhost:8000]
+        [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+import httpx
+from pymongo.database import Database
+
+from app import database
+
+log = logging.getLogger(__name__)
+
+# keys of every kind sampled from Mongo
+KEYS_SAMPLE = 1000
+
+# profiles in one request of add_profiles
+PROFILES_PER_SESSION = 10
+
+
+def sample_keys(
+    size: int = KEYS_SAMPLE,
+    db: Optional[Database] = None,
+    db_data: Optional[Database] = None,
+) -> dict:
+    """
+    Return random usernames, twitter ids, twitts and sessions from Mongo.
+    :param size: keys of every kind
+    :param db: database with accounts and sessions, twitter by default
+    :param db_data: database with twitts, twitter_data by default
+    :return:
+    """
+    if db is None:
+        db = database.sync_client.twitter
+    if db_data is None:
+        db_data = database.s_db_data
+
+    def sample(collection, fields: dict) -> list[dict]:
+        pipeline = [{"$sample": {"size": size}}, {"$project": fields}]
+        return list(collection.aggregate(pipeline))
+
+    accounts = sample(db.accounts, {"_id": 0, "username": 1, "twitter_id": 1})
+    twitts = sample(db_data.twitts, {"_id": 0, "author_id": 1, "id": 1})
+    sessions = sample(db.tasks, {"_id": 1})
+    if not accounts or not twitts or not sessions:
+        raise SystemExit("No data in Mongo, run: python -m benchmarks.seed")
+    return {
+        "usernames": [account["username"] for account in accounts],
+        "twitter_ids": [account["twitter_id"] for account in accounts],
+        "twitts": [(twitt["author_id"], twitt["id"]) for twitt in twitts],
+        "sessions": [str(session["_id"]) for session in sessions],
+    }
+
+
+def _add_profiles(keys: dict, rnd: random.Random) -> tuple:
+    usernames = rnd.sample(keys["usernames"], PROFILES_PER_SESSION)
+    profiles = [f"https://twitter.com/{username}" for username in usernames]
+    return "POST", "/api/users", {"profiles": profiles}
+
+
+def _status(keys: dict, rnd: random.Random) -> tuple:
+    return "GET", f"/api/users/status?session_id={rnd.choice(keys['sessions'])}", None
+
+
+def _status_page(keys: dict, rnd: random.Random) -> tuple:
+    method, url, body = _status(keys, rnd)
+    return method, f"{url}&offset=0&limit=100", body
+
+
+def _status_summary(keys: dict, rnd: random.Random) -> tuple:
+    method, url, body = _status(keys, rnd)
+    return method, f"{url}&summary=true", body
+
+
+def _user(keys: dict, rnd: random.Random) -> tuple:
+    return "GET", f"/api/user/{rnd.choice(keys['usernames'])}", None
+
+
+def _twitts(keys: dict, rnd: random.Random) -> tuple:
+    return "GET", f"/api/twitts/{rnd.choice(keys['twitter_ids'])}", None
+
+
+def _twitts_page(keys: dict, rnd: random.Random) -> tuple:
+    author_id, twitt_id = rnd.choice(keys["twitts"])
+    return "GET", f"/api/twitts/{author_id}?before_id={twitt_id}", None
+
+
+def _export(keys: dict, rnd: random.Random) -> tuple:
+    return "GET", f"/api/twitts/{rnd.choice(keys['twitter_ids'])}/export", None
+
+
+def _ready(keys: dict, rnd: random.Random) -> tuple:
+    return "GET", "/api/ready", None
+
+
+# name of route -> builder of request (method, url, json)
+ROUTES: dict[str, Callable[[dict, random.Random], tuple]] = {
+    "add_profiles": _add_profiles,
+    "status": _status,
+    "status_page": _status_page,
+    "status_summary": _status_summary,
+    "user": _user,
+    "twitts": _twitts,
+    "twitts_page": _twitts_page,
+    "export": _export,
+    "ready": _ready,
+}
+DEFAULT_ROUTES = [name for name in ROUTES if name != "add_profiles"]
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Return percentile of sorted values by nearest rank.
+    :param values: sorted values
+    :param percent: 0-100
+    :return:
+    """
+    if not values:
+        return 0
+    rank = math.ceil(percent / 100 * len(values))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int) -> dict:
+    """
+    Return statistics of requests of route.
+    :param latencies: seconds of every request
+    :param elapsed: seconds of all requests
+    :param errors: requests failed or with status 5xx
+    :return:
+    """
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "rps": len(values) / elapsed if elapsed else 0,
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p90_ms": percentile(values, 90) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000 if values else 0,
+    }
+
+
+async def run_route(
+    client: httpx.AsyncClient,
+    name: str,
+    keys: dict,
+    requests: int,
+    concurrency: int,
+    warmup: int = 0,
+) -> dict:
+    """
+    Send requests of route by concurrent clients, return statistics.
+    :param client:
+    :param name: key of ROUTES
+    :param keys: keys from sample_keys
+    :param requests: measured requests
+    :param concurrency: requests at once
+    :param warmup: requests before measure
+    :return:
+    """
+    build = ROUTES[name]
+    rnd = random.Random(name)
+    latencies, errors = [], 0
+
+    async def send(count: int, record: bool) -> None:
+        nonlocal errors
+        for _ in range(count):
+            method, url, body = build(keys, rnd)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body)
+                failed = response.status_code >= 500
+            except httpx.HTTPError:
+                failed = True
+            if record:
+                latencies.append(time.perf_counter() - started)
+                errors += failed
+
+    async def send_all(count: int, record: bool) -> None:
+        workers = min(concurrency, count)
+        if not workers:
+            return
+        counts = [count // workers + (i < count % workers) for i in range(workers)]
+        await asyncio.gather(*(send(part, record) for part in counts))
+
+    await send_all(warmup, record=False)
+    started = time.perf_counter()
+    await send_all(requests, record=True)
+    result = summarize(latencies, time.perf_counter() - started, errors)
+    log.info(
+        "%s: %.0f rps, p50 %.1f ms, p99 %.1f ms, errors %s.",
+        name,
+        result["rps"],
+        result["p50_ms"],
+        result["p99_ms"],
+        errors,
+    )
+    return result
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", *args], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _client(url: Optional[str], concurrency: int) -> httpx.AsyncClient:
+    if url:
+        limits = httpx.Limits(max_connections=concurrency)
+        return httpx.AsyncClient(base_url=url, limits=limits, timeout=60)
+
+    from app import celery_twitter
+    from app.main import app
+
+    # API only, new sessions not synced
+    celery_twitter.create_task.delay = lambda *args, **kwargs: None
+    return httpx.AsyncClient(app=app, base_url="http://benchmark", timeout=60)
+
+
+async def run(
+    routes: list[str],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    url: Optional[str] = None,
+) -> dict:
+    """
+    Run benchmark of routes one by one, return results with environment.
+    :param routes: keys of ROUTES
+    :param requests: measured requests of every route
+    :param concurrency: requests at once
+    :param warmup: requests of every route before measure
+    :param url: url of running API, app in this process if None
+    :return:
+    """
+    keys = await asyncio.to_thread(sample_keys)
+    results = {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "target": url or "in-process",
+        "requests": requests,
+        "concurrency": concurrency,
+        "data": {
+            "accounts": database.sync_client.twitter.accounts.estimated_document_count(),
+            "twitts": database.s_db_data.twitts.estimated_document_count(),
+        },
+        "routes": {},
+    }
+    async with _client(url, concurrency) as client:
+        for name in routes:
+            results["routes"][name] = await run_route(
+                client, name, keys, requests, concurrency, warmup
+            )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--routes", default=",".join(DEFAULT_ROUTES))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--output", default="benchmark.json")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    routes = args.routes.split(",")
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(
+        run(routes, args.requests, args.concurrency, args.warmup, url=args.url)
+    )
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    log.info("Results saved to %s.", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Seed of local Mongo for benchmarks: accounts, twitts and sessions
+
+Data written to databases of app (twitter, twitter_data), use only local Mongo.
+Twitts of accounts distributed like in real life: few accounts have most twitts.
+
+Run:
+    python -m benchmarks.seed [--accounts 100000] [--twitts 10000000]
+        [--sessions 100] [--session-users 1000] [--batch-size 10000] [--drop]
+"""
+import argparse
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+
+from fastapi.encoders import jsonable_encoder
+from pymongo.database import Database
+
+from app import database, progress
+from app.models import SyncTask
+from app.services import TWITTER_EPOCH_MS
+
+log = logging.getLogger(__name__)
+
+# seed of random, same data for every run
+RANDOM_SEED = 2023
+
+# twitts created in last days
+TWITTS_DAYS = 365
+
+# twitter ids of seeded accounts start from
+FIRST_TWITTER_ID = 10**9
+
+WORDS = (
+    "api sync twitter user account data mongo redis fast test news today "
+    "release python async worker queue cache index page cursor stream"
+).split()
+
+
+def username(number: int) -> str:
+    return f"bench_{number}"
+
+
+def twitter_id(number: int) -> int:
+    return FIRST_TWITTER_ID + number
+
+
+def account_document(number: int, rnd: random.Random, now: datetime) -> dict:
+    """
+    Document of account like saved by puller.
+    :param number: number of account
+    :param rnd:
+    :param now:
+    :return:
+    """
+    return {
+        # int like in accounts saved by puller
+        "twitter_id": twitter_id(number),
+        "name": f"Bench User {number}",
+        "username": username(number),
+        "following_count": rnd.randint(0, 5000),
+        "followers_count": int(rnd.paretovariate(1.2) * 100),
+        "description": " ".join(rnd.choices(WORDS, k=12)),
+        "twitts_count": 0,
+        "status": progress.STATUS_UPDATED,
+        "synced_at": now - timedelta(seconds=rnd.randint(0, 24 * 3600)),
+        "velocity": rnd.random() * 5,
+        "backfill": {"done": True},
+    }
+
+
+def twitts_per_account(accounts: int, twitts: int, rnd: random.Random) -> list[int]:
+    """
+    Return count of twitts of every account, sum is twitts.
+    :param accounts:
+    :param twitts:
+    :param rnd:
+    :return:
+    """
+    weights = [rnd.paretovariate(1.1) for _ in range(accounts)]
+    total = sum(weights)
+    counts = [int(twitts * weight / total) for weight in weights]
+    # rest of rounding to first accounts
+    for number in range(twitts - sum(counts)):
+        counts[number % accounts] += 1
+    return counts
+
+
+def twitt_documents(
+    number: int, count: int, rnd: random.Random, now: datetime
+) -> Iterator[dict]:
+    """
+    Yield twitts of account, ids are snowflakes of time of twitt.
+    :param number: number of account
+    :param count: twitts of account
+    :param rnd:
+    :param now:
+    :return:
+    """
+    author_id = twitter_id(number)
+    now_ms = int(now.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    period_ms = TWITTS_DAYS * 24 * 3600 * 1000
+    for created_ms in sorted(rnd.randrange(period_ms) for _ in range(count)):
+        created_ms = now_ms - period_ms + created_ms
+        _id = ((created_ms - TWITTER_EPOCH_MS) << 22) + rnd.randrange(1 << 22)
+        yield {
+            "id": _id,
+            "id_str": str(_id),
+            "author_id": author_id,
+            "text": " ".join(rnd.choices(WORDS, k=rnd.randint(5, 30))),
+            "created_at": datetime.utcfromtimestamp(created_ms / 1000),
+            "lang": "en",
+        }
+
+
+def _insert(collection, documents: list) -> None:
+    if documents:
+        collection.insert_many(documents, ordered=False)
+        documents.clear()
+
+
+def seed(
+    accounts: int = 100_000,
+    twitts: int = 10_000_000,
+    sessions: int = 100,
+    session_users: int = 1000,
+    batch_size: int = 10_000,
+    drop: bool = False,
+    db: Optional[Database] = None,
+    db_data: Optional[Database] = None,
+) -> None:
+    """
+    Write accounts, twitts and sessions for benchmarks.
+    :param accounts:
+    :param twitts:
+    :param sessions:
+    :param session_users: users in every session
+    :param batch_size: documents in one insert
+    :param drop: drop accounts, twitts and sessions before seed
+    :param db: database with accounts and sessions, twitter by default
+    :param db_data: database with twitts, twitter_data by default
+    """
+    if db is None:
+        db = database.sync_client.twitter
+    if db_data is None:
+        db_data = database.s_db_data
+    if drop:
+        db.accounts.drop()
+        db.tasks.drop()
+        db_data.twitts.drop()
+    elif db.accounts.estimated_document_count():
+        raise SystemExit("Accounts already in Mongo, run with --drop to replace.")
+    database.create_indexes(db_data, db)
+
+    rnd = random.Random(RANDOM_SEED)
+    now = datetime.utcnow()
+    started = time.monotonic()
+
+    counts = twitts_per_account(accounts, twitts, rnd)
+    documents = []
+    for number in range(accounts):
+        document = account_document(number, rnd, now)
+        document["twitts_count"] = counts[number]
+        documents.append(document)
+        if len(documents) == batch_size:
+            _insert(db.accounts, documents)
+    _insert(db.accounts, documents)
+    log.info("Seeded %s accounts.", accounts)
+
+    saved = 0
+    for number, count in enumerate(counts):
+        for document in twitt_documents(number, count, rnd, now):
+            documents.append(document)
+            if len(documents) == batch_size:
+                saved += len(documents)
+                _insert(db_data.twitts, documents)
+                if saved % (batch_size * 100) == 0:
+                    log.info("Seeded %s twitts.", saved)
+    saved += len(documents)
+    _insert(db_data.twitts, documents)
+    log.info("Seeded %s twitts.", saved)
+
+    for _ in range(sessions):
+        users = {username(rnd.randrange(accounts)) for _ in range(session_users)}
+        document = jsonable_encoder(SyncTask(users_list=users))
+        document.update(progress.new_session(users, updated=users))
+        documents.append(document)
+    _insert(db.tasks, documents)
+    log.info("Seeded %s sessions in %.0f s.", sessions, time.monotonic() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--twitts", type=int, default=10_000_000)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--session-users", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--drop", action="store_true")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    seed(
+        accounts=args.accounts,
+        twitts=args.twitts,
+        sessions=args.sessions,
+        session_users=args.session_users,
+        batch_size=args.batch_size,
+        drop=args.drop,
+    )
+
+
+if __name__ == "__main__":
+    main()
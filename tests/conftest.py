@@ -1,7 +1,17 @@
+import time
+
 import pytest
+import redis
+from redis.exceptions import ConnectionError, RedisError
+
+from app import database
+from app.config import get_settings
 from app.main import app
 from httpx import AsyncClient
 
+# database of REDIS for tests of scripts, flushed by tests
+LUA_TEST_DB = 15
+
 
 @pytest.fixture(scope="session")
 def anyio_backend():
@@ -13,3 +23,166 @@ async def client():
     async with AsyncClient(app=app, base_url="http://test") as client:
         print("Client is ready")
         yield client
+
+
+def _encode(value) -> bytes:
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class fake_pipeline:
+    """
+    Mock for redis pipeline, results of commands returned by execute.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.results = []
+
+    def __getattr__(self, name):
+        command = getattr(self.server, name)
+
+        def queued(*args, **kwargs):
+            self.results.append(command(*args, **kwargs))
+            return self
+
+        return queued
+
+    def execute(self):
+        results, self.results = self.results, []
+        return results
+
+
+class fake_redis:
+    """
+    Mock for redis connection, keys in dict.
+    Scripts run by python functions from scripts: text -> function(server, keys, args).
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.scripts = {}
+        self.calls = []
+        self.now_ms = int(time.time() * 1000)
+
+    def pipeline(self, transaction=True):
+        return fake_pipeline(self)
+
+    def register_script(self, script):
+        def run(keys=None, args=None, client=None):
+            self.calls.append((keys, args))
+            result = self.scripts[script](self, keys, args)
+            if client is not None:
+                client.results.append(result)
+            return result
+
+        return run
+
+    def time(self):
+        return self.now_ms // 1000, self.now_ms % 1000 * 1000
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, nx=False, ex=None, px=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = _encode(value)
+        return True
+
+    def incr(self, key):
+        self.data[key] = _encode(int(self.data.get(key, b"0")) + 1)
+        return int(self.data[key])
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def exists(self, *keys):
+        return sum(key in self.data for key in keys)
+
+    def expire(self, key, ttl):
+        return int(key in self.data)
+
+    def rename(self, key, new_key):
+        self.data[new_key] = self.data.pop(key)
+        return True
+
+    def sadd(self, key, *values):
+        members = self.data.setdefault(key, set())
+        added = {_encode(value) for value in values} - members
+        members.update(added)
+        return len(added)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def smismember(self, key, values):
+        members = self.data.get(key, set())
+        return [int(_encode(value) in members) for value in values]
+
+    def hmget(self, key, *fields):
+        bucket = self.data.get(key, {})
+        return [bucket.get(field) for field in fields]
+
+
+class broken_redis:
+    """
+    Mock for not available redis, every command fails.
+    """
+
+    def __getattr__(self, item):
+        def fail(*args, **kwargs):
+            raise ConnectionError
+
+        return fail
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    server = fake_redis()
+    monkeypatch.setattr(database, "cash_server", server)
+    return server
+
+
+@pytest.fixture
+def broken_redis_server(monkeypatch):
+    server = broken_redis()
+    monkeypatch.setattr(database, "cash_server", server)
+    return server
+
+
+def _lua_server():
+    settings = get_settings()
+    server = redis.Redis(
+        host=settings.REDIS_HOST or "localhost",
+        port=settings.REDIS_PORT or 6379,
+        db=LUA_TEST_DB,
+        socket_timeout=1,
+        socket_connect_timeout=1,
+    )
+    try:
+        server.ping()
+        return server
+    except RedisError:
+        pass
+    try:
+        import fakeredis
+    except ImportError:
+        pytest.skip("REDIS not available for test of scripts.")
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def lua_redis(monkeypatch):
+    """
+    REDIS which run Lua scripts: local server (database LUA_TEST_DB),
+    or fakeredis with Lua, test skipped if both not available.
+    """
+    server = _lua_server()
+    server.flushdb()
+    monkeypatch.setattr(database, "cash_server", server)
+    yield server
+    server.flushdb()
+    server.close()
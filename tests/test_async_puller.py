@@ -0,0 +1,98 @@
+"""
+File for test asyncio puller from twitter
+"""
+import httpx
+import pytest
+
+from app import async_puller, celery_twitter
+from app.async_puller import AsyncTwitterPuller, API_URL
+from app.config import get_settings
+from app.database import async_client, sync_client
+from app.models import InternalError, RateLimited
+
+TEST_DATABASE = "test"
+
+db = sync_client[TEST_DATABASE]
+a_db = async_client[TEST_DATABASE]
+
+
+def fake_twitt(_id, user_id):
+    return {
+        "id": _id,
+        "user": {"id": user_id},
+        "created_at": "Wed Oct 10 20:19:24 +0000 2018",
+    }
+
+
+def timeline(request: httpx.Request) -> httpx.Response:
+    """
+    Mock of user_timeline, user has twitts 1..450 with ids 1000*user + n.
+    """
+    user_id = int(request.url.params["user_id"])
+    count = int(request.url.params["count"])
+    max_id = int(request.url.params.get("max_id", user_id * 1000 + 450))
+    since_id = int(request.url.params.get("since_id", 0))
+    ids = range(max_id, max(since_id, user_id * 1000), -1)
+    return httpx.Response(200, json=[fake_twitt(_id, user_id) for _id in ids][:count])
+
+
+@pytest.fixture
+def puller(monkeypatch):
+    async def no_limits(server, method, tokens=1):
+        return 0
+
+    monkeypatch.setattr(async_puller, "acquire_async", no_limits)
+    monkeypatch.setattr(celery_twitter, "add_scrapper_task", None)
+    monkeypatch.setattr(get_settings(), "API_BEARER_TOKEN", "test")
+    puller = AsyncTwitterPuller()
+    puller.http = httpx.AsyncClient(
+        base_url=API_URL,
+        transport=httpx.MockTransport(timeline),
+    )
+    puller.storage = a_db
+    puller.twitts = a_db.twitts
+    db.twitts.create_index("id", unique=True)
+    db.accounts.insert_many(
+        [{"twitter_id": user_id, "username": f"user_{user_id}"} for user_id in (1, 2)]
+    )
+    yield puller
+    sync_client.drop_database(TEST_DATABASE)
+
+
+@pytest.mark.anyio
+async def test_pull_many(monkeypatch, puller):
+    updated = []
+
+    async def mock_set_updated(account):
+        updated.append(account["twitter_id"])
+
+    monkeypatch.setattr(puller, "_set_updated", mock_set_updated)
+    db.accounts.update_many({}, {"$set": {"backfill.done": True}})
+
+    assert await puller.pull_many([1, 2]) == 900
+    account = db.accounts.find_one({"twitter_id": 1})
+    assert account["last_twitt_id"] == 1450
+    assert db.twitts.count_documents({"author_id": 2}) == 450
+    assert sorted(updated) == [1, 2]
+
+    # next sync pull only new twitts
+    assert await puller.pull_many([1, 2]) == 0
+
+
+@pytest.mark.anyio
+async def test_pull_many_limited(monkeypatch, puller):
+    async def limited(server, method, tokens=1):
+        return 3
+
+    monkeypatch.setattr(async_puller, "acquire_async", limited)
+
+    with pytest.raises(RateLimited) as error:
+        await puller.pull_many([1, 2])
+    assert error.value.pending == [1, 2]
+    assert error.value.retry_after == 3
+
+
+def test_no_bearer_token(monkeypatch):
+    monkeypatch.setattr(get_settings(), "API_BEARER_TOKEN", None)
+    with pytest.raises(InternalError):
+        AsyncTwitterPuller()
@@ -0,0 +1,49 @@
+"""
+File for test statistics of benchmarks
+"""
+import random
+
+from benchmarks import compare, run, seed
+
+
+def test_summarize():
+    latencies = [i / 1000 for i in range(100, 0, -1)]
+    result = run.summarize(latencies, elapsed=2, errors=1)
+
+    assert result["requests"] == 100
+    assert result["errors"] == 1
+    assert result["rps"] == 50
+    assert result["p50_ms"] == 50
+    assert result["p99_ms"] == 99
+    assert result["max_ms"] == 100
+    assert run.summarize([], elapsed=0, errors=0)["p99_ms"] == 0
+
+
+def test_compare():
+    base = {"routes": {"user": {"p50_ms": 10, "p99_ms": 50, "rps": 1000}}}
+    current = {
+        "routes": {
+            "user": {"p50_ms": 10.5, "p99_ms": 40, "rps": 800},
+            "twitts": {"p50_ms": 10, "p99_ms": 50, "rps": 1000},
+        }
+    }
+
+    changes = compare.compare(base, current, threshold=0.1)
+    regressions = {change["metric"] for change in changes if change["regression"]}
+    assert len(changes) == 3
+    assert regressions == {"rps"}
+
+
+def test_seed_twitts():
+    rnd = random.Random(1)
+    counts = seed.twitts_per_account(10, 1000, rnd)
+    assert sum(counts) == 1000
+
+    twitts = list(seed.twitt_documents(1, 5, rnd, seed.datetime.utcnow()))
+    assert [twitt["author_id"] for twitt in twitts] == [seed.twitter_id(1)] * 5
+    assert sorted(twitts, key=lambda twitt: twitt["created_at"]) == twitts
+
+
+def test_seed_account():
+    account = seed.account_document(1, random.Random(1), seed.datetime.utcnow())
+    assert account["twitter_id"] == seed.twitter_id(1)
@@ -0,0 +1,158 @@
+"""
+File for test redis cache
+"""
+import pytest
+from redis.exceptions import ConnectionError
+
+from app import cache
+
+TEST_ACCOUNT = {
+    "twitter_id": "test",
+    "name": "test",
+    "username": "test",
+}
+
+
+def set_if_version(server, keys, args):
+    version = (server.data.get(keys[1]) or b"").decode()
+    if version != args[0]:
+        return 0
+    server.set(keys[0], args[1])
+    return 1
+
+
+def add_if_exists(server, keys, args):
+    if not server.exists(keys[0]):
+        return 0
+    server.sadd(keys[0], *args[1:])
+    return 1
+
+
+@pytest.fixture
+def fake_cache(redis_server):
+    redis_server.scripts.update(
+        {cache._SET_IF_VERSION: set_if_version, cache._ADD_IF_EXISTS: add_if_exists}
+    )
+    return redis_server
+
+
+def test_lookup_not_cached(fake_cache):
+    account, version = cache.lookup_account("test")
+    assert account is cache.NOT_CACHED
+    assert version == ""
+
+
+def test_store_and_lookup(fake_cache):
+    _, version = cache.lookup_account("test")
+    cache.store_account("test", TEST_ACCOUNT, version)
+    account, _ = cache.lookup_account("test")
+    assert account == TEST_ACCOUNT
+
+
+def test_store_negative_result(fake_cache):
+    _, version = cache.lookup_account("test")
+    cache.store_account("test", None, version)
+    account, _ = cache.lookup_account("test")
+    assert account is None
+
+
+def test_invalidate(fake_cache):
+    _, version = cache.lookup_account("test")
+    cache.store_account("test", TEST_ACCOUNT, version)
+    cache.invalidate_accounts(["test"])
+    account, _ = cache.lookup_account("test")
+    assert account is cache.NOT_CACHED
+
+
+def test_store_after_invalidate_skipped(fake_cache):
+    # sync finished between read from Mongo and write to cache
+    _, version = cache.lookup_account("test")
+    cache.invalidate_accounts(["test"])
+    cache.store_account("test", TEST_ACCOUNT, version)
+    account, _ = cache.lookup_account("test")
+    assert account is cache.NOT_CACHED
+
+
+def test_cache_not_available(broken_redis_server):
+    account, _ = cache.lookup_account("test")
+    assert account is cache.NOT_CACHED
+    cache.store_account("test", TEST_ACCOUNT, "")
+    cache.invalidate_accounts(["test"])
+
+
+class fake_collection:
+    """
+    Mock for collection of twitts.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.calls = 0
+
+    def find(self, query, projection, batch_size):
+        self.calls += 1
+        return [{"id": _id} for _id in self.ids]
+
+
+def test_known_twitts(fake_cache):
+    collection = fake_collection([1, 2])
+
+    assert cache.known_twitts(1, [1, 3], collection) == {1}
+    cache.add_known_twitts(1, [3])
+    assert cache.known_twitts(1, [1, 2, 3, 4], collection) == {1, 2, 3}
+    # index loaded from Mongo once
+    assert collection.calls == 1
+
+
+def test_known_twitts_expired(fake_cache):
+    collection = fake_collection([1, 2])
+
+    cache.add_known_twitts(1, [3])
+    assert cache._known_twitts_key(1) not in fake_cache.data
+    assert cache.known_twitts(1, [1, 3], collection) == {1}
+    assert collection.calls == 1
+
+
+class failing_collection(fake_collection):
+    """
+    Mock for collection of twitts failed after first batch.
+    """
+
+    def find(self, query, projection, batch_size):
+        yield from super().find(query, projection, batch_size)
+        raise ConnectionError
+
+
+def test_known_twitts_partial_load(fake_cache, monkeypatch):
+    monkeypatch.setattr(cache, "KNOWN_TWITTS_BATCH_SIZE", 2)
+    collection = failing_collection([1, 2])
+
+    assert cache.known_twitts(1, [1], collection) == set()
+    # partial index not under key and temporary key removed
+    assert fake_cache.data == {}
+
+
+def test_known_twitts_not_available(broken_redis_server):
+    assert cache.known_twitts(1, [1], fake_collection([1])) == set()
+    cache.add_known_twitts(1, [1])
+
+
+def test_scripts(lua_redis):
+    # store after invalidate skipped
+    _, version = cache.lookup_account("test")
+    cache.invalidate_accounts(["test"])
+    cache.store_account("test", TEST_ACCOUNT, version)
+    assert cache.lookup_account("test")[0] is cache.NOT_CACHED
+    _, version = cache.lookup_account("test")
+    cache.store_account("test", TEST_ACCOUNT, version)
+    assert cache.lookup_account("test")[0] == TEST_ACCOUNT
+
+    # ids not added to not loaded index
+    collection = fake_collection([1, 2])
+    cache.add_known_twitts(1, [3])
+    assert not lua_redis.exists(cache._known_twitts_key(1))
+    assert cache.known_twitts(1, [1, 3], collection) == {1}
+    cache.add_known_twitts(1, [3])
+    assert cache.known_twitts(1, [1, 2, 3, 4], collection) == {1, 2, 3}
+    assert collection.calls == 1
+    assert lua_redis.ttl(cache._known_twitts_key(1)) > 0
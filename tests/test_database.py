@@ -0,0 +1,77 @@
+"""
+File for test connections to Mongo and REDIS
+"""
+import pytest
+from pymongo.read_preferences import SecondaryPreferred
+
+from app import database
+from app.config import get_settings
+
+
+class fake_db:
+    """
+    Mock for database, save options of reads.
+    """
+
+    def with_options(self, **kwargs):
+        self.options = kwargs
+        return self
+
+
+def test_for_reads(monkeypatch):
+    db = fake_db()
+    assert database.for_reads(db) is db
+    assert db.options == {"read_preference": SecondaryPreferred(max_staleness=90)}
+
+    monkeypatch.setattr(get_settings(), "MONGO_SECONDARY_READS", False)
+    db = fake_db()
+    assert database.for_reads(db) is db
+    assert not hasattr(db, "options")
+
+
+def test_clients_on_first_use(monkeypatch):
+    created = []
+
+    def create_client(settings):
+        created.append(settings)
+        return {"twitter": "db"}
+
+    monkeypatch.setitem(database._CLIENTS, "test_client", create_client)
+    monkeypatch.setitem(database._DATABASES, "test_db", ("test_client", "twitter"))
+    try:
+        assert not created
+        assert database.test_db == "db"
+        assert database.test_client == {"twitter": "db"}
+        assert len(created) == 1
+    finally:
+        vars(database).pop("test_client", None)
+        vars(database).pop("test_db", None)
+
+    with pytest.raises(AttributeError):
+        database.not_client
+
+
+@pytest.mark.anyio
+async def test_check_health(monkeypatch, broken_redis_server):
+    # same broken client for async REDIS of API
+    broken_redis_server.connection_pool = database.a_cash_server.connection_pool
+    monkeypatch.setattr(database, "a_cash_server", broken_redis_server)
+
+    health = await database.check_health()
+    assert health["ready"] is False
+    assert health["redis"]["ok"] is False
+    assert "max_connections" in health["redis"]
+    assert "max_pool_size" in health["mongo"]
+
+
+def test_create_indexes():
+    db = database.sync_client.test
+    try:
+        database.create_indexes(db, db)
+        indexes = db.accounts.index_information()
+        assert indexes["username"]["key"] == [("username", 1)]
+        assert "collation" not in indexes["username"]
+        assert "username_ci" in indexes
+        assert indexes["twitter_id"]["key"] == [("twitter_id", 1)]
+    finally:
+        database.sync_client.drop_database("test")
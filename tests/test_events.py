@@ -0,0 +1,134 @@
+"""
+File for test push of sync progress
+"""
+import asyncio
+import json
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from app import database, events
+
+
+class fake_pubsub:
+    """
+    Mock for REDIS pub/sub connection.
+    """
+
+    def __init__(self):
+        self.channels = set()
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel):
+        self.channels.discard(channel)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def publish(self, channel, data):
+        message = {"type": "message", "channel": channel.encode()}
+        self.messages.put_nowait({**message, "data": json.dumps(data).encode()})
+
+    async def close(self):
+        pass
+
+
+class fake_async_redis:
+    def __init__(self):
+        self.server = fake_pubsub()
+
+    def pubsub(self):
+        return self.server
+
+
+class broken_async_redis:
+    def pubsub(self):
+        return self
+
+    async def subscribe(self, channel):
+        raise ConnectionError
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    server = fake_async_redis()
+    monkeypatch.setattr(database, "a_cash_server", server)
+    return server.server
+
+
+@pytest.mark.anyio
+async def test_dispatch(fake_server):
+    hub = events.SessionEvents()
+    first = await hub.subscribe("first")
+    other = await hub.subscribe("first")
+    second = await hub.subscribe("second")
+    assert fake_server.channels == {"session:first", "session:second"}
+
+    hub.dispatch("session:first", "{}")
+    assert first.get_nowait() == other.get_nowait() == "{}"
+    assert second.empty()
+
+    await hub.unsubscribe("first", first)
+    assert fake_server.channels == {"session:first", "session:second"}
+    await hub.unsubscribe("first", other)
+    assert fake_server.channels == {"session:second"}
+    await hub.close()
+
+
+@pytest.mark.anyio
+async def test_stream(fake_server):
+    hub = events.SessionEvents()
+    queue = await hub.open("first")
+    stream = hub.stream("first", {"total": 1, "counters": {"new": 1}}, queue)
+    assert await stream.__anext__() == (
+        b'event: progress\ndata: {"total": 1, "counters": {"new": 1}}\n\n'
+    )
+
+    progress = {
+        "total": 1,
+        "counters": {"new": 0, "updated": 1},
+        "users": [{"username": "test", "status": "updated"}],
+    }
+    fake_server.publish("session:first", progress)
+    event = await stream.__anext__()
+    assert event == f"event: progress\ndata: {json.dumps(progress)}\n\n".encode()
+    assert await stream.__anext__() == b"event: done\ndata: {}\n\n"
+    with pytest.raises(StopAsyncIteration):
+        await stream.__anext__()
+    assert fake_server.channels == set()
+    await hub.close()
+
+
+@pytest.mark.anyio
+async def test_stream_not_available(monkeypatch):
+    monkeypatch.setattr(database, "a_cash_server", broken_async_redis())
+    hub = events.SessionEvents()
+    queue = await hub.open("first")
+    assert queue is None
+    chunks = [chunk async for chunk in hub.stream("first", {"total": 0}, queue)]
+    assert chunks == [b'event: progress\ndata: {"total": 0}\n\n']
+
+
+@pytest.mark.anyio
+async def test_stream_published_before_snapshot(fake_server):
+    hub = events.SessionEvents()
+    queue = await hub.open("first")
+    # session finished after subscribe, before snapshot was read
+    progress = {"total": 1, "counters": {"updated": 1}}
+    fake_server.publish("session:first", progress)
+    snapshot = {"total": 1, "counters": {"new": 1}}
+
+    chunks = [chunk async for chunk in hub.stream("first", snapshot, queue)]
+    assert chunks == [
+        f"event: progress\ndata: {json.dumps(snapshot)}\n\n".encode(),
+        f"event: progress\ndata: {json.dumps(progress)}\n\n".encode(),
+        b"event: done\ndata: {}\n\n",
+    ]
+    assert fake_server.channels == set()
+    await hub.close()
@@ -0,0 +1,71 @@
+"""
+File for test leases in redis
+"""
+import pytest
+
+from app import leases
+
+
+def acquire(server, keys, args):
+    current = server.get(keys[0])
+    if current not in (None, args[0].encode()):
+        return 0
+    server.set(keys[0], args[0], px=args[1])
+    return 1
+
+
+def release(server, keys, args):
+    if server.get(keys[0]) != args[0].encode():
+        return 0
+    return server.delete(keys[0])
+
+
+@pytest.fixture
+def fake_leases(redis_server):
+    redis_server.scripts.update({leases._ACQUIRE: acquire, leases._RELEASE: release})
+    return redis_server
+
+
+def test_acquire(fake_leases):
+    token = leases.acquire("pull:1", 60)
+    assert token
+    assert leases.acquire("pull:1", 60) is None
+    # owner extend own lease
+    assert leases.acquire("pull:1", 60, token) == token
+
+    leases.release("pull:1", "other")
+    assert leases.acquire("pull:1", 60) is None
+    leases.release("pull:1", token)
+    assert leases.acquire("pull:1", 60)
+
+
+def test_acquire_many(fake_leases):
+    leases.acquire("lookup:first", 60)
+    token, taken = leases.acquire_many(["lookup:first", "lookup:second"], 60)
+    assert taken == ["lookup:second"]
+    leases.release_many(taken, token)
+    assert leases.acquire("lookup:second", 60)
+
+
+def test_held_many(fake_leases):
+    leases.acquire("pull:1", 60)
+    assert leases.held_many(["pull:1", "backfill:test"]) == {"pull:1"}
+
+
+def test_not_available(broken_redis_server):
+    # work not stopped without redis
+    assert leases.acquire("pull:1", 60)
+    leases.release("pull:1", "token")
+
+
+def test_scripts(lua_redis):
+    token = leases.acquire("pull:1", 60)
+    assert token
+    assert leases.acquire("pull:1", 60) is None
+    assert leases.acquire("pull:1", 60, token) == token
+    assert 0 < lua_redis.pttl("lease:pull:1") <= 60000
+
+    leases.release("pull:1", "other")
+    assert leases.held_many(["pull:1", "pull:2"]) == {"pull:1"}
+    leases.release("pull:1", token)
+    assert leases.held_many(["pull:1"]) == set()
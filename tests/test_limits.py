@@ -0,0 +1,112 @@
+"""
+File for test limits of calls to twitter
+"""
+from types import SimpleNamespace
+
+import pytest
+import tweepy
+
+from app import limits
+from app.models import RateLimited
+
+
+def script_result(server, result):
+    """
+    Scripts of limits return result: time to wait in ms or tokens.
+    """
+    server.scripts[limits._TOKEN_BUCKET] = lambda server, keys, args: result
+    server.scripts[limits._TOKENS_AVAILABLE] = lambda server, keys, args: result
+    return server
+
+
+@limits.with_limits("users")
+def call_twitter():
+    return True
+
+
+def test_acquire_key_by_method(redis_server):
+    server = script_result(redis_server, 0)
+
+    assert limits.acquire("users") == 0
+    keys, args = server.calls[0]
+    assert keys == ["twitter:limits:users"]
+    assert args[0] == limits.TWITTER_LIMITS["users"]
+
+
+def test_with_limits_ok(redis_server):
+    script_result(redis_server, 0)
+    assert call_twitter()
+
+
+def test_with_limits_over(redis_server):
+    script_result(redis_server, 2500)
+    with pytest.raises(RateLimited) as error:
+        call_twitter()
+    assert error.value.retry_after == 2.5
+
+
+def test_with_limits_redis_not_available(broken_redis_server):
+    assert call_twitter()
+
+
+def test_available(redis_server):
+    script_result(redis_server, 120)
+    assert limits.available("twitts") == 120
+
+
+def test_available_redis_not_available(broken_redis_server):
+    assert limits.available("twitts") == 0
+
+
+def test_available_all(redis_server):
+    redis_server.data.update(
+        {
+            "twitter:limits:twitts": {"tokens": b"10", "ts": b"1000000"},
+            "twitter:limits:users": {"tokens": b"0.5", "ts": b"1000000"},
+        }
+    )
+    # one minute after last call
+    redis_server.now_ms = 1060000
+
+    assert limits.available_all() == {"twitts": 30, "users": 20, "tasks": 150}
+
+
+def test_available_all_redis_not_available(broken_redis_server):
+    assert limits.available_all() == {"twitts": 0, "users": 0, "tasks": 0}
+
+
+def too_many_requests(headers):
+    response = SimpleNamespace(
+        status_code=429, reason="Too Many Requests", headers=headers, json=dict
+    )
+    return tweepy.TooManyRequests(response)
+
+
+def test_with_limits_twitter_limited(monkeypatch, redis_server):
+    script_result(redis_server, 0)
+    monkeypatch.setattr(limits, "time", SimpleNamespace(time=lambda: 1000))
+
+    @limits.with_limits("users")
+    def limited(headers):
+        raise too_many_requests(headers)
+
+    with pytest.raises(RateLimited) as error:
+        limited({"x-rate-limit-reset": "1060"})
+    assert error.value.retry_after == 60
+
+    with pytest.raises(RateLimited) as error:
+        limited({})
+    assert error.value.retry_after == limits.TTL / limits.TWITTER_LIMITS["users"]
+
+
+def test_scripts(lua_redis):
+    capacity = limits.TWITTER_LIMITS["users"]
+    assert limits.available("users") == capacity
+    assert limits.acquire("users", capacity - 1) == 0
+    assert limits.available("users") == 1
+    assert limits.available_all()["users"] == 1
+    # one token left, wait for refill of second
+    wait = limits.acquire("users", 2)
+    assert 0 < wait <= limits.TTL / capacity
+    assert limits.acquire("users") == 0
+    assert limits.acquire("users") > 0
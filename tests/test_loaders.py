@@ -0,0 +1,70 @@
+"""
+File for test batch loads of API reads
+"""
+import asyncio
+
+import pytest
+
+from app import services
+from app.loaders import DataLoader
+
+
+class fake_batch:
+    """
+    Mock of batch function, value of key is key * 10.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, keys):
+        self.calls.append(keys)
+        await asyncio.sleep(0)
+        return {key: key * 10 for key in keys if key}
+
+
+@pytest.mark.anyio
+async def test_load_batch():
+    batch = fake_batch()
+    loader = DataLoader(batch)
+
+    results = await asyncio.gather(*(loader.load(key) for key in [1, 2, 1, 0, 3]))
+    assert results == [10, 20, 10, None, 30]
+    # same keys loaded once, distinct keys by one call
+    assert batch.calls == [[1, 2, 0, 3]]
+    assert loader.stats() == {"batches": 1, "keys": 4, "average_batch_size": 4}
+
+
+@pytest.mark.anyio
+async def test_load_max_batch_size():
+    batch = fake_batch()
+    loader = DataLoader(batch, max_batch_size=2)
+
+    results = await asyncio.gather(*(loader.load(key) for key in [1, 2, 3]))
+    assert results == [10, 20, 30]
+    assert batch.calls == [[1, 2], [3]]
+    assert loader.batch_sizes == {2: 1, 1: 1}
+
+
+@pytest.mark.anyio
+async def test_load_error():
+    async def broken(keys):
+        raise ValueError
+
+    loader = DataLoader(broken)
+    results = await asyncio.gather(
+        loader.load(1), loader.load(2), return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+
+    # failed keys loaded again by next load
+    loader.batch_function = fake_batch()
+    assert await loader.load(1) == 10
+
+
+def test_twitts_page_pipeline():
+    pipeline = services._twitts_page_pipeline((1, 10, None, 500), 2)
+    assert pipeline[0] == {"$match": {"author_id": 1, "id": {"$gt": 500}}}
+    assert pipeline[1] == {"$sort": {"id": 1}}
+    assert pipeline[2] == {"$limit": 11}
+    assert pipeline[3]["$project"]["batch"] == {"$literal": 2}
@@ -4,7 +4,7 @@ File for test controller
 import json
 import pytest
 from app import services
-from app.models import InternalError, Account, ProfilesList, Session
+from app.models import InternalError, Account, ProfilesList, Session, TwittsPage
 from httpx import AsyncClient
 
 _data = {
@@ -78,9 +78,11 @@ async def test_add_profiles_bad_response(monkeypatch, client: AsyncClient):
 
 @pytest.mark.anyio
 async def test_get_status(monkeypatch, client: AsyncClient):
-    async def mock_get_status_by_session(data=None):
+    async def mock_get_status_by_session(data=None, **kwargs):
         from app.models import AccountStatus
 
+        assert kwargs == {"offset": 0, "limit": None, "summary": False}
+
         return [
             AccountStatus(username="test", status="ok"),
             AccountStatus(username="test", status="ok"),
@@ -98,6 +100,31 @@ async def test_get_status(monkeypatch, client: AsyncClient):
     ]
 
 
+@pytest.mark.anyio
+async def test_get_status_summary(monkeypatch, client: AsyncClient):
+    async def mock_get_status_by_session(data=None, **kwargs):
+        from app.models import SessionSummary
+
+        assert kwargs == {"offset": 10, "limit": 5, "summary": True}
+        return SessionSummary(
+            session_id=data, total=2, counters={"new": 1, "updated": 1}
+        )
+
+    monkeypatch.setattr(services, "get_status_by_session", mock_get_status_by_session)
+
+    session_id = "235434132"
+    response = await client.get(
+        f"/api/users/status?session_id={session_id}&offset=10&limit=5&summary=true"
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "session_id": session_id,
+        "total": 2,
+        "counters": {"new": 1, "updated": 1},
+    }
+
+
 @pytest.mark.anyio
 async def test_get_status_bad_response(monkeypatch, client: AsyncClient):
     response = await client.get(f"/api/users/status?session_id=")
@@ -119,6 +146,50 @@ async def test_get_status_empty_response(monkeypatch, client: AsyncClient):
     assert response.json() == {"detail": "Session_id key not valid"}
 
 
+@pytest.mark.anyio
+async def test_stream_status(monkeypatch, client: AsyncClient):
+    from app import main
+    from app.models import SessionSummary
+
+    async def mock_get_status_by_session(data=None, **kwargs):
+        assert kwargs == {"summary": True}
+        return SessionSummary(session_id=data, total=1, counters={"updated": 1})
+
+    async def mock_open(session_id):
+        return None
+
+    async def mock_stream(session_id, snapshot, queue):
+        yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n".encode()
+
+    monkeypatch.setattr(services, "get_status_by_session", mock_get_status_by_session)
+    monkeypatch.setattr(main.session_events, "open", mock_open)
+    monkeypatch.setattr(main.session_events, "stream", mock_stream)
+
+    response = await client.get("/api/users/status/stream?session_id=235434132")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == (
+        'event: progress\ndata: {"total": 1, "counters": {"updated": 1}}\n\n'
+    )
+
+
+@pytest.mark.anyio
+async def test_stream_status_not_found(monkeypatch, client: AsyncClient):
+    from app import main
+
+    async def mock_open(session_id):
+        return None
+
+    monkeypatch.setattr(main.session_events, "open", mock_open)
+    monkeypatch.setattr(services, "get_status_by_session", mock_none)
+
+    response = await client.get("/api/users/status/stream?session_id=235434132")
+
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Session_id key not valid"}
+
+
 @pytest.mark.anyio
 async def test_get_status_internal_error(monkeypatch, client: AsyncClient):
     monkeypatch.setattr(services, "get_status_by_session", mock_internal_error)
@@ -185,17 +256,15 @@ async def test_get_user_data_error(monkeypatch, client: AsyncClient):
 
 @pytest.mark.anyio
 async def test_get_twitts_ok(monkeypatch, client: AsyncClient):
-    async def mock_get_last_ten_twitts_by_twitter_id(twitter_id):
+    async def mock_get_twitts_by_twitter_id(twitter_id, **kwargs):
         assert twitter_id == "test"
-        return [
-            "test",
-            "test",
-        ]
+        assert kwargs == {"limit": 10, "before_id": None, "after_id": None}
+        return TwittsPage(twitts=["test", "test"])
 
     monkeypatch.setattr(
         services,
-        "get_last_ten_twitts_by_twitter_id",
-        mock_get_last_ten_twitts_by_twitter_id,
+        "get_twitts_by_twitter_id",
+        mock_get_twitts_by_twitter_id,
     )
 
     response = await client.get(f"/api/twitts/test")
@@ -205,14 +274,61 @@ async def test_get_twitts_ok(monkeypatch, client: AsyncClient):
         "test",
         "test",
     ]
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.anyio
+async def test_get_twitts_page(monkeypatch, client: AsyncClient):
+    async def mock_get_twitts_by_twitter_id(twitter_id, **kwargs):
+        assert kwargs == {"limit": 2, "before_id": 100, "after_id": None}
+        return TwittsPage(twitts=["test", "test"], next_cursor="98", prev_cursor="99")
+
+    monkeypatch.setattr(
+        services,
+        "get_twitts_by_twitter_id",
+        mock_get_twitts_by_twitter_id,
+    )
+
+    response = await client.get(f"/api/twitts/test?limit=2&before_id=100")
+
+    assert response.status_code == 200
+    assert response.headers["X-Next-Cursor"] == "98"
+    assert response.headers["X-Prev-Cursor"] == "99"
+
+
+@pytest.mark.anyio
+async def test_get_twitts_page_empty(monkeypatch, client: AsyncClient):
+    async def mock_get_twitts_by_twitter_id(twitter_id, **kwargs):
+        return TwittsPage(twitts=[])
+
+    monkeypatch.setattr(
+        services,
+        "get_twitts_by_twitter_id",
+        mock_get_twitts_by_twitter_id,
+    )
+
+    response = await client.get(f"/api/twitts/test?before_id=1")
+
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+@pytest.mark.anyio
+async def test_get_twitts_bad_limit(client: AsyncClient):
+    response = await client.get(f"/api/twitts/test?limit=1000")
+
+    assert response.status_code == 422
 
 
 @pytest.mark.anyio
 async def test_get_twitts_notfound(monkeypatch, client: AsyncClient):
+    async def mock_get_twitts_by_twitter_id(twitter_id, **kwargs):
+        return TwittsPage(twitts=[])
+
     monkeypatch.setattr(
         services,
-        "get_last_ten_twitts_by_twitter_id",
-        mock_none,
+        "get_twitts_by_twitter_id",
+        mock_get_twitts_by_twitter_id,
     )
 
     response = await client.get(f"/api/twitts/test")
@@ -225,7 +341,7 @@ async def test_get_twitts_notfound(monkeypatch, client: AsyncClient):
 async def test_get_twitts_error(monkeypatch, client: AsyncClient):
     monkeypatch.setattr(
         services,
-        "get_last_ten_twitts_by_twitter_id",
+        "get_twitts_by_twitter_id",
         mock_internal_error,
     )
 
@@ -233,3 +349,95 @@ async def test_get_twitts_error(monkeypatch, client: AsyncClient):
 
     assert response.status_code == 500
     assert response.json() == {"detail": "Internal error, try leter."}
+
+
+@pytest.mark.anyio
+async def test_export_twitts(monkeypatch, client: AsyncClient):
+    async def mock_export_twitts(twitter_id, since=None, until=None):
+        assert twitter_id == "1"
+        assert since.year == 2022
+        assert until is None
+        yield b'{"id": 2}\n'
+        yield b'{"id": 1}\n'
+
+    monkeypatch.setattr(services, "export_twitts", mock_export_twitts)
+
+    response = await client.get(f"/api/twitts/1/export?since=2022-01-01T00:00:00")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"id": 2},
+        {"id": 1},
+    ]
+
+
+@pytest.mark.anyio
+async def test_export_twitts_notfound(client: AsyncClient):
+    response = await client.get(f"/api/twitts/test/export")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_readiness(monkeypatch, client: AsyncClient):
+    from app import database
+
+    health = {"ready": False, "mongo": {"ok": True}, "redis": {"ok": False}}
+
+    async def mock_check_health():
+        return health
+
+    monkeypatch.setattr(database, "check_health", mock_check_health)
+
+    response = await client.get("/api/ready")
+    assert response.status_code == 503
+    assert response.json() == health
+
+    health["ready"] = health["redis"]["ok"] = True
+    response = await client.get("/api/ready")
+    assert response.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_stream_status_published_during_snapshot(
+    monkeypatch, client: AsyncClient
+):
+    from app import database, events, main
+    from app.models import SessionSummary
+    from tests.test_events import fake_async_redis
+
+    server = fake_async_redis()
+    monkeypatch.setattr(database, "a_cash_server", server)
+    monkeypatch.setattr(main, "session_events", events.SessionEvents())
+    done = {"total": 1, "counters": {"updated": 1}}
+
+    async def mock_get_status_by_session(data=None, **kwargs):
+        # session finished while snapshot is read
+        server.server.publish("session:235434132", done)
+        return SessionSummary(session_id=data, total=1, counters={"new": 1})
+
+    monkeypatch.setattr(services, "get_status_by_session", mock_get_status_by_session)
+
+    response = await client.get("/api/users/status/stream?session_id=235434132")
+
+    assert response.status_code == 200
+    assert f"data: {json.dumps(done)}" in response.text
+    assert response.text.endswith("event: done\ndata: {}\n\n")
+    assert server.server.channels == set()
+
+
+@pytest.mark.anyio
+async def test_add_profiles_callback_not_allowed(monkeypatch, client: AsyncClient):
+    async def mock_is_safe_callback(url):
+        assert url == "http://redis:6379"
+        return False
+
+    monkeypatch.setattr(services, "is_safe_callback", mock_is_safe_callback)
+    monkeypatch.setattr(services, "create_new_task", mock_internal_error)
+
+    data = {**_data, "callback_url": "http://redis:6379"}
+    response = await client.post("/api/users", json=data)
+
+    assert response.status_code == 422
+    assert response.json() == {"detail": "Callback url not allowed."}
@@ -0,0 +1,81 @@
+"""
+File for test metrics of API and workers
+"""
+import time
+from types import SimpleNamespace
+
+import pytest
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+
+from app import celery_twitter, limits, metrics, services
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.anyio
+async def test_metrics(monkeypatch, client: AsyncClient):
+    async def mock_get_status_by_session(data=None, **kwargs):
+        return []
+
+    monkeypatch.setattr(services, "get_status_by_session", mock_get_status_by_session)
+    monkeypatch.setattr(
+        limits, "available_all", lambda: dict.fromkeys(limits.TWITTER_LIMITS, 7)
+    )
+    labels = {"method": "GET", "route": "/api/users/status", "status": "404"}
+    before = sample("api_request_duration_seconds_count", **labels)
+
+    await client.get("/api/users/status?session_id=1")
+    response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert sample("api_request_duration_seconds_count", **labels) == before + 1
+    assert 'twitter_limit_remaining{method="twitts"} 7.0' in response.text
+    assert 'api_loader_batches_total{loader="accounts"}' in response.text
+
+
+def test_mongo_commands():
+    listener = metrics.MongoCommandListener("pymongo")
+    labels = {"client": "pymongo", "command": "find", "status": "failed"}
+    before = sample("mongo_command_duration_seconds_sum", **labels)
+
+    listener.failed(SimpleNamespace(command_name="find", duration_micros=2000))
+    assert sample("mongo_command_duration_seconds_sum", **labels) == before + 0.002
+
+
+def test_tasks():
+    task = SimpleNamespace(
+        name="test_task",
+        request={metrics.PUBLISHED_AT_HEADER: time.time() - 10, "eta": None},
+    )
+    task.request = SimpleNamespace(get=task.request.get, eta=None)
+
+    metrics.start_task(task_id="1", task=task)
+    metrics.finish_task(task_id="1", task=task, state="SUCCESS")
+    metrics.count_failure(sender=task, exception=ValueError())
+
+    assert sample("celery_task_queue_wait_seconds_sum", task="test_task") >= 10
+    assert (
+        sample("celery_task_duration_seconds_count", task="test_task", state="SUCCESS")
+        == 1
+    )
+    assert (
+        sample("celery_task_failures_total", task="test_task", exception="ValueError")
+        == 1
+    )
+    assert "1" not in metrics._started
+
+
+def test_task_error_counted(monkeypatch):
+    def failed(self, usernames):
+        raise ValueError
+
+    monkeypatch.setattr(celery_twitter.TwitterPuller, "get_users_data", failed)
+    labels = {"task": "create_task", "exception": "ValueError"}
+    before = sample("celery_task_failures_total", **labels)
+
+    # error of task logged, not raised
+    celery_twitter.create_task.apply(args=[["test"]])
+    assert sample("celery_task_failures_total", **labels) == before + 1
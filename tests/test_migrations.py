@@ -0,0 +1,46 @@
+"""
+File for test migrations of data in Mongo
+"""
+import pytest
+
+from app import migrations
+from app.database import sync_client
+
+TEST_DATABASE = "test"
+
+db = sync_client[TEST_DATABASE]
+
+
+@pytest.fixture
+def test_db():
+    yield db
+    sync_client.drop_database(TEST_DATABASE)
+
+
+def test_migrate_user_twitts(test_db):
+    test_db["1"].insert_many(
+        [
+            {"id": 1, "text": "1", "created_at": "Sun Jan 08 01:05:44 +0000 2023"},
+            {"id": 2, "text": "2", "created_at": "Sun Jan 08 01:06:44 +0000 2023"},
+        ]
+    )
+
+    assert migrations.migrate_user_twitts(drop=True, db=test_db) == 2
+    # restart of migration dont make duplicates
+    test_db["1"].insert_one({"id": 2, "text": "2"})
+    migrations.migrate_user_twitts(drop=True, db=test_db)
+
+    assert "1" not in test_db.list_collection_names()
+    twitts = list(test_db.twitts.find({"author_id": 1}).sort("id"))
+    assert [twitt["id"] for twitt in twitts] == [1, 2]
+    assert twitts[0]["created_at"].year == 2023
+
+
+def test_dedup_twitts(test_db):
+    test_db.twitts.insert_many(
+        [{"id": _id, "author_id": 1} for _id in [1, 2, 2, 3, 3, 3]]
+    )
+
+    assert migrations.dedup_twitts(batch_size=1, db=test_db) == 3
+    assert sorted(twitt["id"] for twitt in test_db.twitts.find()) == [1, 2, 3]
+    assert "twitt_id" in test_db.twitts.index_information()
@@ -0,0 +1,77 @@
+"""
+File for test profiling of requests
+"""
+import pytest
+from httpx import AsyncClient
+from pydantic import ValidationError
+
+from app import services
+from app.config import Settings, get_settings
+
+
+@pytest.fixture
+def profiling(monkeypatch, tmp_path):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "PROFILE_KEEP", 2)
+
+    async def mock_get_status_by_session(data=None, **kwargs):
+        return []
+
+    monkeypatch.setattr(services, "get_status_by_session", mock_get_status_by_session)
+    return tmp_path
+
+
+@pytest.mark.anyio
+async def test_profile_request(profiling, client: AsyncClient):
+    url = "/api/users/status?session_id=1"
+    response = await client.get(url)
+    assert "X-Profile-Id" not in response.headers
+
+    names = []
+    for _ in range(3):
+        response = await client.get(url, headers={"X-Profile": "secret"})
+        names.append(response.headers["X-Profile-Id"])
+
+    response = await client.get("/api/profiles", headers={"X-Profile": "secret"})
+    assert response.status_code == 200
+    # only last profiles kept
+    assert [profile["name"] for profile in response.json()] == names[:0:-1]
+
+    response = await client.get(
+        f"/api/profiles/{names[-1]}", headers={"X-Profile": "secret"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+
+    response = await client.get(
+        f"/api/profiles/{names[0]}", headers={"X-Profile": "secret"}
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_profiles_token(profiling, client: AsyncClient):
+    response = await client.get("/api/profiles", headers={"X-Profile": "other"})
+    assert response.status_code == 404
+
+    response = await client.get(
+        "/api/profiles/..%2Fsecret.html", headers={"X-Profile": "secret"}
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_profile_token_not_utf8(profiling, client: AsyncClient):
+    headers = {"X-Profile": b"\xff"}
+    response = await client.get("/api/users/status?session_id=1", headers=headers)
+    assert "X-Profile-Id" not in response.headers
+
+    response = await client.get("/api/profiles", headers=headers)
+    assert response.status_code == 404
+
+
+def test_profile_keep_positive():
+    with pytest.raises(ValidationError):
+        Settings(PROFILE_KEEP=0)
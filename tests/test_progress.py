@@ -0,0 +1,193 @@
+"""
+File for test progress of sync sessions
+"""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import database, progress, webhooks
+from app.database import async_client, sync_client
+
+TEST_DATABASE = "test"
+
+db = sync_client[TEST_DATABASE]
+a_db = async_client[TEST_DATABASE]
+
+
+@pytest.fixture
+def sessions():
+    db.tasks.insert_many(
+        [
+            {"_id": "first", **progress.new_session(["Test", "other"])},
+            {"_id": "second", **progress.new_session(["test"])},
+        ]
+    )
+    yield db.tasks
+    sync_client.drop_database(TEST_DATABASE)
+
+
+def test_new_session():
+    session = progress.new_session(["Test", "test", "other"])
+    assert session["users"] == [
+        {"username": "test", "status": "new"},
+        {"username": "other", "status": "new"},
+    ]
+    assert session["counters"] == {"new": 2}
+    assert session["total"] == 2
+
+
+def test_new_session_with_updated():
+    session = progress.new_session(["Test", "other"], updated=["test"])
+    assert session["users"] == [
+        {"username": "test", "status": "updated"},
+        {"username": "other", "status": "new"},
+    ]
+    assert session["counters"] == {"updated": 1, "new": 1}
+
+
+def test_set_accounts_status(sessions):
+    progress.set_accounts_status(sessions, ["Test"], progress.STATUS_PULLING)
+    progress.set_accounts_status(sessions, ["other"], progress.STATUS_NOT_FOUND)
+
+    first = sessions.find_one({"_id": "first"})
+    assert first["users"] == [
+        {"username": "test", "status": "pulling"},
+        {"username": "other", "status": "not_found"},
+    ]
+    assert first["counters"] == {"new": 0, "pulling": 1, "not_found": 1}
+    second = sessions.find_one({"_id": "second"})
+    assert second["counters"] == {"new": 0, "pulling": 1}
+
+    progress.set_accounts_status(sessions, ["test"], progress.STATUS_UPDATED)
+    second = sessions.find_one({"_id": "second"})
+    assert second["counters"] == {"new": 0, "pulling": 0, "updated": 1}
+
+
+def test_set_accounts_status_only_forward(sessions):
+    progress.set_accounts_status(sessions, ["test"], progress.STATUS_UPDATED)
+    # late message from other worker dont change final status
+    progress.set_accounts_status(sessions, ["test"], progress.STATUS_PULLING)
+
+    second = sessions.find_one({"_id": "second"})
+    assert second["users"] == [{"username": "test", "status": "updated"}]
+    assert second["counters"] == {"new": 0, "updated": 1}
+
+
+class fake_publisher:
+    """
+    Mock for redis connection, collect published messages.
+    """
+
+    def __init__(self):
+        self.published = []
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def publish(self, channel, data):
+        self.published.append((channel, json.loads(data)))
+
+    def execute(self):
+        pass
+
+
+def test_publish_progress(sessions, monkeypatch):
+    server = fake_publisher()
+    monkeypatch.setattr(database, "cash_server", server)
+
+    progress.set_accounts_status(sessions, ["other"], progress.STATUS_NOT_FOUND)
+
+    assert server.published == [
+        (
+            "session:first",
+            {
+                "total": 2,
+                "counters": {"new": 1, "not_found": 1},
+                "users": [{"username": "other", "status": "not_found"}],
+            },
+        )
+    ]
+
+
+def test_publish_progress_concurrent_update(sessions, monkeypatch):
+    server = fake_publisher()
+    monkeypatch.setattr(database, "cash_server", server)
+
+    now = datetime.utcnow()
+    sessions.update_one(
+        {"_id": "second"},
+        {
+            "$set": {
+                "users.0.status": "updated",
+                "counters": {"updated": 1},
+                "updated_at": now,
+            }
+        },
+    )
+    # other worker changed session after this update
+    sessions.update_one({"_id": "second"}, {"$currentDate": {"updated_at": True}})
+    progress.publish_progress(sessions, ["test"], progress.STATUS_UPDATED, now)
+
+    assert server.published == [
+        (
+            "session:second",
+            {
+                "total": 1,
+                "counters": {"updated": 1},
+                "users": [{"username": "test", "status": "updated"}],
+            },
+        )
+    ]
+
+
+class fake_async_publisher(fake_publisher):
+    """
+    Mock for async redis connection, collect published messages.
+    """
+
+    async def execute(self):
+        pass
+
+
+@pytest.mark.anyio
+async def test_set_accounts_status_async(sessions):
+    server = fake_async_publisher()
+
+    await progress.set_accounts_status_async(
+        a_db.tasks, ["Test"], progress.STATUS_UPDATED, server
+    )
+
+    second = sessions.find_one({"_id": "second"})
+    assert second["counters"] == {"new": 0, "updated": 1}
+    assert sorted(channel for channel, _ in server.published) == [
+        "session:first",
+        "session:second",
+    ]
+    assert server.published[0][1]["users"] == [
+        {"username": "test", "status": "updated"}
+    ]
+
+
+def test_publish_progress_only_changed_sessions(sessions, monkeypatch):
+    server = fake_publisher()
+    monkeypatch.setattr(database, "cash_server", server)
+    deliveries = []
+    monkeypatch.setattr(
+        webhooks,
+        "schedule_delivery",
+        lambda session_id, usernames: deliveries.append(session_id),
+    )
+    # session completed long ago, with callback
+    old = progress.new_session(["test"], updated=["test"])
+    old["updated_at"] -= timedelta(days=1)
+    sessions.insert_one({"_id": "old", "callback_url": "http://test", **old})
+    sessions.update_one({"_id": "second"}, {"$set": {"callback_url": "http://test"}})
+
+    progress.set_accounts_status(sessions, ["test"], progress.STATUS_UPDATED)
+
+    assert sorted(channel for channel, _ in server.published) == [
+        "session:first",
+        "session:second",
+    ]
+    assert deliveries == ["second"]
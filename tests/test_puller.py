@@ -0,0 +1,383 @@
+"""
+File for test puller from twitter
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import tweepy
+
+from app import celery_twitter, leases, progress
+from app.database import sync_client
+from app.models import Account, InternalError, RateLimited, TaskFaled
+from app import puller as puller_module
+from app.puller import TwitterPuller, batched, pull_cost, update_velocity
+
+TEST_DATABASE = "test"
+USERNAMES = [f"user_{i}" for i in range(250)]
+TEST_ACCOUNT = {
+    "twitter_id": 1,
+    "username": "test",
+    "status": "updated",
+    "twitts_count": 1200,
+}
+
+db = sync_client[TEST_DATABASE]
+
+
+@pytest.fixture
+def puller():
+    return TwitterPuller()
+
+
+@pytest.fixture
+def test_db(puller):
+    puller.storage = db
+    puller.twitts = db.twitts
+    db.twitts.create_index("id", unique=True)
+    db.accounts.insert_one(dict(TEST_ACCOUNT))
+    yield db
+    sync_client.drop_database(TEST_DATABASE)
+
+
+class fake_task:
+    """
+    Mock for Celery tasks.
+    """
+
+    calls = []
+
+    @classmethod
+    def delay(cls, *args, **kwargs):
+        cls.calls.append(args)
+
+
+@pytest.fixture
+def fake_tasks(monkeypatch):
+    fake_task.calls = []
+    monkeypatch.setattr(celery_twitter, "start_pull_from_twitter", fake_task)
+    monkeypatch.setattr(celery_twitter, "add_scrapper_task", fake_task)
+    return fake_task
+
+
+def fake_account(username):
+    return Account.construct(username=username)
+
+
+def fake_status(_id):
+    return SimpleNamespace(
+        id=_id,
+        created_at=None,
+        user=SimpleNamespace(id=TEST_ACCOUNT["twitter_id"]),
+        _json={"id": _id, "id_str": str(_id), "text": f"{_id}"},
+    )
+
+
+class fake_timeline:
+    """
+    Mock for user_timeline, twitts with ids from 1 to count, pages of 3 twitts.
+    """
+
+    def __init__(self, count):
+        self.ids = list(range(count, 0, -1))
+        self.calls = []
+
+    def __call__(self, user_id, since_id=None, max_id=None, count=None):
+        self.calls.append((since_id, max_id))
+        ids = [
+            _id
+            for _id in self.ids
+            if (since_id is None or _id > since_id)
+            and (max_id is None or _id <= max_id)
+        ]
+        return [fake_status(_id) for _id in ids[:3]]
+
+
+def test_get_users_by_chunks(monkeypatch, puller):
+    calls = []
+
+    def mock_lookup_users(usernames):
+        calls.append(usernames)
+        return [fake_account(username) for username in usernames]
+
+    monkeypatch.setattr(puller, "_lookup_users", mock_lookup_users)
+    users, limited = puller._get_users(USERNAMES)
+
+    assert limited == []
+    assert sorted(len(chunk) for chunk in calls) == [50, 100, 100]
+    assert sorted(user.username for user in users) == sorted(USERNAMES)
+
+
+def test_get_users_retry_failed_chunk(monkeypatch, puller):
+    calls = []
+
+    def mock_lookup_users(usernames):
+        calls.append(usernames)
+        # first call of first chunk failed
+        if usernames[0] == USERNAMES[0] and calls.count(usernames) == 1:
+            raise ConnectionError
+        return [fake_account(username) for username in usernames]
+
+    monkeypatch.setattr(puller, "_lookup_users", mock_lookup_users)
+    users, _ = puller._get_users(USERNAMES)
+
+    assert len(calls) == 4
+    assert len(users) == len(USERNAMES)
+
+
+def test_get_users_chunk_always_failed(monkeypatch, puller):
+    def mock_lookup_users(usernames):
+        if usernames[0] == USERNAMES[0]:
+            raise ConnectionError
+        return [fake_account(username) for username in usernames]
+
+    monkeypatch.setattr(puller, "_lookup_users", mock_lookup_users)
+    users, _ = puller._get_users(USERNAMES)
+
+    assert len(users) == len(USERNAMES) - 100
+
+
+def test_get_users_chunk_not_found(monkeypatch, puller):
+    calls = []
+
+    def mock_lookup_users(usernames):
+        calls.append(usernames)
+        if usernames[0] == USERNAMES[0]:
+            response = SimpleNamespace(status_code=404, reason="Not Found", json=dict)
+            raise tweepy.NotFound(response)
+        return [fake_account(username) for username in usernames]
+
+    monkeypatch.setattr(puller, "_lookup_users", mock_lookup_users)
+    users, limited = puller._get_users(USERNAMES)
+
+    # chunk without users not retried
+    assert len(calls) == 3
+    assert len(users) == len(USERNAMES) - 100
+    assert limited == []
+
+
+def test_get_users_rate_limited(monkeypatch, puller):
+    def mock_lookup_users(usernames):
+        if usernames[0] == USERNAMES[0]:
+            raise RateLimited(1)
+        return [fake_account(username) for username in usernames]
+
+    monkeypatch.setattr(puller, "_lookup_users", mock_lookup_users)
+    users, limited = puller._get_users(USERNAMES)
+
+    assert len(users) == len(USERNAMES) - 100
+    assert limited == USERNAMES[:100]
+
+
+def test_pull_data_incremental(monkeypatch, puller, test_db, fake_tasks):
+    timeline = fake_timeline(5)
+    monkeypatch.setattr(puller, "_get_twitts", timeline)
+
+    puller.pull_data(1)
+    account = test_db.accounts.find_one({"twitter_id": 1})
+    assert account["last_twitt_id"] == 5
+    assert test_db.twitts.count_documents({"author_id": 1}) == 5
+
+    # two new twitts, paging only from last_twitt_id
+    timeline.ids = [7, 6] + timeline.ids
+    timeline.calls.clear()
+    puller.pull_data(1)
+    account = test_db.accounts.find_one({"twitter_id": 1})
+    assert account["last_twitt_id"] == 7
+    assert timeline.calls == [(5, None), (5, 5)]
+    assert test_db.twitts.count_documents({"author_id": 1}) == 7
+    # backfill of old twitts started after pull
+    assert fake_tasks.calls == [("test",), ("test",)]
+
+
+def test_pull_data_resume_after_limits(monkeypatch, puller, test_db, fake_tasks):
+    timeline = fake_timeline(5)
+
+    def limited_timeline(user_id, since_id=None, max_id=None, count=None):
+        if max_id is not None:
+            raise RateLimited(1)
+        return timeline(user_id, since_id, max_id, count)
+
+    monkeypatch.setattr(puller, "_get_twitts", limited_timeline)
+    with pytest.raises(RateLimited):
+        puller.pull_data(1)
+    account = test_db.accounts.find_one({"twitter_id": 1})
+    assert account["pull_cursor"] == {"max_id": 2, "newest_id": 5}
+    assert "last_twitt_id" not in account
+
+    monkeypatch.setattr(puller, "_get_twitts", timeline)
+    puller.pull_data(1)
+    account = test_db.accounts.find_one({"twitter_id": 1})
+    assert account["last_twitt_id"] == 5
+    assert "pull_cursor" not in account
+    assert test_db.twitts.count_documents({"author_id": 1}) == 5
+
+
+def test_pull_data_leased(monkeypatch, puller, test_db, fake_tasks):
+    timeline = fake_timeline(5)
+    monkeypatch.setattr(puller, "_get_twitts", timeline)
+    # account pulled by other worker
+    monkeypatch.setattr(leases, "acquire", lambda name, ttl, token=None: None)
+
+    puller.pull_data(1)
+    assert timeline.calls == []
+    assert fake_tasks.calls == []
+
+
+def test_get_users_data_leased(monkeypatch, puller, test_db, fake_tasks):
+    looked_up = []
+
+    def mock_get_users(usernames):
+        looked_up.extend(usernames)
+        return [], []
+
+    def mock_acquire_many(names, ttl, token=None):
+        return "token", [name for name in names if name != "lookup:test"]
+
+    monkeypatch.setattr(puller, "_get_users", mock_get_users)
+    monkeypatch.setattr(leases, "acquire_many", mock_acquire_many)
+
+    with pytest.raises(InternalError):
+        puller.get_users_data(["Test", "new"])
+    assert looked_up == ["new"]
+
+
+def fake_scrapped_twitt(_id):
+    return {
+        "id": _id,
+        "author_id": TEST_ACCOUNT["twitter_id"],
+        "created_at": datetime(2020, 1, 1) + timedelta(hours=_id),
+    }
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
+
+
+def test_scrap_user_data_resume(monkeypatch, puller, test_db):
+    queries = []
+
+    def mock_iter_scrapped_twitts(query):
+        queries.append(query)
+        for _id in range(1200, 0, -1):
+            if len(queries) == 1 and _id == 600:
+                raise ConnectionError
+            if len(queries) == 1 or _id <= 700:
+                yield fake_scrapped_twitt(_id)
+
+    monkeypatch.setattr(puller, "_iter_scrapped_twitts", mock_iter_scrapped_twitts)
+
+    with pytest.raises(TaskFaled):
+        puller.scrap_user_data("test")
+    account = test_db.accounts.find_one({"username": "test"})
+    assert account["backfill"]["oldest_id"] == 701
+    assert not account["backfill"].get("done")
+
+    assert puller.scrap_user_data("test")
+    assert queries[1] == "(from:test) since:2010-01-01 max_id:700"
+    account = test_db.accounts.find_one({"username": "test"})
+    # last batch shorter than BACKFILL_BATCH_SIZE saved too
+    assert account["backfill"] == {
+        "oldest_id": 1,
+        "oldest_date": fake_scrapped_twitt(1)["created_at"],
+        "done": True,
+    }
+    assert test_db.twitts.count_documents({"author_id": 1}) == 1200
+
+
+def test_scrap_user_data_chunks(monkeypatch, puller, test_db, fake_tasks):
+    def mock_iter_scrapped_twitts(query):
+        for _id in range(1200, 0, -1):
+            yield fake_scrapped_twitt(_id)
+
+    monkeypatch.setattr(puller, "_iter_scrapped_twitts", mock_iter_scrapped_twitts)
+
+    assert not puller.scrap_user_data("test", max_batches=2)
+    # next chunk sent to queue with lease of backfill
+    assert [args[0] for args in fake_tasks.calls] == ["test"]
+    account = test_db.accounts.find_one({"username": "test"})
+    assert account["backfill"]["oldest_id"] == 201
+    assert not account["backfill"].get("done")
+    assert test_db.twitts.count_documents({"author_id": 1}) == 1000
+
+
+def test_save_twitts_skip_duplicates(puller, test_db):
+    twitts = [{"id": _id, "author_id": 1} for _id in [1, 2]]
+    assert puller._save_twitts(1, twitts) == 2
+
+    twitts = [{"id": _id, "author_id": 1} for _id in [1, 2, 3]]
+    assert puller._save_twitts(1, twitts) == 1
+    assert test_db.twitts.count_documents({"author_id": 1}) == 3
+
+
+def test_get_users_data_progress(monkeypatch, puller, test_db, fake_tasks):
+    test_db.tasks.insert_one(
+        {"_id": "session", **progress.new_session(["Test", "new", "missing"])}
+    )
+    users = [
+        Account.construct(username="test", twitter_id=1, twitts_count=1200),
+        Account.construct(username="new", twitter_id=2, twitts_count=1),
+    ]
+    monkeypatch.setattr(puller, "_get_users", lambda usernames: (users, []))
+
+    puller.get_users_data(["Test", "new", "missing"])
+
+    session = test_db.tasks.find_one({"_id": "session"})
+    assert session["users"] == [
+        {"username": "test", "status": "updated"},
+        {"username": "new", "status": "pulling"},
+        {"username": "missing", "status": "not_found"},
+    ]
+    assert fake_tasks.calls == [(2,)]
+    assert test_db.accounts.find_one({"username": "new"})["status"] == "pulling"
+
+
+def test_get_users_data_sync_running(monkeypatch, puller, test_db, fake_tasks):
+    test_db.tasks.insert_one({"_id": "session", **progress.new_session(["test"])})
+    users = [Account.construct(username="test", twitter_id=1, twitts_count=1200)]
+    monkeypatch.setattr(puller, "_get_users", lambda usernames: (users, []))
+    # other worker still pulls account for first session
+    monkeypatch.setattr(leases, "held_many", lambda names: {leases.pull_lease(1)})
+
+    puller.get_users_data(["test"])
+
+    session = test_db.tasks.find_one({"_id": "session"})
+    assert session["users"] == [{"username": "test", "status": "pulling"}]
+    assert fake_tasks.calls == []
+
+
+def test_update_velocity():
+    assert update_velocity(None, 10, 2) == 5
+    # after half life old velocity has half of weight
+    assert update_velocity(10, 0, 24) == 5
+
+
+def test_pull_cost():
+    assert pull_cost(0) == 1
+    assert pull_cost(200) == 2
+    assert pull_cost(10**6) == 17
+
+
+def test_schedule_updates(monkeypatch, puller, test_db):
+    monkeypatch.setattr(puller_module, "available", lambda method: 8)
+    now = datetime.utcnow()
+    test_db.accounts.insert_many(
+        [
+            # 10 new twitts expected
+            {"twitter_id": 2, "velocity": 5, "synced_at": now - timedelta(hours=2)},
+            # 400 new twitts expected, 3 calls
+            {"twitter_id": 3, "velocity": 100, "synced_at": now - timedelta(hours=4)},
+            # dormant
+            {"twitter_id": 4, "velocity": 0, "synced_at": now - timedelta(hours=2)},
+            # synced recently
+            {"twitter_id": 5, "velocity": 100, "synced_at": now},
+        ]
+    )
+    test_db.accounts.update_many({}, {"$set": {"backfill.done": True}})
+
+    # budget is half of limit left
+    assert puller.schedule_updates() == [3]
+    # scheduled accounts not chosen again
+    assert puller.schedule_updates() == [2]
+    assert test_db.accounts.find_one({"twitter_id": 3})["scheduled_at"]
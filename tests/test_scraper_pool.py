@@ -0,0 +1,81 @@
+"""
+File for test pool of proxies for scraper
+"""
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app import scraper_pool
+from app.scraper_pool import ProxyPool
+
+
+def test_lease_rotation():
+    pool = ProxyPool(["http://first", "http://second"], concurrency=1, cooldown=60)
+    with pool.lease() as first, pool.lease() as second:
+        assert first == {"http": "http://first", "https": "http://first"}
+        assert second["http"] == "http://second"
+
+
+def test_lease_direct_connection():
+    pool = ProxyPool([], concurrency=2, cooldown=60)
+    assert pool.size == 2
+    with pool.lease() as proxies:
+        assert proxies is None
+
+
+def test_lease_cooldown():
+    pool = ProxyPool(["http://first", "http://second"], concurrency=1, cooldown=60)
+    with pytest.raises(ConnectionError):
+        with pool.lease():
+            raise ConnectionError
+    # failed proxy skipped while cooling down
+    for _ in range(2):
+        with pool.lease() as proxies:
+            assert proxies["http"] == "http://second"
+
+
+def test_lease_wait_free_proxy():
+    pool = ProxyPool(["http://first"], concurrency=1, cooldown=60)
+    leased = []
+
+    def worker():
+        with pool.lease() as proxies:
+            leased.append(proxies)
+
+    with pool.lease():
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join(0.1)
+        assert leased == []
+    thread.join(1)
+    assert len(leased) == 1
+
+
+def test_scrap_users(monkeypatch):
+    calls = []
+    failed = []
+
+    class fake_scraper:
+        def __init__(self, username, proxies=None, retries=3):
+            calls.append((username, proxies))
+            # first try of broken user failed
+            if username == "broken" and not failed:
+                failed.append(proxies)
+                raise ConnectionError
+            self.entity = (
+                None if username == "unknown" else SimpleNamespace(username=username)
+            )
+
+    monkeypatch.setattr(scraper_pool, "TwitterUserScraper", fake_scraper)
+    pool = ProxyPool(["http://first", "http://second"], concurrency=2, cooldown=0)
+
+    users = scraper_pool.scrap_users(["test", "unknown", "broken"], pool=pool)
+
+    assert sorted(user.username for user in users) == ["broken", "test"]
+    # broken user retried
+    assert [name for name, _ in calls].count("broken") == 2
+    assert {proxies["http"] for _, proxies in calls} <= {
+        "http://first",
+        "http://second",
+    }
@@ -1,19 +1,25 @@
 """
 Fiile for test functions
 """
+import json
+from datetime import datetime, timedelta
+
 import pytest
 
-from app import database, celery_twitter
+from app import database, celery_twitter, progress
 from app.services import (
     get_status_by_session,
     get_last_ten_twitts_by_twitter_id,
+    get_twitts_by_twitter_id,
     create_new_task,
+    export_twitts,
+    _twitt_id_by_time,
 )
 from app.database import sync_client, async_client
 from app.models import InternalError, ProfilesList
 
 TEST_DATABASE = "test"
-TEST_TASK = {"users_list": ["test"]}
+TEST_TASK = {"users_list": ["test"], **progress.new_session(["test"])}
 
 TEST_ACCOUNT = {
     "twitter_id": "test",
@@ -25,7 +31,7 @@ TEST_ACCOUNT = {
     "status": "test",
 }
 FAKE_TASK = ["http://twitter.com/test"]
-TEST_TWITT = {"text": "its test twitt"}
+TEST_TWITT = {"id": 1, "id_str": "1", "author_id": 1, "text": "its test twitt"}
 
 db = sync_client[TEST_DATABASE]
 a_db = async_client[TEST_DATABASE]
@@ -34,7 +40,7 @@ a_db = async_client[TEST_DATABASE]
 def insert_fake_data():
     db.accounts.insert_one(TEST_ACCOUNT)
     db.twitts.insert_one(TEST_TWITT)
-    task = db.tasks.insert_one(TEST_TASK)
+    task = db.tasks.insert_one(dict(TEST_TASK))
     return task.inserted_id
 
 
@@ -56,7 +62,25 @@ def fake_data():
 async def test_get_status_by_session(fake_data, monkeypatch):
     monkeypatch.setattr(database, "a_db", a_db)
     result = await get_status_by_session(fake_data)
-    assert result[-1] == TEST_ACCOUNT
+    assert result == [{"username": "test", "status": "new"}]
+
+
+@pytest.mark.anyio
+async def test_get_status_by_session_summary(fake_data, monkeypatch):
+    monkeypatch.setattr(database, "a_db", a_db)
+    result = await get_status_by_session(fake_data, summary=True)
+    assert result.dict() == {
+        "session_id": str(fake_data),
+        "total": 1,
+        "counters": {"new": 1},
+    }
+
+
+@pytest.mark.anyio
+async def test_get_status_by_session_page(fake_data, monkeypatch):
+    monkeypatch.setattr(database, "a_db", a_db)
+    result = await get_status_by_session(fake_data, offset=1, limit=10)
+    assert result == []
 
 
 @pytest.mark.anyio
@@ -88,6 +112,17 @@ async def test_get_userdata_by_username(fake_data, monkeypatch):
     assert result == TEST_ACCOUNT
 
 
+@pytest.mark.anyio
+async def test_get_userdata_by_username_from_primary(fake_data, monkeypatch):
+    def secondary(db):
+        raise AssertionError("profile for cache read from secondary")
+
+    monkeypatch.setattr(database, "a_db", a_db)
+    monkeypatch.setattr(database, "for_reads", secondary)
+    result = await get_user_data_by_username(TEST_ACCOUNT["username"])
+    assert result == TEST_ACCOUNT
+
+
 @pytest.mark.anyio
 async def test_get_userdata_by_username_notfound(fake_data, monkeypatch):
     monkeypatch.setattr(database, "a_db", a_db)
@@ -106,13 +141,12 @@ async def test_get_userdata_by_username_internal_error(fake_data, monkeypatch):
 
 
 @pytest.mark.anyio
-async def test_get_last_ten_twitts_by_twitter_id(fake_data, monkeypatch):
+async def test_get_last_ten_twitts_by_twitter_id_ok(fake_data, monkeypatch):
     monkeypatch.setattr(database, "a_db_data", a_db)
 
-    _twitter_id = TEST_ACCOUNT["twitter_id"]
+    _twitter_id = str(TEST_TWITT["author_id"])
     result = await get_last_ten_twitts_by_twitter_id(_twitter_id)
-    for _twitt in result:
-        assert result["text"] == TEST_TWITT["text"]
+    assert result == [TEST_TWITT["text"]]
 
 
 @pytest.mark.anyio
@@ -136,6 +170,53 @@ async def test_get_last_ten_twitts_by_twitter_id_internal_error(
         assert 0 == 0
 
 
+@pytest.mark.anyio
+async def test_get_twitts_by_twitter_id_pages(fake_data, monkeypatch):
+    monkeypatch.setattr(database, "a_db_data", a_db)
+    db.twitts.insert_many(
+        [{"id": _id, "author_id": 2, "text": f"{_id}"} for _id in range(1, 6)]
+    )
+
+    page = await get_twitts_by_twitter_id("2", limit=2)
+    assert page.twitts == ["5", "4"]
+    assert page.next_cursor == "4"
+    assert page.prev_cursor is None
+
+    page = await get_twitts_by_twitter_id("2", limit=2, before_id=4)
+    assert page.twitts == ["3", "2"]
+    assert page.next_cursor == "2"
+    assert page.prev_cursor == "3"
+
+    page = await get_twitts_by_twitter_id("2", limit=2, before_id=2)
+    assert page.twitts == ["1"]
+    assert page.next_cursor is None
+
+    page = await get_twitts_by_twitter_id("2", limit=2, after_id=2)
+    assert page.twitts == ["4", "3"]
+    assert page.next_cursor == "3"
+    assert page.prev_cursor == "4"
+
+
+def test_twitt_id_by_time():
+    # 1611891871512514560 created at 2023-01-08 01:05:44 UTC
+    _id = _twitt_id_by_time(datetime(2023, 1, 8, 1, 5, 44))
+    assert _id <= 1611891871512514560 < _id + (1000 << 22)
+    assert _twitt_id_by_time(datetime(2009, 1, 1)) is None
+
+
+@pytest.mark.anyio
+async def test_export_twitts(fake_data, monkeypatch):
+    monkeypatch.setattr(database, "a_db_data", a_db)
+    db.twitts.insert_many(
+        [{"id": _id, "author_id": 2, "text": f"{_id}"} for _id in range(1, 6)]
+    )
+
+    chunks = [chunk async for chunk in export_twitts("2", batch_size=2)]
+    assert len(chunks) == 3
+    lines = b"".join(chunks).decode().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [5, 4, 3, 2, 1]
+
+
 class fake_create_task:
     """
     Mock for Celery tasks.
@@ -151,9 +232,51 @@ async def test_create_new_task(monkeypatch):
     monkeypatch.setattr(database, "a_db", a_db)
     monkeypatch.setattr(celery_twitter, "create_task", fake_create_task)
     result = await create_new_task(ProfilesList.construct(profiles=FAKE_TASK))
-    _session_id = db.tasks.find_one({"users_list": ["test"]})["_id"]
+    task = db.tasks.find_one({"users_list": ["test"]})
+    delete_fake_data()
+    assert result.dict() == {"session_id": task["_id"]}
+    assert task["users"] == [{"username": "test", "status": "new"}]
+    assert task["counters"] == {"new": 1}
+
+
+@pytest.mark.anyio
+async def test_create_new_task_callback(monkeypatch):
+    monkeypatch.setattr(database, "a_db", a_db)
+    monkeypatch.setattr(celery_twitter, "create_task", fake_create_task)
+    data = ProfilesList(profiles=FAKE_TASK, callback_url="http://example.com/hook")
+    await create_new_task(data)
+    task = db.tasks.find_one({"users_list": ["test"]})
     delete_fake_data()
-    assert result.dict() == {"session_id": _session_id}
+    assert task["callback_url"] == "http://example.com/hook"
+
+
+@pytest.mark.anyio
+async def test_create_new_task_fresh_accounts(monkeypatch):
+    monkeypatch.setattr(database, "a_db", a_db)
+    sent = []
+    monkeypatch.setattr(
+        celery_twitter.create_task, "delay", lambda users: sent.append(users)
+    )
+    db.accounts.insert_many(
+        [
+            {"username": "test", "status": "updated", "synced_at": datetime.utcnow()},
+            {
+                "username": "old",
+                "status": "updated",
+                "synced_at": datetime.utcnow() - timedelta(days=1),
+            },
+        ]
+    )
+    profiles = [f"https://twitter.com/{name}" for name in ["test", "old", "new"]]
+    await create_new_task(ProfilesList.construct(profiles=profiles))
+    task = db.tasks.find_one({})
+    delete_fake_data()
+
+    # only stale and unknown accounts synced
+    assert sent == [["new", "old"]]
+    statuses = {user["username"]: user["status"] for user in task["users"]}
+    assert statuses == {"test": "updated", "old": "new", "new": "new"}
+    assert task["counters"] == {"new": 2, "updated": 1}
 
 
 @pytest.mark.anyio
@@ -176,3 +299,21 @@ async def test_create_new_task_error(monkeypatch):
         assert 0 == 0
     finally:
         db.tasks.drop()
+
+
+@pytest.mark.anyio
+async def test_create_new_task_invalid_profiles(monkeypatch):
+    monkeypatch.setattr(database, "a_db", a_db)
+    sent = []
+    monkeypatch.setattr(
+        celery_twitter.create_task, "delay", lambda users: sent.append(users)
+    )
+    profiles = ["https://twitter.com/test", "not a profile", "https://twitter.com/"]
+    result = await create_new_task(ProfilesList.construct(profiles=profiles))
+    task = db.tasks.find_one({})
+    delete_fake_data()
+
+    # invalid profiles skipped, not sent to sync
+    assert result.dict() == {"session_id": task["_id"]}
+    assert sent == [["test"]]
+    assert task["users"] == [{"username": "test", "status": "new"}]
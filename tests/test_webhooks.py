@@ -0,0 +1,220 @@
+"""
+File for test delivery of progress to callback urls
+"""
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from app import progress, webhooks
+from app.config import get_settings
+from app.database import sync_client
+from app.models import WebhookFailed
+
+TEST_DATABASE = "test"
+CALLBACK_URL = "http://example.com/hook"
+
+db = sync_client[TEST_DATABASE]
+
+
+class fake_celery:
+    def __init__(self):
+        self.sent = []
+
+    def send_task(self, name, args, countdown):
+        self.sent.append((name, args))
+
+
+class fake_response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+@pytest.fixture(autouse=True)
+def public_dns(monkeypatch):
+    addresses = {"example.com": ["93.184.216.34"]}
+
+    def resolve(host, port):
+        if host not in addresses:
+            raise socket.gaierror
+        return addresses[host]
+
+    monkeypatch.setattr(webhooks, "_resolve", resolve)
+    return addresses
+
+
+@pytest.fixture
+def celery(monkeypatch):
+    app = fake_celery()
+    monkeypatch.setattr(webhooks, "get_celery", lambda: app)
+    return app
+
+
+@pytest.fixture
+def sessions():
+    db.tasks.insert_one(
+        {
+            "_id": "first",
+            "callback_url": CALLBACK_URL,
+            **progress.new_session(["test", "other"]),
+        }
+    )
+    yield db.tasks
+    sync_client.drop_database(TEST_DATABASE)
+
+
+def test_schedule_coalesced(redis_server, celery):
+    webhooks.schedule_delivery("first", ["test"])
+    webhooks.schedule_delivery("first", ["other"])
+    assert celery.sent == [("deliver_webhook", ["first"])]
+
+    assert webhooks.pop_changed_users("first") == ["other", "test"]
+    # next change after delivery start schedule new delivery
+    webhooks.schedule_delivery("first", ["test"])
+    assert len(celery.sent) == 2
+
+
+def test_schedule_not_available(broken_redis_server, celery):
+    webhooks.schedule_delivery("first", ["test"])
+    assert celery.sent == []
+    assert webhooks.pop_changed_users("first") == []
+
+
+def test_deliver(monkeypatch, sessions):
+    posted = []
+
+    def mock_post(url, address, json, timeout, allow_redirects):
+        assert address == "93.184.216.34"
+        assert not allow_redirects
+        posted.append((url, json))
+        return fake_response(200)
+
+    monkeypatch.setattr(webhooks, "_post", mock_post)
+
+    webhooks.deliver("first", ["test"], collection=sessions)
+    progress.set_accounts_status(sessions, ["test", "other"], progress.STATUS_UPDATED)
+    webhooks.deliver("first", ["other"], collection=sessions)
+
+    assert posted == [
+        (
+            CALLBACK_URL,
+            {
+                "session_id": "first",
+                "event": "progress",
+                "total": 2,
+                "counters": {"new": 2},
+                "users": [{"username": "test", "status": "new"}],
+            },
+        ),
+        (
+            CALLBACK_URL,
+            {
+                "session_id": "first",
+                "event": "completed",
+                "total": 2,
+                "counters": {"new": 0, "updated": 2},
+                "users": [{"username": "other", "status": "updated"}],
+            },
+        ),
+    ]
+
+
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_deliver_retry(monkeypatch, sessions, status_code):
+    monkeypatch.setattr(webhooks, "_post", lambda *a, **k: fake_response(status_code))
+    with pytest.raises(WebhookFailed):
+        webhooks.deliver("first", ["test"], collection=sessions)
+
+
+def test_deliver_not_available(monkeypatch, sessions):
+    def mock_post(*args, **kwargs):
+        raise requests.ConnectionError
+
+    monkeypatch.setattr(webhooks, "_post", mock_post)
+    with pytest.raises(WebhookFailed):
+        webhooks.deliver("first", ["test"], collection=sessions)
+
+
+def test_deliver_rejected(monkeypatch, sessions):
+    monkeypatch.setattr(webhooks, "_post", lambda *a, **k: fake_response(404))
+    webhooks.deliver("first", ["test"], collection=sessions)
+
+
+@pytest.mark.parametrize(
+    "address, safe",
+    [
+        ("93.184.216.34", True),
+        ("2606:2800:220:1::248", True),
+        ("127.0.0.1", False),
+        ("10.0.0.5", False),
+        ("172.18.0.3", False),
+        ("192.168.1.1", False),
+        ("169.254.169.254", False),
+        ("::1", False),
+        ("fe80::1%eth0", False),
+        ("0.0.0.0", False),
+    ],
+)
+def test_is_safe_callback(public_dns, address, safe):
+    public_dns["hook.test"] = ["93.184.216.34", address]
+    assert webhooks.is_safe_callback("http://hook.test:8080/hook") is safe
+
+
+def test_is_safe_callback_host(monkeypatch, public_dns):
+    assert not webhooks.is_safe_callback("ftp://example.com/hook")
+    assert not webhooks.is_safe_callback("http://unknown.test/hook")
+
+    monkeypatch.setattr(get_settings(), "WEBHOOK_ALLOWED_HOSTS", ["hooks.test"])
+    public_dns["hooks.test"] = ["93.184.216.34"]
+    assert webhooks.is_safe_callback("https://hooks.test/hook")
+    assert not webhooks.is_safe_callback(CALLBACK_URL)
+
+
+def test_deliver_not_allowed(monkeypatch, public_dns, sessions):
+    # host resolved to internal address after session was created
+    public_dns["example.com"] = ["172.18.0.2"]
+    posted = []
+    monkeypatch.setattr(webhooks, "_post", lambda *a, **k: posted.append(a))
+
+    webhooks.deliver("first", ["test"], collection=sessions)
+    assert posted == []
+
+
+def test_deliver_redirect(monkeypatch, sessions):
+    monkeypatch.setattr(webhooks, "_post", lambda *a, **k: fake_response(302))
+    # redirect not followed and not retried
+    webhooks.deliver("first", ["test"], collection=sessions)
+
+
+def test_post_to_checked_address():
+    received = {}
+
+    class handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received["host"] = self.headers["Host"]
+            received["path"] = self.path
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.handle_request, daemon=True).start()
+    port = server.server_address[1]
+    # host not resolved again, request sent to checked address
+    response = webhooks._post(
+        f"http://rebind.test:{port}/hook?a=1", "127.0.0.1", json={}, timeout=5
+    )
+    server.server_close()
+
+    assert response.status_code == 204
+    assert received == {"host": f"rebind.test:{port}", "path": "/hook?a=1"}
+
+
+def test_pinned_adapter_tls_for_host():
+    adapter = webhooks._PinnedAdapter("example.com")
+    pool = adapter.poolmanager.connection_from_url("https://93.184.216.34/hook")
+    assert pool.conn_kw["server_hostname"] == "example.com"